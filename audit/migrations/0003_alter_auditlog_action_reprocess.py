@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audit', '0002_alter_auditlog_action'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='auditlog',
+            name='action',
+            field=models.CharField(choices=[('create', '创建'), ('update', '更新'), ('delete', '删除'), ('upload', '上传'), ('download', '下载'), ('reprocess', '重新处理'), ('extract', '抽取'), ('verify', '验证'), ('test', '测试')], max_length=20),
+        ),
+    ]
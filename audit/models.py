@@ -12,6 +12,8 @@ class AuditLog(models.Model):
     ACTION_UPDATE = 'update'
     ACTION_DELETE = 'delete'
     ACTION_UPLOAD = 'upload'
+    ACTION_DOWNLOAD = 'download'
+    ACTION_REPROCESS = 'reprocess'
     ACTION_EXTRACT = 'extract'
     ACTION_VERIFY = 'verify'
     ACTION_TEST = 'test'
@@ -21,6 +23,8 @@ class AuditLog(models.Model):
         (ACTION_UPDATE, '更新'),
         (ACTION_DELETE, '删除'),
         (ACTION_UPLOAD, '上传'),
+        (ACTION_DOWNLOAD, '下载'),
+        (ACTION_REPROCESS, '重新处理'),
         (ACTION_EXTRACT, '抽取'),
         (ACTION_VERIFY, '验证'),
         (ACTION_TEST, '测试'),
@@ -0,0 +1,32 @@
+from celery import shared_task
+from celery.utils.log import get_task_logger
+
+from audit.models import AuditLog
+
+logger = get_task_logger(__name__)
+
+
+@shared_task
+def record_audit_logs(records):
+    """
+    批量写入审计日志（在audit队列中执行）
+    records为AuditLog字段字典的列表，用户以user_id给出
+    """
+    AuditLog.objects.bulk_create([AuditLog(**record) for record in records])
+    return len(records)
+
+
+def enqueue_audit_logs(records):
+    """
+    将审计日志交给audit队列写入；消息代理不可用时改为在当前进程中直接写入
+    审计不能影响业务请求本身，同步写入也失败时只记录错误
+    """
+    try:
+        record_audit_logs.delay(records)
+        return
+    except Exception as e:
+        logger.warning(f"审计日志投递失败，改为同步写入: {str(e)}")
+    try:
+        record_audit_logs(records)
+    except Exception as e:
+        logger.error(f"审计日志写入失败: {str(e)}")
@@ -3,6 +3,11 @@ ASGI config for core project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+文档处理进度的SSE接口（documents/streams.py）是异步视图，需要以ASGI方式部署才能
+在单个进程中保持大量长连接，例如:
+    uvicorn core.asgi:application --workers 4
+在WSGI下这些接口仍可使用，但每个连接会占用一个工作线程。
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
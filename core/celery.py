@@ -1,6 +1,28 @@
+"""
+Celery应用
+
+工作进程拓扑：每类任务使用独立队列（路由见settings.CELERY_TASK_ROUTES），
+按队列分别启动工作进程，可在不同节点上独立扩缩容：
+
+    # OCR节点：CPU/内存密集，低并发、不预取，每个进程持有预热的OCR引擎
+    celery -A core worker -Q ocr -n ocr@%h
+    # 解析节点：PDF文本与Word解析，高并发
+    celery -A core worker -Q pdf_text -n pdf@%h
+    # 抽取节点：调用模型服务，受rate_limit限流
+    celery -A core worker -Q extraction -n extraction@%h
+    # 审计与其他任务，可合并到同一个轻量工作进程（此时使用命令行或全局默认参数）
+    celery -A core worker -Q audit -n audit@%h
+    celery -A core worker -Q default -n default@%h
+    # 定时任务调度（settings.CELERY_BEAT_SCHEDULE），全局只启动一个
+    celery -A core beat
+
+只消费单个队列的工作进程默认采用settings.CELERY_WORKER_QUEUE_OPTIONS中该队列的
+并发数与预取倍数，命令行参数-c/--prefetch-multiplier优先。
+"""
 from __future__ import absolute_import, unicode_literals
 import os
 from celery import Celery
+from celery.signals import celeryd_init
 
 # 设置Django settings模块
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
@@ -13,6 +35,37 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # 自动发现任务模块
 app.autodiscover_tasks()
 
+def route_preprocess_task(name, args, kwargs, options, task=None, **kw):
+    """预处理任务按文档类型路由：图像进入OCR队列，PDF与Word进入文本解析队列"""
+    if name != 'documents.tasks.preprocess_document' or 'queue' in options:
+        return None
+    
+    from django.conf import settings
+    from documents.models import Document
+    
+    document_id = args[0] if args else kwargs.get('document_id')
+    source_type = Document.objects.filter(id=document_id).values_list('source_type', flat=True).first()
+    return {'queue': settings.DOCUMENT_PREPROCESS_QUEUES.get(source_type, 'pdf_text')}
+
+@celeryd_init.connect
+def apply_queue_worker_options(sender=None, conf=None, options=None, **kwargs):
+    """只消费单个队列的工作进程使用该队列的默认并发数与预取倍数"""
+    from django.conf import settings
+    
+    queues = options.get('queues') or []
+    if isinstance(queues, str):
+        queues = queues.split(',')
+    if len(queues) != 1:
+        return
+    
+    queue_options = settings.CELERY_WORKER_QUEUE_OPTIONS.get(queues[0].strip())
+    if not queue_options:
+        return
+    if not options.get('concurrency'):
+        conf.worker_concurrency = queue_options['concurrency']
+    if not options.get('prefetch_multiplier'):
+        conf.worker_prefetch_multiplier = queue_options['prefetch_multiplier']
+
 @app.task(bind=True)
 def debug_task(self):
-    print(f'Request: {self.request!r}')
\ No newline at end of file
+    print(f'Request: {self.request!r}')
@@ -139,6 +139,179 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 
+# 任务队列与路由，各类任务由独立的工作进程消费，部署拓扑见core/celery.py
+#   ocr        图像OCR预处理（CPU/内存密集）
+#   pdf_text   PDF文本解析、PDF分片及Word解析（轻量、高吞吐）
+#   extraction 字段抽取（调用模型服务，受外部接口限流）
+#   audit      审计日志批量写入
+#   default    其他任务
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+CELERY_TASK_ROUTES = (
+    # 预处理任务按文档类型路由
+    'core.celery.route_preprocess_task',
+    {
+        'documents.tasks.process_pdf_chunk': {'queue': 'pdf_text'},
+        'documents.tasks.finalize_pdf_chunks': {'queue': 'pdf_text'},
+        'documents.tasks.ocr_health_check': {'queue': 'ocr'},
+        'extractions.tasks.extract_fields': {'queue': 'extraction'},
+        'audit.tasks.*': {'queue': 'audit'},
+    },
+)
+# 预处理任务按文档类型选择的队列
+DOCUMENT_PREPROCESS_QUEUES = {
+    'image': 'ocr',
+    'pdf': 'pdf_text',
+    'word': 'pdf_text',
+}
+# 长任务在执行完成后才确认，工作进程异常退出时任务会重新投递
+# PDF处理任务被强制终止（如OOM）后重新投递，从页面检查点继续（见documents.models.PageCheckpoint）
+CELERY_TASK_ANNOTATIONS = {
+    'documents.tasks.preprocess_document': {'acks_late': True, 'reject_on_worker_lost': True},
+    'documents.tasks.process_pdf_chunk': {'acks_late': True, 'reject_on_worker_lost': True},
+    'extractions.tasks.extract_fields': {'acks_late': True, 'rate_limit': '30/m'},
+}
+# 预处理任务（含PDF分片）的最大执行次数：工作进程反复在处理同一任务时被强制终止（如某页导致OOM）时，
+# 达到该次数后将文档标记为失败并确认消息，不再重新投递
+DOCUMENT_TASK_MAX_DELIVERIES = 3
+# 各队列工作进程的默认并发数与预取倍数
+# 工作进程只消费单个队列（-Q）且命令行未指定-c/--prefetch-multiplier时生效
+CELERY_WORKER_QUEUE_OPTIONS = {
+    'ocr': {'concurrency': 2, 'prefetch_multiplier': 1},
+    'pdf_text': {'concurrency': 8, 'prefetch_multiplier': 4},
+    'extraction': {'concurrency': 4, 'prefetch_multiplier': 1},
+    'audit': {'concurrency': 2, 'prefetch_multiplier': 16},
+    'default': {'concurrency': 2, 'prefetch_multiplier': 4},
+}
+# 定时任务（需启动 celery -A core beat）
+CELERY_BEAT_SCHEDULE = {
+    'cleanup-upload-sessions': {'task': 'documents.tasks.cleanup_upload_sessions', 'schedule': 60 * 60},
+}
+
+# 文档处理配置
+# PDF页数超过单个分片大小时，按页码区间拆分为多个子任务并行处理
+DOCUMENT_PDF_FANOUT_ENABLED = True
+# 每个分片子任务处理的页数
+DOCUMENT_PDF_CHUNK_SIZE = 50
+# 单个文档最多同时运行的分片子任务数，避免超大文档占满队列
+DOCUMENT_PDF_MAX_PARALLEL_CHUNKS = 4
+# 页面记录批量写入的批次大小（每批一个事务，同时推进页面检查点）
+DOCUMENT_PAGE_BULK_BATCH_SIZE = 50
+# PDF处理任务的常驻内存上限（MB）：超过时先释放MuPDF缓存，仍超过则提交已处理页面，
+# 剩余页面拆分为新任务继续处理；None表示不限制
+DOCUMENT_PDF_MEMORY_CEILING_MB = 1536
+# 工作子进程常驻内存超过该值（KB，与上面的上限一致）时在当前任务结束后替换为新进程，拆分出的任务在新进程中执行
+CELERY_WORKER_MAX_MEMORY_PER_CHILD = 1536 * 1024
+# 页面布局存储格式: json（逐条JSON）或 columnar（列式二进制，见documents.layout）
+DOCUMENT_LAYOUT_FORMAT = 'columnar'
+# 入库时为片段数不少于该值的页面建立网格空间索引，片段较少的页面查询时临时建立
+DOCUMENT_LAYOUT_SPATIAL_INDEX = True
+DOCUMENT_LAYOUT_INDEX_MIN_SPANS = 64
+
+# 文档文件存储（见documents/storage.py）：上传文件与页面图像按哈希分片存放
+# 后端: documents.storage.LocalDocumentStorage（本地或共享挂载目录）或 documents.storage.S3DocumentStorage
+DOCUMENT_STORAGE_BACKEND = 'documents.storage.LocalDocumentStorage'
+DOCUMENT_STORAGE_ROOT = MEDIA_ROOT
+# S3兼容对象存储配置；endpoint_url为空时使用AWS S3，也可指向MinIO等兼容服务
+DOCUMENT_STORAGE_S3 = {
+    'bucket': '',
+    'prefix': '',
+    'endpoint_url': None,
+    'region_name': None,
+    'access_key': None,
+    'secret_key': None,
+    # 分段上传的分段大小（不小于5MB）
+    'part_size': 8 * 1024 * 1024,
+    # 下载接口重定向到的预签名地址有效期（秒）
+    'url_expires': 300,
+}
+# 断点续传上传分片的暂存目录（接收分片的Web节点本地目录），上传完成后移入文档存储
+DOCUMENT_UPLOAD_TEMP_DIR = MEDIA_ROOT / 'upload_parts'
+# 未完成的上传会话超过该时长（小时）未收到分片即过期，暂存文件由cleanup_upload_sessions定时任务删除
+DOCUMENT_UPLOAD_SESSION_EXPIRE_HOURS = 24
+
+# 入库时是否渲染PDF页面图像；关闭时由page-image接口按需渲染
+DOCUMENT_PDF_RASTERIZE_ON_INGEST = False
+# 入库时保存的页面图像规格（PDF开启入库渲染时及图像文档）：每页只栅格化一次，按各规格缩放编码后写入存储
+# max_edge为长边像素上限（不放大，1600约合A4页面150DPI），format为WEBP、JPEG或PNG，quality为有损格式的编码质量（1-100）
+DOCUMENT_PAGE_IMAGE_PROFILES = {
+    'review': {'max_edge': 1600, 'format': 'WEBP', 'quality': 80},
+    'thumbnail': {'max_edge': 256, 'format': 'WEBP', 'quality': 60},
+}
+# DocumentPage.image_path指向的规格，page-image接口未指定profile时返回该规格
+DOCUMENT_PAGE_IMAGE_PRIMARY_PROFILE = 'review'
+# PDF页面相对旧版本无损PNG的节省量统计：每隔N页抽样一页额外做一次PNG编码来计算基准，
+# 其余页面按抽样页的压缩比估算；0表示不计算（图像文档的基准直接取原文件大小，不受影响）
+DOCUMENT_PAGE_IMAGE_BASELINE_SAMPLE_INTERVAL = 0
+# 按需渲染的页面图像/瓦片缓存目录及容量上限，超出后按最近最少使用淘汰
+DOCUMENT_PAGE_CACHE_DIR = MEDIA_ROOT / 'page_cache'
+DOCUMENT_PAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# 按需渲染的默认/最大DPI，以及缩放浏览时的瓦片边长（像素）
+DOCUMENT_PAGE_RENDER_DEFAULT_DPI = 150
+DOCUMENT_PAGE_RENDER_MAX_DPI = 600
+DOCUMENT_PAGE_TILE_SIZE = 512
+# 不分瓦片的整页渲染的最大像素数（约合108MB的RGB像素缓冲区），超过时需按瓦片获取，避免大幅面图纸在高DPI下占满Web进程内存
+DOCUMENT_PAGE_RENDER_MAX_PIXELS = 6000 * 6000
+
+# 文档下载交给前端Web服务器传输：None（由Django流式返回）、'x-accel-redirect'（Nginx）或'x-sendfile'（Apache）
+DOCUMENT_SENDFILE_BACKEND = None
+# X-Accel-Redirect模式下，DOCUMENT_SENDFILE_ROOT下的文件映射到Nginx internal location的URL前缀
+DOCUMENT_SENDFILE_ROOT = BASE_DIR
+DOCUMENT_SENDFILE_URL_PREFIX = '/protected/'
+
+# 文档保存时增量维护状态计数表，统计接口直接汇总计数表而不扫描文档表
+# 开启前或计数异常时执行 manage.py rebuild_document_status_counters 重建
+DOCUMENT_STATUS_COUNTERS_ENABLED = True
+
+# 上传去重：内容完全相同的文件复用已存储的文件和页面，不再重复处理
+DOCUMENT_DEDUP_ENABLED = True
+# 去重时同时复制已有的抽取结果
+DOCUMENT_DEDUP_REUSE_EXTRACTIONS = False
+
+# 文档预处理完成后是否自动使用当前激活的Prompt模板抽取字段（上传时可用auto_extract参数覆盖）
+DOCUMENT_AUTO_EXTRACT = False
+
+# 处理进度事件：预处理与抽取任务发布进度，SSE接口（需以ASGI方式部署，见core/asgi.py）推送给订阅方
+DOCUMENT_PROGRESS_ENABLED = True
+# 进度频道实现：documents.progress.RedisProgressBroker（跨进程）或LocalProgressBroker（仅当前进程，用于开发与测试）
+DOCUMENT_PROGRESS_BROKER = 'documents.progress.RedisProgressBroker'
+DOCUMENT_PROGRESS_REDIS_URL = CELERY_BROKER_URL
+# SSE连接空闲时发送心跳注释的间隔，以及单个连接的最长保持时间（超时后由浏览器EventSource自动重连）
+DOCUMENT_PROGRESS_KEEPALIVE_SECONDS = 15
+DOCUMENT_PROGRESS_STREAM_MAX_SECONDS = 30 * 60
+
+# Word文档：没有分页符时单个逻辑页的最大段落（表格）数
+DOCUMENT_WORD_PARAGRAPHS_PER_PAGE = 40
+# 是否把Word上次排版时记录的分页位置（lastRenderedPageBreak）作为分页依据
+DOCUMENT_WORD_USE_RENDERED_PAGE_BREAKS = True
+
+# OCR配置
+DOCUMENT_OCR_LANG = 'ch'
+DOCUMENT_OCR_USE_ANGLE_CLS = True
+# 每组识别选项在单个工作进程中最多创建的引擎数
+DOCUMENT_OCR_MAX_ENGINES_PER_KEY = 2
+# 多帧图像并行OCR的线程数（并发受上面的引擎数限制）
+DOCUMENT_OCR_MAX_WORKERS = 2
+# 跨调用OCR微批处理：同一工作进程内短时间窗口提交的图像合并推理
+# 适合threads/gevent并发池或多帧图像；每批最多图像数及为凑批最多额外等待的毫秒数
+DOCUMENT_OCR_BATCHING_ENABLED = False
+DOCUMENT_OCR_BATCH_MAX_SIZE = 8
+DOCUMENT_OCR_BATCH_MAX_LATENCY_MS = 50
+# OCR前的图像规范化：灰度化、裁剪空白边缘、限制最长边并纠正倾斜，识别坐标映射回原图
+DOCUMENT_OCR_NORMALIZE_ENABLED = True
+DOCUMENT_OCR_GRAYSCALE = True
+DOCUMENT_OCR_MAX_LONG_EDGE = 2000
+DOCUMENT_OCR_TRIM_BORDERS = True
+# 灰度值与白色相差超过该值的像素视为内容
+DOCUMENT_OCR_TRIM_TOLERANCE = 40
+DOCUMENT_OCR_DESKEW = True
+DOCUMENT_OCR_DESKEW_MAX_ANGLE = 5
+# 工作进程启动时预热的引擎
+DOCUMENT_OCR_WARMUP_ENGINES = [
+    {'lang': DOCUMENT_OCR_LANG, 'use_angle_cls': DOCUMENT_OCR_USE_ANGLE_CLS},
+]
+# 只有消费这些队列的工作进程在启动时预热引擎（其他队列的工作进程不加载OCR模型）
+DOCUMENT_OCR_WARMUP_QUEUES = ['ocr']
+
 # REST Framework配置
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -175,6 +348,13 @@ FILE_UPLOAD_HANDLERS = [
 # 最大上传文件大小 (50MB)
 DATA_UPLOAD_MAX_MEMORY_SIZE = 52428800
 
+# 断点续传上传的最大文件大小 (2GB)，分片直接追加写入磁盘，不受上面的限制
+DOCUMENT_RESUMABLE_UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024
+
+# 批量上传（多文件或ZIP/TAR压缩包）单批最多导入的文件数和解压后的总大小 (2GB)
+DOCUMENT_BULK_MAX_FILES = 1000
+DOCUMENT_BULK_MAX_UNPACKED_SIZE = 2 * 1024 * 1024 * 1024
+
 # 日志配置
 LOGGING = {
     'version': 1,
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class DocumentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'documents'
+    
+    def ready(self):
+        # 注册状态计数等信号处理
+        from documents import signals
+        
+        post_migrate.connect(signals.install_page_search_index, sender=self)
@@ -0,0 +1,44 @@
+"""
+批量上传的压缩包解析
+ZIP从已落盘的上传文件中按条目流式读取；TAR（含gz/bz2/xz压缩）以流模式顺序读取，
+条目内容都以文件对象的形式交给调用方分块写出，不会把整个压缩包读入内存。
+"""
+import os
+import tarfile
+import zipfile
+
+ZIP_EXTENSIONS = ('.zip',)
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+def is_archive(filename):
+    name = filename.lower()
+    return name.endswith(ZIP_EXTENSIONS) or name.endswith(TAR_EXTENSIONS)
+
+
+def _is_hidden(name):
+    """跳过目录占位、macOS资源分支等非文档条目"""
+    parts = name.replace('\\', '/').split('/')
+    return any(part.startswith('.') or part == '__MACOSX' for part in parts if part)
+
+
+def iter_archive_entries(file_obj, filename):
+    """
+    逐个产出压缩包中的(文件名, 可读文件对象)
+    文件名只保留条目的基本名，不使用条目中的目录结构；文件对象只在下一次迭代前有效
+    """
+    if filename.lower().endswith(ZIP_EXTENSIONS):
+        with zipfile.ZipFile(file_obj) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or _is_hidden(info.filename):
+                    continue
+                with archive.open(info) as stream:
+                    yield os.path.basename(info.filename), stream
+        return
+
+    with tarfile.open(fileobj=file_obj, mode='r|*') as archive:
+        for member in archive:
+            if not member.isfile() or _is_hidden(member.name):
+                continue
+            stream = archive.extractfile(member)
+            yield os.path.basename(member.name), stream
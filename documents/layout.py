@@ -0,0 +1,112 @@
+"""
+页面布局的列式二进制存储
+PDF/OCR页面的布局是大量形如{'text', 'bbox', 'size'}的文本片段，逐条存JSON体积大、解析慢。
+列式格式把bbox存为float32数组(n, 4)，其余数值字段各存一列float32，
+全部文本拼接为一个UTF-8缓冲区并记录偏移量，读取时用NumPy按需解码。
+
+二进制布局:
+    b'LAY1' | uint32 头部长度 | 头部JSON {"count": n, "columns": [...]}
+    | bbox float32[n*4] | 各数值列 float32[n] | 文本偏移 uint32[n+1] | 文本UTF-8字节
+"""
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'LAY1'
+HEADER = struct.Struct('<4sI')
+
+
+def _rounded(values):
+    return np.round(values.astype(np.float64), 4).tolist()
+
+
+class ColumnarLayout:
+    """列式布局，数组直接引用原始字节缓冲区，不做逐条解析"""
+
+    def __init__(self, bboxes, columns, offsets, text_buffer):
+        self.bboxes = bboxes
+        self.columns = columns
+        self.offsets = offsets
+        self.text_buffer = text_buffer
+
+    def __len__(self):
+        return len(self.bboxes)
+
+    @classmethod
+    def from_spans(cls, spans):
+        """
+        由文本片段列表构建列式布局
+        各片段必须只含text、长度为4的bbox以及相同的数值字段，否则返回None（仍按JSON存储）
+        """
+        if not spans:
+            return None
+        names = sorted(set(spans[0]) - {'text', 'bbox'})
+        encoded = []
+        for span in spans:
+            if set(span) != {'text', 'bbox', *names} or len(span['bbox']) != 4:
+                return None
+            if not all(isinstance(span[name], (int, float)) for name in names):
+                return None
+            encoded.append(span['text'].encode('utf-8'))
+
+        offsets = np.zeros(len(spans) + 1, dtype=np.uint32)
+        np.cumsum([len(text) for text in encoded], out=offsets[1:])
+        return cls(
+            np.array([span['bbox'] for span in spans], dtype=np.float32),
+            {name: np.array([span[name] for span in spans], dtype=np.float32) for name in names},
+            offsets,
+            b''.join(encoded),
+        )
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        magic, header_length = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("无法识别的布局数据格式")
+        position = HEADER.size
+        header = json.loads(data[position:position + header_length])
+        position += header_length
+
+        count = header['count']
+        bboxes = np.frombuffer(data, dtype=np.float32, count=count * 4, offset=position).reshape(count, 4)
+        position += bboxes.nbytes
+        columns = {}
+        for name in header['columns']:
+            columns[name] = np.frombuffer(data, dtype=np.float32, count=count, offset=position)
+            position += columns[name].nbytes
+        offsets = np.frombuffer(data, dtype=np.uint32, count=count + 1, offset=position)
+        position += offsets.nbytes
+        return cls(bboxes, columns, offsets, memoryview(data)[position:])
+
+    def to_bytes(self):
+        header = json.dumps({'count': len(self), 'columns': list(self.columns)}).encode('utf-8')
+        parts = [HEADER.pack(MAGIC, len(header)), header, self.bboxes.astype('<f4').tobytes()]
+        parts.extend(column.astype('<f4').tobytes() for column in self.columns.values())
+        parts.append(self.offsets.astype('<u4').tobytes())
+        parts.append(bytes(self.text_buffer))
+        return b''.join(parts)
+
+    def text(self, index):
+        return bytes(self.text_buffer[self.offsets[index]:self.offsets[index + 1]]).decode('utf-8')
+
+    def span(self, index):
+        """解码单个片段"""
+        return {
+            'text': self.text(index),
+            'bbox': _rounded(self.bboxes[index]),
+            **{name: _rounded(column[index]) for name, column in self.columns.items()},
+        }
+
+    def texts(self):
+        return [self.text(index) for index in range(len(self))]
+
+    def to_list(self):
+        """还原为与layout_json相同结构的字典列表（数值保留到float32的有效精度）"""
+        bboxes = _rounded(self.bboxes)
+        columns = {name: _rounded(column) for name, column in self.columns.items()}
+        return [
+            {'text': text, 'bbox': bbox, **{name: values[index] for name, values in columns.items()}}
+            for index, (text, bbox) in enumerate(zip(self.texts(), bboxes))
+        ]
@@ -0,0 +1,60 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from documents.layout import ColumnarLayout
+
+
+class Command(BaseCommand):
+    """
+    页面布局存储格式基准测试
+    生成密集页面的文本片段，对比JSON与列式二进制格式的存储大小和编解码耗时。
+    """
+    help = '对比页面布局JSON与列式二进制格式的大小与编解码耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spans', type=int, default=20000, help='单页文本片段数')
+        parser.add_argument('--repeat', type=int, default=5, help='重复次数')
+
+    def handle(self, *args, **options):
+        spans = self._build_spans(options['spans'])
+        repeat = options['repeat']
+
+        json_data = json.dumps(spans, ensure_ascii=False).encode('utf-8')
+        blob = ColumnarLayout.from_spans(spans).to_bytes()
+
+        timings = {
+            'JSON编码': self._time(lambda: json.dumps(spans, ensure_ascii=False), repeat),
+            'JSON解码': self._time(lambda: json.loads(json_data), repeat),
+            '列式编码': self._time(lambda: ColumnarLayout.from_spans(spans).to_bytes(), repeat),
+            '列式加载（数组视图）': self._time(lambda: ColumnarLayout.from_bytes(blob), repeat),
+            '列式还原为JSON结构': self._time(lambda: ColumnarLayout.from_bytes(blob).to_list(), repeat),
+        }
+
+        self.stdout.write(f"片段数: {len(spans)}")
+        self.stdout.write(f"JSON大小: {len(json_data) / 1024:.1f} KB")
+        self.stdout.write(f"列式大小: {len(blob) / 1024:.1f} KB")
+        for name, seconds in timings.items():
+            self.stdout.write(f"{name}: {seconds * 1000:.2f} ms")
+        self.stdout.write(self.style.SUCCESS(f"体积缩减: {len(json_data) / len(blob):.2f}x"))
+
+    def _time(self, func, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        return (time.perf_counter() - started) / repeat
+
+    def _build_spans(self, count):
+        """模拟PyMuPDF输出的密集页面片段"""
+        words = ['保险合同', '被保险人', '保单号', 'P00012345', '投保单', '金额', '100.00', '条款']
+        spans = []
+        for index in range(count):
+            x, y = 72 + (index % 20) * 24.37, 72 + (index // 20) * 0.71
+            spans.append({
+                'text': random.choice(words),
+                'bbox': [x, y, x + 23.91, y + 10.53],
+                'size': random.choice([9.0, 10.0, 10.5, 16.0]),
+            })
+        return spans
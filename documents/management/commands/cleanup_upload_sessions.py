@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from documents.tasks import cleanup_upload_sessions
+
+
+class Command(BaseCommand):
+    """未部署celery beat时可由cron定时执行"""
+    help = '清理过期的断点续传上传会话及暂存文件'
+    
+    def handle(self, *args, **options):
+        result = cleanup_upload_sessions()
+        self.stdout.write(self.style.SUCCESS(f"已清理过期上传会话 {result['expired']} 个，孤立暂存文件 {result['orphaned']} 个"))
@@ -0,0 +1,84 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from documents.models import Document, DocumentPage
+from documents.storage import get_document_storage, read_chunks, upload_name
+
+
+class Command(BaseCommand):
+    """
+    将旧版本写在本地目录中的文档文件迁入文档存储
+    旧版本的上传文件相对Web进程当前目录保存（uploads/YYYYMMDD/...），页面图像相对MEDIA_ROOT保存；
+    存储中缺失的上传文件复制到新的分片存储名并更新storage_path，缺失的页面图像按原存储名复制。
+    迁移成功后旧文件保留，确认无误后可手动删除。
+    """
+    help = '将旧版本本地目录中的上传文件与页面图像迁入文档存储'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--legacy-root', default=str(settings.BASE_DIR),
+                            help='旧版本保存上传文件的目录（Web进程的当前目录）')
+        parser.add_argument('--dry-run', action='store_true', help='只列出需要迁移的文件，不复制、不更新数据库')
+    
+    def handle(self, *args, **options):
+        self.storage = get_document_storage()
+        self.roots = [options['legacy_root'], str(settings.MEDIA_ROOT)]
+        self.dry_run = options['dry_run']
+        
+        moved, missing = self._migrate_uploads()
+        pages_moved, pages_missing = self._migrate_page_images()
+        
+        prefix = "需迁移" if self.dry_run else "已迁移"
+        self.stdout.write(f"{prefix}上传文件 {moved} 个，页面图像 {pages_moved} 个")
+        if missing or pages_missing:
+            self.stdout.write(self.style.WARNING(f"未找到源文件: 上传文件 {missing} 个，页面图像 {pages_missing} 个"))
+        else:
+            self.stdout.write(self.style.SUCCESS("迁移完成"))
+    
+    def _legacy_path(self, name):
+        for root in self.roots:
+            path = os.path.join(root, name)
+            if os.path.isfile(path):
+                return path
+        return None
+    
+    def _copy(self, name, source_path):
+        with open(source_path, 'rb') as f:
+            self.storage.write(name, read_chunks(f))
+    
+    def _migrate_uploads(self):
+        moved = missing = 0
+        # 重复上传复用同一文件，多个文档可能共用一个storage_path
+        paths = Document.objects.exclude(storage_path='').values_list('storage_path', flat=True).distinct()
+        for old_path in paths.iterator():
+            if self.storage.exists(old_path):
+                continue
+            source_path = self._legacy_path(old_path)
+            if source_path is None:
+                missing += 1
+                self.stdout.write(self.style.WARNING(f"未找到: {old_path}"))
+                continue
+            
+            new_path = upload_name(old_path)
+            self.stdout.write(f"{old_path} -> {new_path}")
+            if not self.dry_run:
+                self._copy(new_path, source_path)
+                Document.objects.filter(storage_path=old_path).update(storage_path=new_path)
+            moved += 1
+        return moved, missing
+    
+    def _migrate_page_images(self):
+        moved = missing = 0
+        names = DocumentPage.objects.exclude(image_path='').values_list('image_path', flat=True)
+        for name in names.iterator():
+            if self.storage.exists(name):
+                continue
+            source_path = self._legacy_path(name)
+            if source_path is None:
+                missing += 1
+                continue
+            if not self.dry_run:
+                self._copy(name, source_path)
+            moved += 1
+        return moved, missing
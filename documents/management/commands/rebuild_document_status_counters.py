@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from documents.models import DocumentStatusCounter
+
+
+class Command(BaseCommand):
+    """根据文档表全量重建状态计数表"""
+    help = '全量重建文档状态计数表'
+    
+    def handle(self, *args, **options):
+        DocumentStatusCounter.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"已重建 {DocumentStatusCounter.objects.count()} 条状态计数"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from documents.search import install_search_index, search_index_available
+
+
+class Command(BaseCommand):
+    """根据页面表全量重建全文索引，并补建同步触发器"""
+    help = '全量重建文档页面全文索引'
+    
+    def handle(self, *args, **options):
+        if not search_index_available():
+            raise CommandError("当前数据库后端不支持全文索引，检索将使用LIKE匹配")
+        install_search_index(rebuild=True)
+        self.stdout.write(self.style.SUCCESS("已重建页面全文索引"))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='文件内容SHA-256摘要', max_length=64),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_status_counters(apps, schema_editor):
+    Document = apps.get_model('documents', 'Document')
+    DocumentStatusCounter = apps.get_model('documents', 'DocumentStatusCounter')
+    rows = Document.objects.values('status', 'source_type', 'uploaded_by').annotate(total=models.Count('id'))
+    DocumentStatusCounter.objects.bulk_create([
+        DocumentStatusCounter(status=row['status'], source_type=row['source_type'], uploaded_by_id=row['uploaded_by'], count=row['total'])
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0003_uploadsession'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentStatusCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(max_length=20)),
+                ('source_type', models.CharField(max_length=20)),
+                ('count', models.BigIntegerField(default=0)),
+                ('uploaded_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'source_type', 'uploaded_by'], name='documents_d_status_ef4160_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_status_counters, migrations.RunPython.noop),
+    ]
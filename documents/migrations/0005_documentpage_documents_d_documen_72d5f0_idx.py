@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_documentstatuscounter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='documentpage',
+            index=models.Index(fields=['document', 'page_num'], name='documents_d_documen_72d5f0_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_documentpage_documents_d_documen_72d5f0_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentpage',
+            name='ocr_confidence',
+            field=models.FloatField(blank=True, help_text='OCR识别的平均置信度', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0006_documentpage_ocr_confidence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='processing_metrics',
+            field=models.JSONField(blank=True, help_text='处理过程统计（耗时、节省量等）', null=True),
+        ),
+    ]
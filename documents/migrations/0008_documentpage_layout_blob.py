@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0007_document_processing_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentpage',
+            name='layout_blob',
+            field=models.BinaryField(blank=True, help_text='列式二进制布局，见documents.layout', null=True),
+        ),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations
+
+
+class SQLiteRunSQL(migrations.RunSQL):
+    """只在SQLite上执行的RunSQL；其他数据库后端没有FTS5，页面检索退化为LIKE匹配"""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'sqlite':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'sqlite':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0008_documentpage_layout_blob'),
+    ]
+
+    operations = [
+        SQLiteRunSQL(
+            sql=[
+                """CREATE VIRTUAL TABLE IF NOT EXISTS documents_page_fts USING fts5(
+                    text, content='documents_documentpage', content_rowid='id', tokenize='trigram'
+                )""",
+                """CREATE TRIGGER IF NOT EXISTS documents_page_fts_ai AFTER INSERT ON documents_documentpage BEGIN
+                    INSERT INTO documents_page_fts(rowid, text) VALUES (new.id, new.text);
+                END""",
+                """CREATE TRIGGER IF NOT EXISTS documents_page_fts_ad AFTER DELETE ON documents_documentpage BEGIN
+                    INSERT INTO documents_page_fts(documents_page_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                END""",
+                """CREATE TRIGGER IF NOT EXISTS documents_page_fts_au AFTER UPDATE OF text ON documents_documentpage BEGIN
+                    INSERT INTO documents_page_fts(documents_page_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                    INSERT INTO documents_page_fts(rowid, text) VALUES (new.id, new.text);
+                END""",
+                # 为已有页面建立索引
+                "INSERT INTO documents_page_fts(documents_page_fts) VALUES ('rebuild')",
+            ],
+            reverse_sql=[
+                "DROP TRIGGER IF EXISTS documents_page_fts_ai",
+                "DROP TRIGGER IF EXISTS documents_page_fts_ad",
+                "DROP TRIGGER IF EXISTS documents_page_fts_au",
+                "DROP TABLE IF EXISTS documents_page_fts",
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0009_page_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentpage',
+            name='layout_index',
+            field=models.BinaryField(blank=True, help_text='布局片段的网格空间索引，见documents.spatial', null=True),
+        ),
+    ]
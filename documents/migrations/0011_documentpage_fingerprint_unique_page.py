@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:14
+
+from django.db import migrations, models
+
+
+def remove_duplicate_pages(apps, schema_editor):
+    """重复处理遗留的同页码记录只保留最新写入的一条"""
+    DocumentPage = apps.get_model('documents', 'DocumentPage')
+    duplicates = (
+        DocumentPage.objects.values('document', 'page_num')
+        .annotate(latest=models.Max('id'), total=models.Count('id'))
+        .filter(total__gt=1)
+    )
+    for row in list(duplicates):
+        DocumentPage.objects.filter(document=row['document'], page_num=row['page_num'], id__lt=row['latest']).delete()
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0010_documentpage_layout_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_pages, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='documentpage',
+            name='documents_d_documen_72d5f0_idx',
+        ),
+        migrations.AddField(
+            model_name='documentpage',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', help_text='页面源内容与处理流程版本、选项的摘要', max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='documentpage',
+            constraint=models.UniqueConstraint(fields=('document', 'page_num'), name='unique_document_page'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0012_uploadbatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PageCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.CharField(max_length=255, unique=True)),
+                ('next_page', models.IntegerField(help_text='下一个待处理的页码（从0开始）')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='documents.document')),
+            ],
+        ),
+    ]
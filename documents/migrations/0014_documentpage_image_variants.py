@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0013_pagecheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentpage',
+            name='image_baseline_bytes',
+            field=models.BigIntegerField(blank=True, help_text='按旧版本无损PNG输出该页面图像时的字节数，用于统计节省量', null=True),
+        ),
+        migrations.AddField(
+            model_name='documentpage',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, help_text='各输出规格的页面图像{规格: {name, format, bytes, width, height}}'),
+        ),
+    ]
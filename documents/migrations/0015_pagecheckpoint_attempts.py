@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0014_documentpage_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pagecheckpoint',
+            name='attempts',
+            field=models.PositiveIntegerField(default=1, help_text='任务的执行次数（含重新投递）'),
+        ),
+        migrations.AlterField(
+            model_name='pagecheckpoint',
+            name='next_page',
+            field=models.IntegerField(default=0, help_text='下一个待处理的页码（从0开始）'),
+        ),
+    ]
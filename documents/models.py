@@ -1,7 +1,11 @@
 from django.db import models
+from django.conf import settings
 from django.contrib.auth import get_user_model
 import uuid
 
+from documents.layout import ColumnarLayout
+from documents.spatial import PageSpans, SpanGridIndex
+
 User = get_user_model()
 
 class Document(models.Model):
@@ -13,9 +17,26 @@ class Document(models.Model):
     uploaded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='uploaded_documents')
     created_at = models.DateTimeField(auto_now_add=True)
     storage_path = models.TextField()
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True, help_text="文件内容SHA-256摘要")
+    processing_metrics = models.JSONField(null=True, blank=True, help_text="处理过程统计（耗时、节省量等）")
+    batch = models.ForeignKey('UploadBatch', on_delete=models.SET_NULL, null=True, blank=True, related_name='documents')
     
     def __str__(self):
         return f"{self.filename} ({self.source_type})"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 记录加载时的统计维度，保存时据此增量维护状态计数
+        instance._counter_key = instance.counter_key()
+        return instance
+    
+    def counter_key(self):
+        """状态计数表的统计维度（未加载的字段返回None）"""
+        loaded = self.__dict__
+        if not all(name in loaded for name in ('status', 'source_type', 'uploaded_by_id')):
+            return None
+        return (self.status, self.source_type, self.uploaded_by_id)
 
 class DocumentPage(models.Model):
     """文档页面模型"""
@@ -24,6 +45,148 @@ class DocumentPage(models.Model):
     text = models.TextField()
     image_path = models.TextField()
     layout_json = models.JSONField(null=True, blank=True)
+    layout_blob = models.BinaryField(null=True, blank=True, help_text="列式二进制布局，见documents.layout")
+    layout_index = models.BinaryField(null=True, blank=True, help_text="布局片段的网格空间索引，见documents.spatial")
+    ocr_confidence = models.FloatField(null=True, blank=True, help_text="OCR识别的平均置信度")
+    fingerprint = models.CharField(max_length=64, blank=True, default='', help_text="页面源内容与处理流程版本、选项的摘要")
+    image_variants = models.JSONField(default=dict, blank=True, help_text="各输出规格的页面图像{规格: {name, format, bytes, width, height}}")
+    image_baseline_bytes = models.BigIntegerField(null=True, blank=True, help_text="按旧版本无损PNG输出该页面图像时的字节数，用于统计节省量")
     
     def __str__(self):
         return f"{self.document.filename} - 第{self.page_num}页"
+    
+    def set_layout(self, layout_data):
+        """
+        按DOCUMENT_LAYOUT_FORMAT保存布局，片段结构不适合列式存储时仍保存为JSON
+        片段数较多的页面同时建立空间索引
+        """
+        columnar = ColumnarLayout.from_spans(layout_data)
+        if columnar is not None and settings.DOCUMENT_LAYOUT_FORMAT == 'columnar':
+            self.layout_json, self.layout_blob = None, columnar.to_bytes()
+        else:
+            self.layout_json, self.layout_blob = layout_data, None
+        
+        self.layout_index = self._spans = None
+        if columnar is not None and settings.DOCUMENT_LAYOUT_SPATIAL_INDEX and len(columnar) >= settings.DOCUMENT_LAYOUT_INDEX_MIN_SPANS:
+            self.layout_index = SpanGridIndex.build(columnar.bboxes).to_bytes()
+    
+    def columnar_layout(self):
+        """列式布局对象，未以列式存储时返回None"""
+        if self.layout_blob is None:
+            return None
+        return ColumnarLayout.from_bytes(self.layout_blob)
+    
+    def span_layout(self):
+        """以列式结构访问片段布局，布局不是片段列表（如Word段落）时返回None"""
+        return self.columnar_layout() or ColumnarLayout.from_spans(self.layout_json or [])
+    
+    def spans(self):
+        """
+        片段布局及其空间索引，用于区域与最近邻查询
+        未保存索引（片段较少或旧数据）时在内存中临时建立；结果缓存在实例上
+        """
+        if getattr(self, '_spans', None) is None:
+            layout = self.span_layout()
+            if layout is None:
+                return None
+            if self.layout_index is not None:
+                index = SpanGridIndex.from_bytes(self.layout_index, layout.bboxes)
+            else:
+                index = SpanGridIndex.build(layout.bboxes)
+            self._spans = PageSpans(layout, index)
+        return self._spans
+    
+    def get_layout(self):
+        """返回JSON结构的布局，无论其存储格式"""
+        if self.layout_blob is not None:
+            return self.columnar_layout().to_list()
+        return self.layout_json
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'page_num'], name='unique_document_page'),
+        ]
+
+class UploadSession(models.Model):
+    """断点续传上传会话，已接收的偏移量持久化在数据库中，服务重启后可继续上传"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    filename = models.CharField(max_length=255)
+    total_size = models.BigIntegerField(help_text="文件总字节数")
+    offset = models.BigIntegerField(default=0, help_text="已接收的字节数")
+    status = models.CharField(max_length=20, default='uploading')  # uploading, finalizing, completed, failed, expired
+    temp_path = models.TextField(help_text="分片追加写入的临时文件路径")
+    document = models.ForeignKey(Document, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload_sessions')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='upload_sessions')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.total_size})"
+
+class UploadBatch(models.Model):
+    """批量上传批次，批次内文档通过Document.batch关联，用于查询整体处理进度"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='upload_batches')
+    created_at = models.DateTimeField(auto_now_add=True)
+    file_count = models.IntegerField(default=0, help_text="批次中创建的文档数")
+    skipped = models.JSONField(default=list, blank=True, help_text="未导入的文件及原因")
+    
+    def __str__(self):
+        return f"批次 {self.id} ({self.file_count}个文件)"
+
+class PageCheckpoint(models.Model):
+    """
+    预处理任务检查点
+    任务开始执行时创建，正常结束、失败或被替换时删除；任务开始时检查点已存在，说明上一次执行中工作进程被强制终止，
+    本次是重新投递（任务ID不变），attempts累加，超过上限时不再处理。
+    PDF页面批量写入（含跳过未变化的页面）时在同一事务中推进next_page，重新投递时从next_page继续
+    """
+    task_id = models.CharField(max_length=255, unique=True)
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='checkpoints')
+    next_page = models.IntegerField(default=0, help_text="下一个待处理的页码（从0开始）")
+    attempts = models.PositiveIntegerField(default=1, help_text="任务的执行次数（含重新投递）")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.document_id} @ {self.next_page}"
+
+class DocumentStatusCounter(models.Model):
+    """
+    文档状态计数表
+    按(状态, 文档类型, 上传用户)维护文档数量，Document保存或删除时增量更新，
+    统计接口汇总该表即可，无需扫描文档表
+    """
+    status = models.CharField(max_length=20)
+    source_type = models.CharField(max_length=20)
+    uploaded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
+    count = models.BigIntegerField(default=0)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'source_type', 'uploaded_by']),
+        ]
+    
+    def __str__(self):
+        return f"{self.status}/{self.source_type}/{self.uploaded_by_id}: {self.count}"
+    
+    @classmethod
+    def adjust(cls, status, source_type, uploaded_by_id, delta):
+        """调整某一维度组合的计数"""
+        if not delta:
+            return
+        updated = cls.objects.filter(
+            status=status, source_type=source_type, uploaded_by_id=uploaded_by_id
+        ).update(count=models.F('count') + delta)
+        if not updated:
+            # 并发时可能产生同一维度的多行，汇总时按维度求和，结果不受影响
+            cls.objects.create(status=status, source_type=source_type, uploaded_by_id=uploaded_by_id, count=delta)
+    
+    @classmethod
+    def rebuild(cls):
+        """根据文档表全量重建计数"""
+        rows = Document.objects.values('status', 'source_type', 'uploaded_by').annotate(total=models.Count('id'))
+        cls.objects.all().delete()
+        cls.objects.bulk_create([
+            cls(status=row['status'], source_type=row['source_type'], uploaded_by_id=row['uploaded_by'], count=row['total'])
+            for row in rows
+        ])
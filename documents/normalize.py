@@ -0,0 +1,107 @@
+"""
+OCR前的图像规范化
+依次执行灰度化、裁剪空白边缘、按最长边缩小和倾斜校正，
+并记录坐标变换，使识别得到的坐标可以映射回原图坐标系。
+"""
+import math
+
+import numpy as np
+from django.conf import settings
+from PIL import Image, ImageOps
+
+
+class ImageTransform:
+    """规范化图像坐标到原图坐标的变换：先反向旋转，再反向缩放，最后加上裁剪偏移"""
+
+    def __init__(self, offset=(0, 0), scale=1.0, angle=0.0, center=(0, 0)):
+        self.offset = offset
+        self.scale = scale
+        self.angle = angle
+        self.center = center
+
+    def to_original(self, x, y):
+        if self.angle:
+            theta = math.radians(self.angle)
+            cx, cy = self.center
+            dx, dy = x - cx, y - cy
+            x = cx + dx * math.cos(theta) - dy * math.sin(theta)
+            y = cy + dx * math.sin(theta) + dy * math.cos(theta)
+        return x / self.scale + self.offset[0], y / self.scale + self.offset[1]
+
+
+def trim_borders(image, tolerance):
+    """裁剪接近白色的空白边缘，返回(裁剪后图像, 左上角偏移)"""
+    gray = image if image.mode == 'L' else image.convert('L')
+    mask = ImageOps.invert(gray).point(lambda value: 255 if value > tolerance else 0)
+    bbox = mask.getbbox()
+    if not bbox or bbox == (0, 0) + image.size:
+        return image, (0, 0)
+
+    # 保留少量边距，避免裁到贴边的笔画
+    margin = 8
+    left, top = max(0, bbox[0] - margin), max(0, bbox[1] - margin)
+    right, bottom = min(image.width, bbox[2] + margin), min(image.height, bbox[3] + margin)
+    return image.crop((left, top, right, bottom)), (left, top)
+
+
+def estimate_skew(image, max_angle):
+    """
+    基于投影轮廓估计倾斜角度（度，逆时针为正）
+    在缩略图上先按1度粗搜，再在最佳角度附近按0.2度细搜，取行投影方差最大的角度
+    """
+    gray = image if image.mode == 'L' else image.convert('L')
+    thumb = gray.copy()
+    thumb.thumbnail((800, 800))
+    ink = ImageOps.invert(thumb)
+
+    def score(angle):
+        rotated = np.asarray(ink.rotate(angle, resample=Image.BILINEAR), dtype=np.float32)
+        return float(np.var(rotated.sum(axis=1)))
+
+    best = max(np.arange(-max_angle, max_angle + 0.5, 1.0), key=score)
+    best = max(np.arange(best - 1.0, best + 1.01, 0.2), key=score)
+    return float(round(best, 2))
+
+
+def normalize_for_ocr(image):
+    """
+    按DOCUMENT_OCR_*配置规范化图像
+    返回(BGR数组, ImageTransform, 统计信息)，统计信息包含处理前后的像素数和倾斜角度
+    """
+    original_pixels = image.width * image.height
+    offset = (0, 0)
+    scale = 1.0
+    angle = 0.0
+
+    image = image.convert('L') if settings.DOCUMENT_OCR_GRAYSCALE else image.convert('RGB')
+
+    if settings.DOCUMENT_OCR_TRIM_BORDERS:
+        image, offset = trim_borders(image, settings.DOCUMENT_OCR_TRIM_TOLERANCE)
+
+    long_edge = max(image.size)
+    if settings.DOCUMENT_OCR_MAX_LONG_EDGE and long_edge > settings.DOCUMENT_OCR_MAX_LONG_EDGE:
+        scale = settings.DOCUMENT_OCR_MAX_LONG_EDGE / long_edge
+        image = image.resize(
+            (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+            Image.LANCZOS
+        )
+
+    if settings.DOCUMENT_OCR_DESKEW:
+        angle = estimate_skew(image, settings.DOCUMENT_OCR_DESKEW_MAX_ANGLE)
+        if angle:
+            fill = 255 if image.mode == 'L' else (255, 255, 255)
+            image = image.rotate(angle, resample=Image.BICUBIC, fillcolor=fill)
+
+    array = np.asarray(image)
+    if array.ndim == 2:
+        array = np.repeat(array[:, :, None], 3, axis=2)
+    else:
+        array = np.ascontiguousarray(array[:, :, ::-1])
+
+    transform = ImageTransform(offset, scale, angle, (image.width / 2, image.height / 2))
+    stats = {
+        'pixels_before': original_pixels,
+        'pixels_after': image.width * image.height,
+        'skew_angle': angle,
+    }
+    return array, transform, stats
@@ -0,0 +1,302 @@
+"""
+OCR引擎池
+每个Celery工作进程启动时创建并预热PaddleOCR引擎，按(lang, use_angle_cls)分组复用，
+避免每张图像都重新加载检测、方向分类和识别模型。
+模型加载耗时与推理耗时分别统计，可通过health()查看。
+
+OCRBatcher在同一工作进程内把短时间窗口内多次调用提交的图像合并成一批，
+检测逐张进行，方向分类和文字识别对所有图像的文本行一次批量推理。
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from celery import current_app
+from celery.signals import worker_process_init
+from celery.utils.log import get_task_logger
+from django.conf import settings
+
+logger = get_task_logger(__name__)
+
+
+class OCREnginePool:
+    """按识别选项分组的PaddleOCR引擎池（线程安全）"""
+
+    def __init__(self, max_engines_per_key=None):
+        self._max_engines_per_key = max_engines_per_key
+        self._condition = threading.Condition()
+        self._idle = {}
+        self._created = {}
+        self._metrics = {}
+
+    @property
+    def max_engines_per_key(self):
+        return max(1, self._max_engines_per_key or settings.DOCUMENT_OCR_MAX_ENGINES_PER_KEY)
+
+    @contextmanager
+    def engine(self, lang='ch', use_angle_cls=True):
+        """借出一个引擎，用完自动归还；引擎数达到上限时等待其他任务归还"""
+        key = (lang, bool(use_angle_cls))
+        engine = self._acquire(key)
+        try:
+            yield engine
+        finally:
+            with self._condition:
+                self._idle[key].append(engine)
+                self._condition.notify()
+
+    def ocr(self, image, lang='ch', use_angle_cls=True):
+        """识别单张图像（路径或数组），记录推理耗时"""
+        with self.engine(lang, use_angle_cls) as engine:
+            started = time.perf_counter()
+            result = engine.ocr(image, cls=use_angle_cls)
+            self.record((lang, bool(use_angle_cls)), 'inference', time.perf_counter() - started)
+        return result
+
+    def warm_up(self, lang='ch', use_angle_cls=True):
+        """创建引擎并用空白图像跑一次推理，使首个真实任务不再承担初始化开销"""
+        import numpy as np
+
+        blank = np.full((32, 32, 3), 255, dtype=np.uint8)
+        with self.engine(lang, use_angle_cls) as engine:
+            engine.ocr(blank, cls=use_angle_cls)
+
+    def health(self):
+        """返回各引擎分组的数量与耗时统计"""
+        with self._condition:
+            return {
+                f"{lang}{'+cls' if use_angle_cls else ''}": {
+                    'engines': self._created.get((lang, use_angle_cls), 0),
+                    'idle': len(self._idle.get((lang, use_angle_cls), [])),
+                    **metrics,
+                }
+                for (lang, use_angle_cls), metrics in self._metrics.items()
+            }
+
+    def _acquire(self, key):
+        with self._condition:
+            while True:
+                idle = self._idle.setdefault(key, [])
+                if idle:
+                    return idle.pop()
+                if self._created.get(key, 0) < self.max_engines_per_key:
+                    # 先占位再在锁外加载模型，避免阻塞其他分组
+                    self._created[key] = self._created.get(key, 0) + 1
+                    break
+                self._condition.wait()
+
+        try:
+            return self._create(key)
+        except Exception:
+            with self._condition:
+                self._created[key] -= 1
+                self._condition.notify()
+            raise
+
+    def _create(self, key):
+        # 延迟导入PaddleOCR
+        from paddleocr import PaddleOCR
+
+        lang, use_angle_cls = key
+        started = time.perf_counter()
+        engine = PaddleOCR(use_angle_cls=use_angle_cls, lang=lang)
+        elapsed = time.perf_counter() - started
+        self.record(key, 'load', elapsed)
+        logger.info(f"OCR引擎加载完成: lang={lang}, use_angle_cls={use_angle_cls}, 耗时{elapsed:.2f}秒")
+        return engine
+
+    def record(self, key, kind, seconds):
+        with self._condition:
+            metrics = self._metrics.setdefault(key, {
+                'load_count': 0,
+                'load_seconds': 0.0,
+                'inference_count': 0,
+                'inference_seconds': 0.0,
+            })
+            metrics[f'{kind}_count'] += 1
+            metrics[f'{kind}_seconds'] += seconds
+
+
+def load_bgr_image(image):
+    """将图像路径转换为PaddleOCR使用的BGR数组，数组原样返回"""
+    if not isinstance(image, str):
+        return image
+
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(image) as img:
+        return np.ascontiguousarray(np.array(img.convert('RGB'))[:, :, ::-1])
+
+
+def ocr_batch(engine, images, use_angle_cls=True):
+    """
+    对多张图像批量识别，返回与images一一对应的识别结果（格式同engine.ocr()的单图结果）
+    检测逐张执行；所有图像的文本行合并后一次送入方向分类和识别模型。
+    引擎不提供分阶段接口时退化为逐张调用engine.ocr()
+    """
+    if not all(hasattr(engine, name) for name in ('text_detector', 'text_recognizer')):
+        return [(engine.ocr(image, cls=use_angle_cls) or [None])[0] for image in images]
+
+    import copy
+    from paddleocr.tools.infer.predict_system import sorted_boxes
+    from paddleocr.tools.infer.utility import get_rotate_crop_image
+
+    crops = []
+    owners = []
+    for index, image in enumerate(images):
+        image = load_bgr_image(image)
+        dt_boxes, _ = engine.text_detector(image)
+        if dt_boxes is None:
+            continue
+        for box in sorted_boxes(dt_boxes):
+            crops.append(get_rotate_crop_image(image, copy.deepcopy(box)))
+            owners.append((index, box))
+
+    results = [[] for _ in images]
+    if not crops:
+        return results
+
+    if use_angle_cls and getattr(engine, 'text_classifier', None) is not None:
+        crops, _, _ = engine.text_classifier(crops)
+    rec_res, _ = engine.text_recognizer(crops)
+
+    drop_score = getattr(engine, 'drop_score', 0.5)
+    for (index, box), (text, score) in zip(owners, rec_res):
+        if score >= drop_score:
+            results[index].append([box.tolist(), (text, score)])
+    return results
+
+
+class OCRBatcher:
+    """
+    OCR微批处理
+    submit()提交的图像进入队列，后台线程等到凑满max_batch_size张或最早的图像等待超过
+    max_latency_ms后，按识别选项分组批量推理，再把结果分别交还给各自的调用方。
+    批处理出错时该批的Future都以异常结束，后台线程继续处理后续提交；线程意外退出时下次submit()重新启动
+    """
+
+    def __init__(self, pool, max_batch_size=None, max_latency_ms=None):
+        self._pool = pool
+        self._max_batch_size = max_batch_size
+        self._max_latency_ms = max_latency_ms
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._metrics = {'batches': 0, 'images': 0, 'max_batch': 0}
+
+    @property
+    def max_batch_size(self):
+        return max(1, self._max_batch_size or settings.DOCUMENT_OCR_BATCH_MAX_SIZE)
+
+    @property
+    def max_latency(self):
+        return (self._max_latency_ms if self._max_latency_ms is not None else settings.DOCUMENT_OCR_BATCH_MAX_LATENCY_MS) / 1000
+
+    def submit(self, image, lang='ch', use_angle_cls=True):
+        """提交一张图像，返回Future，结果为该图像的识别行列表"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put(((lang, bool(use_angle_cls)), image, future))
+        return future
+
+    def ocr(self, image, lang='ch', use_angle_cls=True):
+        """与OCREnginePool.ocr()返回格式一致的同步接口"""
+        return [self.submit(image, lang, use_angle_cls).result()]
+
+    def health(self):
+        with self._lock:
+            return dict(self._metrics)
+
+    def _ensure_started(self):
+        # 在首次提交时启动后台线程，保证线程属于fork之后的工作进程
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ocr-batcher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                self._collect(batch)
+                self._dispatch(batch)
+            except Exception as e:
+                # 异常不能结束后台线程，否则之后提交的图像永远等不到结果
+                logger.exception(f"OCR批处理失败: {str(e)}")
+                error = e
+            else:
+                error = RuntimeError("OCR批处理未返回该图像的结果")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+
+    def _collect(self, batch):
+        """在等待时限内继续从队列取图像，直到凑满一批"""
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+    def _dispatch(self, batch):
+        groups = {}
+        for key, image, future in batch:
+            if future.set_running_or_notify_cancel():
+                groups.setdefault(key, []).append((image, future))
+        for key, items in groups.items():
+            self._run_batch(key, items)
+
+    def _run_batch(self, key, items):
+        lang, use_angle_cls = key
+        try:
+            with self._pool.engine(lang, use_angle_cls) as engine:
+                started = time.perf_counter()
+                results = ocr_batch(engine, [image for image, _ in items], use_angle_cls)
+                self._pool.record(key, 'inference', time.perf_counter() - started)
+        except Exception as e:
+            for _, future in items:
+                future.set_exception(e)
+            return
+
+        for (_, future), result in zip(items, results):
+            future.set_result(result)
+
+        with self._lock:
+            self._metrics['batches'] += 1
+            self._metrics['images'] += len(items)
+            self._metrics['max_batch'] = max(self._metrics['max_batch'], len(items))
+
+
+# 每个工作进程一个引擎池
+ocr_pool = OCREnginePool()
+ocr_batcher = OCRBatcher(ocr_pool)
+
+
+def consumes_warmup_queues(app=None):
+    """当前工作进程是否消费DOCUMENT_OCR_WARMUP_QUEUES中的队列（未指定-Q时只消费默认队列）"""
+    app = app or current_app
+    return not set(app.amqp.queues.consume_from).isdisjoint(settings.DOCUMENT_OCR_WARMUP_QUEUES)
+
+
+@worker_process_init.connect
+def warm_up_ocr_engines(**kwargs):
+    """
+    工作进程启动时预热DOCUMENT_OCR_WARMUP_ENGINES中配置的引擎
+    只在消费OCR队列的工作进程中预热，其他队列的工作进程不加载模型；
+    只在prefork子进程中触发，solo/threads模式下引擎在首次使用时创建
+    """
+    if not consumes_warmup_queues():
+        return
+    for options in settings.DOCUMENT_OCR_WARMUP_ENGINES:
+        try:
+            ocr_pool.warm_up(**options)
+        except Exception as e:
+            # 预热失败不影响工作进程启动，首次使用时会再次尝试创建
+            logger.warning(f"OCR引擎预热失败 {options}: {str(e)}")
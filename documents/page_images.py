@@ -0,0 +1,333 @@
+"""
+页面图像
+PDF页面在首次访问时按请求的DPI渲染整页或缩放瓦片，结果写入容量受限的磁盘LRU缓存，
+后续访问直接读取缓存文件。
+入库时保存的页面图像按DOCUMENT_PAGE_IMAGE_PROFILES的各规格（如审阅图与缩略图）输出：
+每页只栅格化一次，各规格由同一张位图缩放后编码为WebP/JPEG，经临时文件流式写入文档存储。
+"""
+import json
+import math
+import os
+import tempfile
+import threading
+import uuid
+
+import fitz  # PyMuPDF
+from django.conf import settings
+from PIL import Image
+
+from documents.storage import get_document_storage, read_chunks
+
+# 页面图像输出格式对应的扩展名与Content-Type
+PAGE_IMAGE_FORMATS = {
+    'WEBP': ('.webp', 'image/webp'),
+    'JPEG': ('.jpg', 'image/jpeg'),
+    'PNG': ('.png', 'image/png'),
+}
+# 编码结果小于该值时留在内存中，否则溢出到临时文件
+SPOOL_MAX_BYTES = 4 * 1024 * 1024
+
+
+class PageImageCache:
+    """
+    容量受限的磁盘LRU缓存
+    命中时刷新文件修改时间，写入后总大小超过上限则按修改时间从旧到新淘汰
+    """
+
+    def __init__(self, root=None, max_bytes=None):
+        self._root = root
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # 进程内估算的缓存总大小，首次写入时扫描目录初始化
+        self._size = None
+
+    @property
+    def root(self):
+        return str(self._root or settings.DOCUMENT_PAGE_CACHE_DIR)
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes or settings.DOCUMENT_PAGE_CACHE_MAX_BYTES
+
+    def path_for(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """返回缓存文件路径，未命中返回None"""
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, data):
+        """写入缓存（先写临时文件再原子替换），返回缓存文件路径"""
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict(keep=path)
+        return path
+
+    def _entries(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self, keep=None):
+        """淘汰最久未访问的文件，直到总大小降到上限的90%以下"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+
+
+page_image_cache = PageImageCache()
+
+
+class PageTooLarge(ValueError):
+    """整页渲染的像素数超过DOCUMENT_PAGE_RENDER_MAX_PIXELS，需要按瓦片获取"""
+
+
+def _geometry_key(document, page_num, dpi):
+    return os.path.join(str(document.id), f"p{page_num}_d{dpi}.json")
+
+
+def _geometry_from_rect(rect, dpi):
+    zoom = dpi / 72
+    width, height = math.ceil(rect.width * zoom), math.ceil(rect.height * zoom)
+    tile_size = settings.DOCUMENT_PAGE_TILE_SIZE
+    return {
+        'width': width,
+        'height': height,
+        'tile_size': tile_size,
+        'tile_columns': math.ceil(width / tile_size),
+        'tile_rows': math.ceil(height / tile_size),
+    }
+
+
+def _cache_geometry(document, page_num, dpi, rect):
+    geometry = _geometry_from_rect(rect, dpi)
+    page_image_cache.put(_geometry_key(document, page_num, dpi), json.dumps(geometry).encode('utf-8'))
+    return geometry
+
+
+def page_geometry(document, page_num, dpi):
+    """
+    返回页面在指定DPI下的像素宽高及瓦片行列数
+    结果与瓦片一起缓存，缓存命中时不打开PDF（对象存储时打开PDF需要下载整个文件）
+    """
+    cached = page_image_cache.get(_geometry_key(document, page_num, dpi))
+    if cached:
+        try:
+            with open(cached, 'rb') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            # 读取前恰好被淘汰
+            pass
+
+    with get_document_storage().local_path(document.storage_path) as pdf_path, fitz.open(pdf_path) as pdf:
+        rect = pdf[page_num - 1].rect
+    return _cache_geometry(document, page_num, dpi, rect)
+
+
+def render_page_image(document, page_num, dpi, tile=None):
+    """
+    获取PDF页面图像（PNG），优先读取缓存
+    tile为(column, row)时只渲染该瓦片，瓦片边长为DOCUMENT_PAGE_TILE_SIZE像素；
+    整页像素数超过DOCUMENT_PAGE_RENDER_MAX_PIXELS时抛出PageTooLarge（大幅面图纸在高DPI下需要按瓦片获取）
+    返回缓存文件路径
+    """
+    key = os.path.join(str(document.id), f"p{page_num}_d{dpi}" + (f"_t{tile[0]}_{tile[1]}" if tile else '') + '.png')
+    cached = page_image_cache.get(key)
+    if cached:
+        return cached
+
+    zoom = dpi / 72
+    with get_document_storage().local_path(document.storage_path) as pdf_path, fitz.open(pdf_path) as pdf:
+        if not 1 <= page_num <= len(pdf):
+            raise IndexError(f"页码超出范围: {page_num}")
+        page = pdf[page_num - 1]
+        # PDF已打开，顺便缓存页面几何信息，后续请求无需再打开PDF
+        if not page_image_cache.get(_geometry_key(document, page_num, dpi)):
+            _cache_geometry(document, page_num, dpi, page.rect)
+
+        clip = None
+        if not tile:
+            geometry = _geometry_from_rect(page.rect, dpi)
+            if geometry['width'] * geometry['height'] > settings.DOCUMENT_PAGE_RENDER_MAX_PIXELS:
+                raise PageTooLarge(
+                    f"页面在{dpi}DPI下为{geometry['width']}x{geometry['height']}像素，超过整页渲染上限，请按瓦片获取"
+                )
+        else:
+            # 瓦片在页面坐标系（点）中的边长
+            span = settings.DOCUMENT_PAGE_TILE_SIZE / zoom
+            column, row = tile
+            clip = fitz.Rect(column * span, row * span, (column + 1) * span, (row + 1) * span) & page.rect
+            if clip.is_empty:
+                raise IndexError(f"瓦片超出页面范围: {column},{row}")
+
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip)
+        data = pix.tobytes('png')
+
+    return page_image_cache.put(key, data)
+
+
+def page_image_content_type(name):
+    """按存储名的扩展名返回页面图像的Content-Type"""
+    ext = os.path.splitext(name)[1].lower()
+    for extension, content_type in PAGE_IMAGE_FORMATS.values():
+        if extension == ext:
+            return content_type
+    return 'application/octet-stream'
+
+
+def page_raster_zoom(width, height):
+    """
+    PDF页面入库渲染的缩放比例：恰好满足最大规格的长边像素，各规格都由这一次渲染结果缩放得到
+    width、height为页面尺寸（点）
+    """
+    max_edge = max(profile['max_edge'] for profile in settings.DOCUMENT_PAGE_IMAGE_PROFILES.values())
+    return max_edge / max(width, height, 1)
+
+
+class _ByteCounter:
+    """只统计写入字节数的文件对象，用于计算PNG基准大小而不保存内容"""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+
+def png_size(image):
+    """图像以无损PNG编码后的字节数"""
+    counter = _ByteCounter()
+    image.save(counter, format='PNG')
+    return counter.size
+
+
+def _prepare_for_format(image, image_format):
+    """转换为目标格式支持的色彩模式，透明背景合成到白底"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    if image.mode == 'L' and image_format != 'WEBP':
+        return image
+    return image.convert('RGB') if image.mode != 'RGB' else image
+
+
+def write_page_images(image, pages_dir, page_num):
+    """
+    按各输出规格缩放、编码页面图像并写入存储
+    返回(主规格的存储名, {规格: {name, format, bytes, width, height}})
+    """
+    storage = get_document_storage()
+    variants = {}
+    # 从大到小处理，较小的规格由上一个规格的结果缩放，减少重采样的像素量
+    profiles = sorted(settings.DOCUMENT_PAGE_IMAGE_PROFILES.items(), key=lambda item: -item[1]['max_edge'])
+    source = image
+    for name, profile in profiles:
+        image_format = profile['format'].upper()
+        scaled = source.copy() if source is image else source
+        scaled.thumbnail((profile['max_edge'], profile['max_edge']), Image.Resampling.LANCZOS)
+        source = scaled
+
+        extension = PAGE_IMAGE_FORMATS[image_format][0]
+        dest_path = f"{pages_dir}/page_{page_num}_{name}{extension}"
+        options = {'quality': profile.get('quality', 80)} if image_format in ('WEBP', 'JPEG') else {}
+        if image_format == 'JPEG':
+            options.update(optimize=True, progressive=True)
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as f:
+            _prepare_for_format(scaled, image_format).save(f, format=image_format, **options)
+            f.seek(0)
+            size = storage.write(dest_path, read_chunks(f))
+        variants[name] = {
+            'name': dest_path,
+            'format': image_format,
+            'bytes': size,
+            'width': scaled.width,
+            'height': scaled.height,
+        }
+
+    primary = variants.get(settings.DOCUMENT_PAGE_IMAGE_PRIMARY_PROFILE) or variants[profiles[0][0]]
+    return primary['name'], variants
+
+
+def summarize_page_images(rows):
+    """
+    汇总文档各页的页面图像输出
+    rows为(image_variants, image_baseline_bytes)序列；节省量相对旧版本每页保存的无损PNG计算。
+    只有部分页面记录了基准（PDF按抽样计算）时，按这些页面的压缩比估算整个文档的基准大小；
+    没有任何页面记录基准时基准与节省量为None。
+    """
+    pages = output_bytes = 0
+    baseline_pages = sampled_output = sampled_baseline = 0
+    profiles = {}
+    for variants, baseline in rows:
+        if not variants:
+            continue
+        pages += 1
+        page_bytes = 0
+        for name, variant in variants.items():
+            summary = profiles.setdefault(name, {'format': variant['format'], 'bytes': 0})
+            summary['bytes'] += variant['bytes']
+            page_bytes += variant['bytes']
+        output_bytes += page_bytes
+        if baseline is not None:
+            baseline_pages += 1
+            sampled_output += page_bytes
+            sampled_baseline += baseline
+
+    if not pages:
+        return None
+    baseline_bytes = saved_ratio = None
+    if sampled_baseline:
+        if baseline_pages == pages:
+            baseline_bytes = sampled_baseline
+        else:
+            baseline_bytes = round(output_bytes * sampled_baseline / sampled_output) if sampled_output else None
+        saved_ratio = round(1 - sampled_output / sampled_baseline, 4)
+    return {
+        'pages': pages,
+        'profiles': profiles,
+        'output_bytes': output_bytes,
+        'baseline_pages': baseline_pages,
+        'baseline_bytes': baseline_bytes,
+        'saved_bytes': baseline_bytes - output_bytes if baseline_bytes is not None else None,
+        'saved_ratio': saved_ratio,
+    }
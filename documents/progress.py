@@ -0,0 +1,171 @@
+"""
+文档处理进度的发布/订阅
+预处理与字段抽取任务把进度事件发布到文档频道（及所属批次频道），SSE接口订阅频道推送给客户端。
+默认经Redis pub/sub跨进程传递；LocalProgressBroker只在当前进程内传递，用于单进程开发与测试。
+事件不落库，订阅之前发布的事件不会补发，客户端连接时先收到一次当前状态快照。
+
+事件为JSON对象，公共字段为event、document_id、batch_id、timestamp:
+    status  文档状态变化（status，以及page_count、extracted_fields等汇总）
+    pages   本次写入/跳过的页数（written、skipped，page_count为文档总页数，未知时为null）
+    field   单个字段抽取完成（field_key、done、total、success，失败时带error）
+    error   处理失败（stage为preprocess或extraction，error为错误信息）
+"""
+import asyncio
+import json
+import threading
+import time
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = get_task_logger(__name__)
+
+
+def document_channel(document_id):
+    return f'progress:document:{document_id}'
+
+
+def batch_channel(batch_id):
+    return f'progress:batch:{batch_id}'
+
+
+class RedisProgressBroker:
+    """基于Redis pub/sub的进度频道，发布方为Celery工作进程，订阅方为ASGI进程"""
+
+    def __init__(self, url=None):
+        self.url = url or settings.DOCUMENT_PROGRESS_REDIS_URL
+        self._client = None
+
+    def publish(self, channels, event):
+        import redis
+
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url, socket_connect_timeout=1, socket_timeout=1)
+        message = json.dumps(event, ensure_ascii=False)
+        with self._client.pipeline(transaction=False) as pipe:
+            for channel in channels:
+                pipe.publish(channel, message)
+            pipe.execute()
+
+    async def subscribe(self, channels):
+        from redis import asyncio as aioredis
+
+        client = aioredis.from_url(self.url)
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(*channels)
+        return RedisSubscription(client, pubsub)
+
+
+class RedisSubscription:
+
+    def __init__(self, client, pubsub):
+        self.client = client
+        self.pubsub = pubsub
+
+    async def get(self, timeout):
+        """等待下一条事件，timeout秒内没有事件时返回None"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # 订阅确认等非消息数据也会使get_message提前返回None，继续等待到超时
+            message = await self.pubsub.get_message(timeout=remaining)
+            if message and message['type'] == 'message':
+                return json.loads(message['data'])
+
+    async def close(self):
+        await self.pubsub.aclose()
+        await self.client.aclose()
+
+
+class LocalProgressBroker:
+    """
+    进程内的进度频道
+    发布方可以在任意线程中调用（如eager模式下同步执行的Celery任务），事件投递到订阅方所在的事件循环
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def publish(self, channels, event):
+        with self._lock:
+            targets = {subscription for channel in channels for subscription in self._subscribers.get(channel, ())}
+        for subscription in targets:
+            subscription.deliver(event)
+
+    async def subscribe(self, channels):
+        subscription = LocalSubscription(self, channels, asyncio.get_running_loop())
+        with self._lock:
+            for channel in channels:
+                self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel, set())
+                subscribers.discard(subscription)
+                if not subscribers:
+                    self._subscribers.pop(channel, None)
+
+
+class LocalSubscription:
+
+    def __init__(self, broker, channels, loop):
+        self.broker = broker
+        self.channels = channels
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def deliver(self, event):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        self.broker._unsubscribe(self)
+
+
+_broker = None
+_broker_path = None
+
+
+def get_progress_broker():
+    """按DOCUMENT_PROGRESS_BROKER创建的进度频道（每个进程一个实例，配置变化时重新创建）"""
+    global _broker, _broker_path
+    path = settings.DOCUMENT_PROGRESS_BROKER
+    if _broker is None or _broker_path != path:
+        _broker = import_string(path)()
+        _broker_path = path
+    return _broker
+
+
+def publish_document_event(document, event, **data):
+    """
+    发布文档进度事件到文档频道及所属批次频道
+    发布失败只记录警告，不影响处理任务本身
+    """
+    if not settings.DOCUMENT_PROGRESS_ENABLED:
+        return
+    batch_id = str(document.batch_id) if document.batch_id else None
+    payload = {
+        'event': event,
+        'document_id': str(document.id),
+        'batch_id': batch_id,
+        'timestamp': time.time(),
+        **data,
+    }
+    channels = [document_channel(document.id)]
+    if batch_id:
+        channels.append(batch_channel(batch_id))
+    try:
+        get_progress_broker().publish(channels, payload)
+    except Exception as e:
+        logger.warning(f"进度事件发布失败: {event} {document.id}: {str(e)}")
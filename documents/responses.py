@@ -0,0 +1,135 @@
+"""
+文件下载响应
+支持条件请求（ETag/Last-Modified）、单区间Range请求（206），
+以及通过X-Accel-Redirect/X-Sendfile将文件传输交给前端Web服务器。
+"""
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def file_etag(stat):
+    """根据文件大小和修改时间生成强ETag"""
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header, size):
+    """
+    解析单区间Range请求头，返回(start, end)闭区间
+    请求头无法解析或包含多个区间时返回None（按完整响应处理），区间无法满足时抛出ValueError
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # 后缀区间：最后N个字节
+        length = int(last)
+        if length == 0:
+            raise ValueError('unsatisfiable range')
+        return max(0, size - length), size - 1
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError('unsatisfiable range')
+    return start, end
+
+
+def _if_range_matches(request, etag, mtime):
+    """If-Range为空或与当前文件一致时才返回部分内容"""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(mtime)
+
+
+def _read_range(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _sendfile_response(path, content_type):
+    """由前端Web服务器完成传输的响应，Range与缓存校验同样由其处理"""
+    response = HttpResponse(content_type=content_type)
+    backend = settings.DOCUMENT_SENDFILE_BACKEND
+    if backend == 'x-accel-redirect':
+        relative_path = os.path.relpath(path, settings.DOCUMENT_SENDFILE_ROOT)
+        response['X-Accel-Redirect'] = settings.DOCUMENT_SENDFILE_URL_PREFIX.rstrip('/') + '/' + relative_path.replace(os.sep, '/')
+    elif backend == 'x-sendfile':
+        response['X-Sendfile'] = os.path.abspath(path)
+    else:
+        raise ValueError(f"不支持的sendfile方式: {backend}")
+    return response
+
+
+def serve_file(request, path, filename=None, as_attachment=False, content_type=None):
+    """
+    返回文件响应
+    - If-None-Match/If-Modified-Since命中时返回304
+    - 带Range请求头时返回206部分内容，区间无法满足时返回416
+    - 配置了DOCUMENT_SENDFILE_BACKEND时交给前端Web服务器传输
+    """
+    stat = os.stat(path)
+    etag = file_etag(stat)
+    content_type = content_type or mimetypes.guess_type(filename or path)[0] or 'application/octet-stream'
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        response = _build_response(request, path, stat, etag, content_type)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Accept-Ranges'] = 'bytes'
+    if filename or as_attachment:
+        response['Content-Disposition'] = content_disposition_header(as_attachment, filename or os.path.basename(path))
+    return response
+
+
+def _build_response(request, path, stat, etag, content_type):
+    if settings.DOCUMENT_SENDFILE_BACKEND:
+        return _sendfile_response(path, content_type)
+
+    range_header = request.headers.get('Range')
+    if range_header and request.method == 'GET' and _if_range_matches(request, etag, stat.st_mtime):
+        try:
+            byte_range = parse_range(range_header, stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+
+        if byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(_read_range(path, start, end), status=206, content_type=content_type)
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+            return response
+
+    return FileResponse(open(path, 'rb'), content_type=content_type)
+
+
+def is_partial_continuation(request):
+    """判断是否为不从文件开头读取的Range请求（断点续传/分段读取的后续请求）"""
+    match = RANGE_RE.match(request.headers.get('Range', '').strip())
+    return bool(match) and match.group(1) != '0'
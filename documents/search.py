@@ -0,0 +1,202 @@
+"""
+页面全文检索
+SQLite后端使用FTS5外部内容表（trigram分词，适用于中文等无空格分隔的文本）索引DocumentPage.text，
+由数据库触发器在页面插入、删除和文本更新时同步索引。
+短于3个字符的检索词无法使用trigram索引，改为LIKE匹配；其他数据库后端整体退化为LIKE匹配。
+"""
+import html
+import re
+import uuid
+
+from django.db import connection
+
+from documents.models import DocumentPage
+
+FTS_TABLE = 'documents_page_fts'
+PAGE_TABLE = 'documents_documentpage'
+
+# 建表与触发器语句均可重复执行；表被重建（如SQLite下的ALTER）后会在post_migrate时补建触发器
+# 迁移0009内联了同样的语句，这里的修改需要另加迁移
+SEARCH_INDEX_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        text, content='{PAGE_TABLE}', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {PAGE_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {PAGE_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) VALUES ('delete', old.id, old.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF text ON {PAGE_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text);
+    END""",
+]
+
+# trigram分词可索引的最短检索词长度
+MIN_INDEXED_TERM_LENGTH = 3
+SNIPPET_TOKENS = 48
+SNIPPET_RADIUS = 40
+# FTS5 snippet()的高亮标记，转义HTML后再替换为<mark>
+MARK_START, MARK_END = '\x02', '\x03'
+
+
+def search_index_available(conn=None):
+    return (conn or connection).vendor == 'sqlite'
+
+
+def drop_search_index(conn=None):
+    conn = conn or connection
+    if not search_index_available(conn):
+        return
+    with conn.cursor() as cursor:
+        for suffix in ('ai', 'ad', 'au'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def install_search_index(conn=None, rebuild=False):
+    """创建全文索引表及同步触发器，rebuild为True时按页面表重建索引内容"""
+    conn = conn or connection
+    if not search_index_available(conn) or PAGE_TABLE not in conn.introspection.table_names():
+        return
+    with conn.cursor() as cursor:
+        for statement in SEARCH_INDEX_SQL:
+            cursor.execute(statement)
+        if rebuild:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _highlight(text, terms):
+    """截取首个命中位置附近的文本并高亮所有检索词"""
+    pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+    match = pattern.search(text)
+    start = max(0, match.start() - SNIPPET_RADIUS) if match else 0
+    end = min(len(text), (match.end() if match else 0) + SNIPPET_RADIUS)
+    window = text[start:end]
+    snippet = pattern.sub(lambda m: f'{MARK_START}{m.group(0)}{MARK_END}', window)
+    return ('…' if start > 0 else '') + _render_snippet(snippet) + ('…' if end < len(text) else '')
+
+
+def _render_snippet(snippet):
+    return html.escape(snippet).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+class PageSearch:
+    """
+    页面检索结果（惰性执行）
+    实现count()与切片，可直接交给分页器；每条结果为包含文档、页码、高亮摘要和相关度的字典
+    """
+
+    def __init__(self, query, source_type=None):
+        self.terms = query.split()
+        self.source_type = source_type
+        self.indexed_terms = [term for term in self.terms if len(term) >= MIN_INDEXED_TERM_LENGTH]
+        self.use_index = bool(self.indexed_terms) and search_index_available()
+        self._count = None
+
+    def _match_expression(self):
+        return ' AND '.join('"{}"'.format(term.replace('"', '""')) for term in self.indexed_terms)
+
+    def _index_filters(self):
+        """全文索引检索的WHERE子句，索引无法覆盖的短检索词以LIKE补充"""
+        clauses = [f"{FTS_TABLE} MATCH %s"]
+        params = [self._match_expression()]
+        for term in self.terms:
+            if len(term) < MIN_INDEXED_TERM_LENGTH:
+                clauses.append("p.text LIKE %s ESCAPE '\\'")
+                params.append(f'%{_escape_like(term)}%')
+        if self.source_type:
+            clauses.append("d.source_type = %s")
+            params.append(self.source_type)
+        return ' AND '.join(clauses), params
+
+    def _queryset(self):
+        queryset = DocumentPage.objects.all()
+        for term in self.terms:
+            queryset = queryset.filter(text__icontains=term)
+        if self.source_type:
+            queryset = queryset.filter(document__source_type=self.source_type)
+        return queryset
+
+    def count(self):
+        if self._count is None:
+            if self.use_index:
+                where, params = self._index_filters()
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"""SELECT COUNT(*) FROM {FTS_TABLE}
+                        JOIN {PAGE_TABLE} p ON p.id = {FTS_TABLE}.rowid
+                        JOIN documents_document d ON d.id = p.document_id
+                        WHERE {where}""",
+                        params
+                    )
+                    self._count = cursor.fetchone()[0]
+            else:
+                self._count = self._queryset().count()
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        offset = index.start or 0
+        limit = (index.stop if index.stop is not None else self.count()) - offset
+        if limit <= 0:
+            return []
+        return self._index_hits(offset, limit) if self.use_index else self._scan_hits(offset, limit)
+
+    def _index_hits(self, offset, limit):
+        where, params = self._index_filters()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""SELECT p.id, p.document_id, p.page_num, d.filename, d.source_type,
+                    snippet({FTS_TABLE}, 0, %s, %s, '…', {SNIPPET_TOKENS}), bm25({FTS_TABLE})
+                FROM {FTS_TABLE}
+                JOIN {PAGE_TABLE} p ON p.id = {FTS_TABLE}.rowid
+                JOIN documents_document d ON d.id = p.document_id
+                WHERE {where}
+                ORDER BY bm25({FTS_TABLE}), p.id
+                LIMIT %s OFFSET %s""",
+                [MARK_START, MARK_END, *params, limit, offset]
+            )
+            rows = cursor.fetchall()
+        return [
+            {
+                'page_id': page_id,
+                'document_id': str(uuid.UUID(str(document_id))),
+                'page_num': page_num,
+                'filename': filename,
+                'source_type': source_type,
+                'snippet': _render_snippet(snippet),
+                # bm25()越小越相关，取负数使分数越大越相关
+                'score': round(-rank, 4),
+            }
+            for page_id, document_id, page_num, filename, source_type, snippet, rank in rows
+        ]
+
+    def _scan_hits(self, offset, limit):
+        pages = (
+            self._queryset()
+            .select_related('document')
+            .only('id', 'page_num', 'text', 'document__id', 'document__filename', 'document__source_type')
+            .order_by('-document__created_at', 'page_num')[offset:offset + limit]
+        )
+        return [
+            {
+                'page_id': page.id,
+                'document_id': str(page.document.id),
+                'page_num': page.page_num,
+                'filename': page.document.filename,
+                'source_type': page.document.source_type,
+                'snippet': _highlight(page.text, self.terms),
+                'score': None,
+            }
+            for page in pages
+        ]
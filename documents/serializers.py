@@ -1,24 +1,91 @@
 from rest_framework import serializers
-from documents.models import Document, DocumentPage
+from django.conf import settings
+from documents.models import Document, DocumentPage, UploadBatch, UploadSession
 
 class DocumentPageSerializer(serializers.ModelSerializer):
-    """文档页面序列化器"""
+    """文档页面序列化器，布局无论以何种格式存储都以JSON结构返回"""
+    layout_json = serializers.SerializerMethodField()
+    
     class Meta:
         model = DocumentPage
-        fields = ['id', 'page_num', 'text', 'image_path', 'layout_json']
+        fields = ['id', 'page_num', 'text', 'image_path', 'image_variants', 'layout_json', 'ocr_confidence']
         read_only_fields = ['id']
+    
+    def get_layout_json(self, obj):
+        return obj.get_layout()
+
+class DocumentPageListSerializer(DocumentPageSerializer):
+    """
+    分页列表中的页面序列化器
+    默认只返回页面元数据，text、layout_json需通过?include=text,layout_json显式请求
+    """
+    HEAVY_FIELDS = ('text', 'layout_json')
+    # 大字段对应的数据库列，未请求时延迟加载
+    HEAVY_COLUMNS = {'text': ('text',), 'layout_json': ('layout_json', 'layout_blob')}
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        included = self.included_fields(self.context.get('request'))
+        for name in self.HEAVY_FIELDS:
+            if name not in included:
+                self.fields.pop(name)
+    
+    @classmethod
+    def included_fields(cls, request):
+        """解析?include=参数中请求的大字段"""
+        include = request.query_params.get('include', '') if request else ''
+        return {name.strip() for name in include.split(',')} & set(cls.HEAVY_FIELDS)
+    
+    @classmethod
+    def deferred_columns(cls, request):
+        """未通过?include=请求的大字段对应的数据库列"""
+        included = cls.included_fields(request)
+        return [column for name in cls.HEAVY_FIELDS if name not in included for column in cls.HEAVY_COLUMNS[name]]
 
-class DocumentSerializer(serializers.ModelSerializer):
-    """文档序列化器"""
+class SparseFieldsetMixin:
+    """支持通过查询参数?fields=id,filename只返回指定字段"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.requested_fields(self.context.get('request'))
+        if requested:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+    
+    @staticmethod
+    def requested_fields(request):
+        """解析?fields=参数，未指定时返回None"""
+        fields = request.query_params.get('fields') if request else None
+        if not fields:
+            return None
+        return {name.strip() for name in fields.split(',') if name.strip()}
+
+class DocumentListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """文档列表序列化器，不嵌套页面，页数来自查询集注解"""
     uploaded_by = serializers.StringRelatedField(read_only=True)
+    page_count = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Document
+        fields = ['id', 'filename', 'source_type', 'status', 'uploaded_by', 
+                  'created_at', 'storage_path', 'page_count']
+        read_only_fields = fields
+    
+    def get_page_count(self, obj):
+        # 优先使用查询集注解的页数，避免逐行COUNT
+        if hasattr(obj, 'page_count'):
+            return obj.page_count
+        return obj.pages.count()
+
+class DocumentSerializer(DocumentListSerializer):
+    """文档序列化器（详情），包含全部页面"""
     pages = DocumentPageSerializer(many=True, read_only=True)
-    page_count = serializers.IntegerField(source='pages.count', read_only=True)
     
     class Meta:
         model = Document
         fields = ['id', 'filename', 'source_type', 'status', 'uploaded_by', 
-                  'created_at', 'storage_path', 'pages', 'page_count']
-        read_only_fields = ['id', 'uploaded_by', 'created_at', 'status']
+                  'created_at', 'storage_path', 'pages', 'page_count', 'processing_metrics']
+        read_only_fields = ['id', 'uploaded_by', 'created_at', 'status', 'processing_metrics']
     
     def create(self, validated_data):
         # 文件上传处理在视图中完成
@@ -29,4 +96,25 @@ class DocumentCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Document
         fields = ['filename', 'source_type', 'storage_path']
-        read_only_fields = ['id', 'status', 'uploaded_by', 'created_at']
\ No newline at end of file
+        read_only_fields = ['id', 'status', 'uploaded_by', 'created_at']
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """断点续传上传会话序列化器"""
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'filename', 'total_size', 'offset', 'status', 'document', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'offset', 'status', 'document', 'created_at', 'updated_at']
+    
+    def validate_total_size(self, value):
+        if value <= 0 or value > settings.DOCUMENT_RESUMABLE_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError("文件大小超出允许范围")
+        return value
+
+class UploadBatchSerializer(serializers.ModelSerializer):
+    """批量上传批次序列化器"""
+    created_by = serializers.StringRelatedField(read_only=True)
+    
+    class Meta:
+        model = UploadBatch
+        fields = ['id', 'created_by', 'created_at', 'file_count', 'skipped']
+        read_only_fields = fields
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.db import connections
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from documents.models import Document, DocumentStatusCounter
+from documents.search import install_search_index
+
+
+@receiver(post_save, sender=Document)
+def update_status_counter_on_save(sender, instance, created, **kwargs):
+    """文档新建或状态、类型、上传用户变化时增量更新状态计数"""
+    if not settings.DOCUMENT_STATUS_COUNTERS_ENABLED:
+        return
+    
+    old_key = None if created else getattr(instance, '_counter_key', None)
+    new_key = instance.counter_key()
+    if new_key is None or old_key == new_key:
+        return
+    
+    if old_key is not None:
+        DocumentStatusCounter.adjust(*old_key, -1)
+    DocumentStatusCounter.adjust(*new_key, 1)
+    instance._counter_key = new_key
+
+
+@receiver(post_delete, sender=Document)
+def update_status_counter_on_delete(sender, instance, **kwargs):
+    if not settings.DOCUMENT_STATUS_COUNTERS_ENABLED:
+        return
+    
+    key = getattr(instance, '_counter_key', None) or instance.counter_key()
+    if key is not None:
+        DocumentStatusCounter.adjust(*key, -1)
+
+
+def install_page_search_index(sender, using, **kwargs):
+    """迁移后补建全文索引触发器（SQLite重建页面表时会丢失原有触发器）"""
+    install_search_index(connections[using])
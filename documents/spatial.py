@@ -0,0 +1,223 @@
+"""
+页面文本片段的网格空间索引
+入库时把页面划分为均匀网格，记录每个网格单元覆盖的片段序号（CSR结构：单元偏移 + 片段序号），
+区域查询只检查矩形覆盖的单元内的片段，最近邻查询从所在单元按环向外扩展。
+索引只保存片段序号，片段坐标与文本仍来自页面布局（见documents.layout）。
+
+二进制布局:
+    b'GRD1' | float32 x0, y0, cell_width, cell_height | uint32 columns, rows, span_count
+    | 单元偏移 uint32[columns*rows+1] | 片段序号 uint32[...]
+"""
+import math
+import struct
+
+import numpy as np
+
+MAGIC = b'GRD1'
+HEADER = struct.Struct('<4s4f3I')
+# 自动选择网格大小时每个单元平均容纳的片段数
+SPANS_PER_CELL = 4
+
+
+class SpanGridIndex:
+    """片段包围盒的均匀网格索引"""
+
+    def __init__(self, bboxes, origin, cell_size, shape, offsets, span_ids):
+        self.bboxes = bboxes
+        self.origin = origin
+        self.cell_size = cell_size
+        self.shape = shape
+        self.offsets = offsets
+        self.span_ids = span_ids
+
+    @classmethod
+    def build(cls, bboxes, cell_size=None):
+        """由(n, 4)包围盒数组建立索引，cell_size为空时按片段密度自动选择单元边长"""
+        bboxes = np.asarray(bboxes, dtype=np.float32).reshape(-1, 4)
+        if not len(bboxes):
+            return cls(bboxes, (0.0, 0.0), (1.0, 1.0), (1, 1), np.zeros(2, dtype=np.uint32), np.zeros(0, dtype=np.uint32))
+
+        x0, y0 = float(bboxes[:, 0].min()), float(bboxes[:, 1].min())
+        width = max(float(bboxes[:, 2].max()) - x0, 1.0)
+        height = max(float(bboxes[:, 3].max()) - y0, 1.0)
+        if not cell_size:
+            cell_size = max(math.sqrt(width * height * SPANS_PER_CELL / len(bboxes)), 1.0)
+        # 网格参数以float32保存，建索引时使用相同精度，保证加载后单元划分一致
+        cell_size = float(np.float32(cell_size))
+        columns = max(1, math.ceil(width / cell_size))
+        rows = max(1, math.ceil(height / cell_size))
+
+        index = cls(bboxes, (x0, y0), (cell_size, cell_size), (columns, rows), None, None)
+        cells = []
+        owners = []
+        for span_id, bbox in enumerate(bboxes):
+            c0, r0, c1, r1 = index._cell_range(bbox)
+            for row in range(r0, r1 + 1):
+                for column in range(c0, c1 + 1):
+                    cells.append(row * columns + column)
+                    owners.append(span_id)
+
+        cells = np.asarray(cells, dtype=np.int64)
+        order = np.argsort(cells, kind='stable')
+        index.span_ids = np.asarray(owners, dtype=np.uint32)[order]
+        index.offsets = np.zeros(columns * rows + 1, dtype=np.uint32)
+        np.cumsum(np.bincount(cells, minlength=columns * rows), out=index.offsets[1:])
+        return index
+
+    @classmethod
+    def from_bytes(cls, data, bboxes):
+        data = bytes(data)
+        magic, x0, y0, cell_width, cell_height, columns, rows, count = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("无法识别的空间索引格式")
+        bboxes = np.asarray(bboxes, dtype=np.float32).reshape(-1, 4)
+        if count != len(bboxes):
+            raise ValueError("空间索引与页面布局的片段数不一致")
+        offsets = np.frombuffer(data, dtype=np.uint32, count=columns * rows + 1, offset=HEADER.size)
+        span_ids = np.frombuffer(data, dtype=np.uint32, count=int(offsets[-1]), offset=HEADER.size + offsets.nbytes)
+        return cls(bboxes, (x0, y0), (cell_width, cell_height), (columns, rows), offsets, span_ids)
+
+    def to_bytes(self):
+        header = HEADER.pack(MAGIC, *self.origin, *self.cell_size, *self.shape, len(self.bboxes))
+        return header + self.offsets.astype('<u4').tobytes() + self.span_ids.astype('<u4').tobytes()
+
+    def _cell_of(self, x, y):
+        columns, rows = self.shape
+        # 先把坐标限制在网格范围内，兼容无穷大等越界坐标
+        x = min(max(x - self.origin[0], 0.0), columns * self.cell_size[0])
+        y = min(max(y - self.origin[1], 0.0), rows * self.cell_size[1])
+        return min(int(x // self.cell_size[0]), columns - 1), min(int(y // self.cell_size[1]), rows - 1)
+
+    def _cell_range(self, bbox):
+        c0, r0 = self._cell_of(bbox[0], bbox[1])
+        c1, r1 = self._cell_of(bbox[2], bbox[3])
+        return c0, r0, c1, r1
+
+    def _cell_spans(self, column, row):
+        cell = row * self.shape[0] + column
+        return self.span_ids[self.offsets[cell]:self.offsets[cell + 1]]
+
+    def query(self, rect, contains=False):
+        """
+        返回与矩形rect相交的片段序号（按序号升序）
+        contains为True时只返回完全位于矩形内的片段
+        """
+        x0, y0, x1, y1 = rect
+        if not len(self.bboxes) or x1 < x0 or y1 < y0:
+            return np.zeros(0, dtype=np.int64)
+        c0, r0, c1, r1 = self._cell_range(rect)
+        candidates = np.unique(np.concatenate([
+            self._cell_spans(column, row)
+            for row in range(r0, r1 + 1)
+            for column in range(c0, c1 + 1)
+        ])).astype(np.int64)
+
+        boxes = self.bboxes[candidates]
+        if contains:
+            mask = (boxes[:, 0] >= x0) & (boxes[:, 1] >= y0) & (boxes[:, 2] <= x1) & (boxes[:, 3] <= y1)
+        else:
+            mask = (boxes[:, 0] <= x1) & (boxes[:, 2] >= x0) & (boxes[:, 1] <= y1) & (boxes[:, 3] >= y0)
+        return candidates[mask]
+
+    def distances(self, span_ids, x, y):
+        """点到各片段包围盒的距离（点在包围盒内时为0）"""
+        boxes = self.bboxes[span_ids]
+        dx = np.maximum(np.maximum(boxes[:, 0] - x, 0), x - boxes[:, 2])
+        dy = np.maximum(np.maximum(boxes[:, 1] - y, 0), y - boxes[:, 3])
+        return np.hypot(dx, dy)
+
+    def nearest(self, x, y, k=1):
+        """
+        返回距离点(x, y)最近的k个片段的(序号数组, 距离数组)
+        从点所在单元按环向外扩展，已找到k个片段且第k近的距离不超过未扫描单元的最小距离时停止
+        """
+        if not len(self.bboxes):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        columns, rows = self.shape
+        center_column, center_row = self._cell_of(x, y)
+        step = min(self.cell_size)
+        seen = []
+
+        for radius in range(max(columns, rows) + 1):
+            for row in range(center_row - radius, center_row + radius + 1):
+                if not 0 <= row < rows:
+                    continue
+                ring = range(center_column - radius, center_column + radius + 1)
+                if abs(row - center_row) != radius:
+                    ring = (center_column - radius, center_column + radius) if radius else (center_column,)
+                seen.extend(self._cell_spans(column, row) for column in ring if 0 <= column < columns)
+
+            candidates = np.unique(np.concatenate(seen)).astype(np.int64) if seen else np.zeros(0, dtype=np.int64)
+            if len(candidates) >= k:
+                distances = self.distances(candidates, x, y)
+                order = np.argsort(distances, kind='stable')[:k]
+                # 未扫描的单元与点的距离至少为radius个单元边长
+                if distances[order[-1]] <= radius * step:
+                    return candidates[order], distances[order]
+
+        distances = self.distances(candidates, x, y)
+        order = np.argsort(distances, kind='stable')[:k]
+        return candidates[order], distances[order]
+
+
+class PageSpans:
+    """页面片段及其空间索引，查询结果为带序号的片段字典"""
+
+    def __init__(self, layout, index):
+        self.layout = layout
+        self.index = index
+
+    def region(self, rect, contains=False):
+        return [self.layout.span(span_id) | {'index': span_id} for span_id in self.index.query(rect, contains).tolist()]
+
+    def nearest(self, x, y, k=1):
+        span_ids, distances = self.index.nearest(x, y, k)
+        return [
+            self.layout.span(span_id) | {'index': span_id, 'distance': round(distance, 2)}
+            for span_id, distance in zip(span_ids.tolist(), distances.tolist())
+        ]
+
+    def locate(self, value):
+        """
+        定位文本值在页面上的包围盒，找不到时返回None
+        值可能被拆分到同一行相邻的多个片段中：以包含值开头的片段为起点，
+        用区域查询取出同一行右侧的片段，按横坐标拼接直到覆盖整个值
+        """
+        value = value.strip()
+        if not value:
+            return None
+        texts = self.layout.texts()
+        for span_id, text in enumerate(texts):
+            if value in text:
+                return _rounded_bbox(self.index.bboxes[[span_id]])
+
+        for span_id, text in enumerate(texts):
+            text = text.strip()
+            if not text or not any(value.startswith(text[start:]) for start in range(len(text))):
+                continue
+            x0, y0, x1, y1 = self.index.bboxes[span_id].tolist()
+            middle = (y0 + y1) / 2
+            line = [
+                other for other in self.index.query((x1, middle, math.inf, middle)).tolist()
+                if other != span_id
+            ]
+            line.sort(key=lambda other: self.index.bboxes[other][0])
+
+            joined = text
+            boxes = [span_id]
+            for other in line:
+                if value in joined:
+                    break
+                joined += texts[other]
+                boxes.append(other)
+            if value in joined:
+                return _rounded_bbox(self.index.bboxes[boxes])
+        return None
+
+
+def _rounded_bbox(boxes):
+    """多个包围盒的并集"""
+    return [
+        round(float(boxes[:, 0].min()), 2), round(float(boxes[:, 1].min()), 2),
+        round(float(boxes[:, 2].max()), 2), round(float(boxes[:, 3].max()), 2),
+    ]
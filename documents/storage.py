@@ -0,0 +1,247 @@
+"""
+文档文件存储
+上传的原始文件、页面图像等文档文件都通过本模块读写。数据库中保存的storage_path/image_path
+是相对存储根的存储名，与Web进程、工作进程的当前目录无关，不同节点只要使用同一存储即可访问。
+
+新文件按键的哈希分片存放（如 uploads/3f/a2/<uuid>.pdf），避免单个目录下的文件数无限增长。
+后端由DOCUMENT_STORAGE_BACKEND选择:
+    LocalDocumentStorage  本地或共享挂载的目录（DOCUMENT_STORAGE_ROOT，默认MEDIA_ROOT）
+    S3DocumentStorage     S3兼容对象存储（AWS S3、MinIO等），endpoint_url可指向本地的兼容服务
+读写均为流式：write逐块写入（S3使用分段上传），open返回可逐块读取的文件对象；
+PyMuPDF、PIL等需要文件路径的处理通过local_path取得本地文件（对象存储会先流式下载到临时文件）。
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# 流式读写的块大小
+CHUNK_SIZE = 1024 * 1024
+
+
+def sharded_name(prefix, key, suffix=''):
+    """按键的哈希取两级分片目录: prefix/ab/cd/key+suffix"""
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return f"{prefix}/{digest[:2]}/{digest[2:4]}/{key}{suffix}"
+
+
+def upload_name(filename):
+    """上传文件的存储名，保留原文件扩展名"""
+    return sharded_name('uploads', uuid.uuid4().hex, os.path.splitext(filename)[1].lower())
+
+
+def read_chunks(file_obj, chunk_size=CHUNK_SIZE):
+    """逐块读取文件对象"""
+    return iter(lambda: file_obj.read(chunk_size), b'')
+
+
+class LocalDocumentStorage:
+    """本地目录存储，写入先落临时文件再原子替换，读取方不会看到写了一半的文件"""
+
+    def __init__(self, root=None):
+        self._root = root
+
+    @property
+    def root(self):
+        return os.path.abspath(self._root or settings.DOCUMENT_STORAGE_ROOT)
+
+    def path(self, name):
+        root = self.root
+        path = os.path.abspath(os.path.join(root, name))
+        if not path.startswith(root + os.sep):
+            raise ValueError(f"存储名超出存储目录: {name}")
+        return path
+
+    def open(self, name):
+        return open(self.path(name), 'rb')
+
+    def write(self, name, chunks):
+        """将字节块逐块写入，返回写入的字节数；写入出错时不留下部分文件"""
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        size = 0
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in chunks:
+                    size += len(chunk)
+                    f.write(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return size
+
+    def save_file(self, name, source_path):
+        """将本地文件移入存储（同一文件系统时直接重命名），源文件随后不再存在"""
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(source_path, path)
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def size(self, name):
+        return os.path.getsize(self.path(name))
+
+    def delete(self, name):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def local_path(self, name):
+        yield self.path(name)
+
+    def local_file(self, name):
+        """文件在本地文件系统中的路径，可交给serve_file支持条件请求、Range和sendfile"""
+        return self.path(name)
+
+    def url(self, name, filename=None):
+        return None
+
+
+class S3DocumentStorage:
+    """
+    S3兼容对象存储（依赖boto3，按需导入）
+    DOCUMENT_STORAGE_S3中的endpoint_url可指向MinIO等本地兼容服务，便于开发与测试
+    """
+
+    def __init__(self, **options):
+        options = {**settings.DOCUMENT_STORAGE_S3, **options}
+        self.bucket = options['bucket']
+        self.prefix = options.get('prefix', '').strip('/')
+        # 分段上传的最小分段为5MB
+        self.part_size = max(options.get('part_size') or 0, 5 * 1024 * 1024)
+        self.url_expires = options.get('url_expires', 300)
+        self._client_options = {
+            'endpoint_url': options.get('endpoint_url'),
+            'region_name': options.get('region_name'),
+            'aws_access_key_id': options.get('access_key'),
+            'aws_secret_access_key': options.get('secret_key'),
+        }
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+
+            self._client = boto3.client('s3', **self._client_options)
+        return self._client
+
+    def key(self, name):
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    def open(self, name):
+        """返回对象内容的流式文件对象（botocore StreamingBody）"""
+        return self.client.get_object(Bucket=self.bucket, Key=self.key(name))['Body']
+
+    def write(self, name, chunks):
+        """
+        将字节块逐块上传，返回写入的字节数
+        累积到一个分段大小后以分段上传写出，小文件直接单次上传；出错时中止分段上传
+        """
+        key = self.key(name)
+        buffer = bytearray()
+        size = 0
+        upload_id = None
+        parts = []
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                buffer += chunk
+                if len(buffer) >= self.part_size:
+                    if upload_id is None:
+                        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)['UploadId']
+                    parts.append(self._upload_part(key, upload_id, len(parts) + 1, bytes(buffer)))
+                    buffer.clear()
+
+            if upload_id is None:
+                self.client.put_object(Bucket=self.bucket, Key=key, Body=bytes(buffer))
+                return size
+            if buffer:
+                parts.append(self._upload_part(key, upload_id, len(parts) + 1, bytes(buffer)))
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts}
+            )
+        except BaseException:
+            if upload_id is not None:
+                self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+        return size
+
+    def _upload_part(self, key, upload_id, number, data):
+        response = self.client.upload_part(Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=data)
+        return {'PartNumber': number, 'ETag': response['ETag']}
+
+    def save_file(self, name, source_path):
+        """上传本地文件（boto3按大小自动分段并发上传）后删除源文件"""
+        self.client.upload_file(source_path, self.bucket, self.key(name))
+        os.remove(source_path)
+
+    def _head(self, name):
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def exists(self, name):
+        return self._head(name) is not None
+
+    def size(self, name):
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head['ContentLength']
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    @contextmanager
+    def local_path(self, name):
+        """流式下载到临时文件，退出时删除"""
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(name)[1])
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                self.client.download_fileobj(self.bucket, self.key(name), f)
+            yield path
+        finally:
+            os.remove(path)
+
+    def local_file(self, name):
+        return None
+
+    def url(self, name, filename=None):
+        """限时的预签名下载地址，下载流量直接由对象存储承担"""
+        params = {'Bucket': self.bucket, 'Key': self.key(name)}
+        if filename:
+            from django.utils.http import content_disposition_header
+
+            params['ResponseContentDisposition'] = content_disposition_header(True, filename)
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=self.url_expires)
+
+
+_storage = None
+_storage_path = None
+
+
+def get_document_storage():
+    """按DOCUMENT_STORAGE_BACKEND创建的文档存储（每个进程一个实例，配置变化时重新创建）"""
+    global _storage, _storage_path
+    path = settings.DOCUMENT_STORAGE_BACKEND
+    if _storage is None or _storage_path != path:
+        _storage = import_string(path)()
+        _storage_path = path
+    return _storage
@@ -0,0 +1,106 @@
+"""
+文档处理进度的SSE（Server-Sent Events）接口
+异步视图由core/asgi.py的ASGI应用直接服务，每个连接只占用一个协程；
+连接后先推送一次当前状态快照（snapshot事件），之后转发进度频道中的事件（见documents.progress）。
+客户端断开时Django取消流式响应，订阅随之关闭。
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from documents.models import Document, UploadBatch
+from documents.progress import batch_channel, document_channel, get_progress_broker
+from documents.views import batch_progress_summary
+
+
+def _authenticate(request):
+    """使用REST_FRAMEWORK配置的认证方式（会话、Basic）认证请求，返回用户"""
+    authenticators = [authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    try:
+        return Request(request, authenticators=authenticators).user
+    except APIException:
+        return None
+
+
+def _format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+async def _event_stream(channel, snapshot):
+    """先订阅再生成快照，避免两者之间发布的事件丢失；空闲时发送心跳注释保持连接"""
+    subscription = await get_progress_broker().subscribe([channel])
+    try:
+        yield _format_event('snapshot', await sync_to_async(snapshot)())
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.DOCUMENT_PROGRESS_STREAM_MAX_SECONDS
+        while (remaining := deadline - loop.time()) > 0:
+            event = await subscription.get(min(settings.DOCUMENT_PROGRESS_KEEPALIVE_SECONDS, remaining))
+            yield _format_event(event['event'], event) if event else ': keepalive\n\n'
+    finally:
+        await subscription.close()
+
+
+async def _authenticated(request):
+    user = await sync_to_async(_authenticate)(request)
+    return user is not None and user.is_authenticated
+
+
+def _unauthorized():
+    return JsonResponse({'detail': '身份认证信息未提供或无效'}, status=401)
+
+
+def _stream_response(channel, snapshot):
+    response = StreamingHttpResponse(_event_stream(channel, snapshot), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # 关闭Nginx对该响应的缓冲，事件才能即时送达
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_GET
+async def document_events(request, pk):
+    """
+    订阅单个文档的处理进度
+    快照包含文档状态与已写入页数
+    """
+    if not await _authenticated(request):
+        return _unauthorized()
+    if not await Document.objects.filter(pk=pk).aexists():
+        raise Http404
+
+    def snapshot():
+        document = Document.objects.annotate(page_count=Count('pages')).only('id', 'status', 'batch_id').get(pk=pk)
+        return {
+            'document_id': str(document.id),
+            'batch_id': str(document.batch_id) if document.batch_id else None,
+            'status': document.status,
+            'page_count': document.page_count,
+        }
+
+    return _stream_response(document_channel(pk), snapshot)
+
+
+@require_GET
+async def batch_events(request, batch_id):
+    """
+    订阅批量上传批次的处理进度，推送批次内所有文档的事件
+    快照与GET batches/{id}/ 的返回相同
+    """
+    if not await _authenticated(request):
+        return _unauthorized()
+    if not await UploadBatch.objects.filter(pk=batch_id).aexists():
+        raise Http404
+
+    def snapshot():
+        return batch_progress_summary(get_object_or_404(UploadBatch, pk=batch_id))
+
+    return _stream_response(batch_channel(batch_id), snapshot)
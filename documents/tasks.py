@@ -1,192 +1,883 @@
-from celery import shared_task
+from celery import shared_task, chain, chord, group
+from celery.exceptions import Ignore
 from celery.utils.log import get_task_logger
 from django.conf import settings
-from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+import gc
 import os
+import resource
+import tempfile
+import hashlib
+import time
 import fitz  # PyMuPDF
 import json
+from datetime import timedelta
+from PIL import Image, ImageSequence
 
-from documents.models import Document, DocumentPage
+from documents.models import Document, DocumentPage, PageCheckpoint, UploadSession
+from documents.normalize import normalize_for_ocr
+from documents.page_images import page_raster_zoom, png_size, summarize_page_images, write_page_images
+from documents.progress import publish_document_event
+from documents.storage import get_document_storage, read_chunks, sharded_name
+from documents.ocr import ocr_pool, ocr_batcher
+from documents.word import iter_word_pages
 from audit.models import AuditLog, SystemLog
+from extractions.models import ExtractionResult
+from extractions.tasks import extract_fields
+from prompts.models import PromptTemplate
 
 logger = get_task_logger(__name__)
 
-@shared_task
-def preprocess_document(document_id):
+@shared_task(bind=True)
+def preprocess_document(self, document_id, force=False):
     """
     预处理文档任务
     1. 根据文档类型使用不同的处理方式
     2. 提取文本和布局信息
-    3. 创建DocumentPage记录
+    3. 按(document, page_num)写入或更新DocumentPage记录
+    大型PDF会被拆分为多个页码区间子任务并行处理，由finalize_pdf_chunks汇总
+    重新处理时跳过指纹未变化的页面，force为True时全部重新处理
+    PDF处理超过内存上限时，剩余页面拆分为新的分片任务继续处理
     """
     try:
         document = Document.objects.get(id=document_id)
+        register_attempt(document, self.request.id)
         logger.info(f"开始预处理文档: {document.filename}")
         
         # 更新文档状态
         document.status = 'processing'
         document.save()
+        publish_document_event(document, 'status', status=document.status)
         
-        # 创建存储目录
-        pages_dir = os.path.join('document_pages', str(document.id))
-        os.makedirs(settings.MEDIA_ROOT / pages_dir, exist_ok=True)
+        # 页面图像的存储名前缀
+        pages_dir = get_pages_dir(document)
         
         # 根据文档类型进行处理
         if document.source_type == 'pdf':
-            process_pdf(document, pages_dir)
+            chunks = plan_pdf_chunks(document)
+            if chunks:
+                # 用分片工作流替换当前任务，最终状态由汇总任务更新
+                logger.info(f"PDF拆分为{len(chunks)}个分片处理: {document.filename}")
+                return self.replace(build_pdf_chunk_workflow(document.id, chunks, force))
+            try:
+                process_pdf(document, pages_dir, force=force, checkpoint_key=self.request.id)
+            except MemoryCeilingExceeded as e:
+                logger.warning(f"{document.filename}: {str(e)}")
+                return self.replace(chain(
+                    process_pdf_chunk.si(str(document.id), e.next_page, e.end_page, force),
+                    finalize_pdf_chunks.si(str(document.id), e.end_page)
+                ))
         elif document.source_type == 'image':
-            process_image(document, pages_dir)
+            process_image(document, pages_dir, force=force)
         elif document.source_type == 'word':
-            # TODO: 实现Word文档处理
-            process_word(document, pages_dir)
+            process_word(document, pages_dir, force=force)
         else:
             raise ValueError(f"不支持的文档类型: {document.source_type}")
         
-        # 更新文档状态为已处理
-        document.status = 'preprocessed'
-        document.save()
-        
-        logger.info(f"文档预处理完成: {document.filename}")
+        return finish_preprocess(document)
         
-        # 记录系统日志
-        SystemLog.objects.create(
-            level=SystemLog.LEVEL_INFO,
-            message=f"文档预处理成功",
-            source='document_preprocess',
-            context={'document_id': str(document.id), 'filename': document.filename}
+    except Ignore:
+        # 任务已被分片工作流替换
+        raise
+    except Exception as e:
+        fail_preprocess(document_id, e)
+        raise
+    finally:
+        release_checkpoint(self.request.id)
+
+def get_pages_dir(document):
+    """文档页面图像的存储名前缀（按文档ID分片）"""
+    return sharded_name('document_pages', str(document.id))
+
+def finish_preprocess(document):
+    """将文档标记为预处理完成，汇总页面图像输出并记录系统日志"""
+    document.status = 'preprocessed'
+    record_page_image_metrics(document)
+    document.save()
+    publish_document_event(document, 'status', status=document.status, page_count=document.pages.count())
+    
+    logger.info(f"文档预处理完成: {document.filename}")
+    
+    # 记录系统日志
+    SystemLog.objects.create(
+        level=SystemLog.LEVEL_INFO,
+        message=f"文档预处理成功",
+        source='document_preprocess',
+        context={'document_id': str(document.id), 'filename': document.filename}
+    )
+    
+    return {'status': 'success', 'document_id': str(document.id)}
+
+def fail_preprocess(document_id, error):
+    """将文档标记为预处理失败并记录错误日志"""
+    logger.error(f"文档预处理失败: {str(error)}")
+    
+    # 更新文档状态为失败（逐条保存以同步状态计数）
+    document = Document.objects.filter(id=document_id).first()
+    if document:
+        document.status = 'failed'
+        document.save()
+        publish_document_event(document, 'error', stage='preprocess', error=str(error))
+        publish_document_event(document, 'status', status=document.status)
+    
+    # 记录错误日志
+    SystemLog.objects.create(
+        level=SystemLog.LEVEL_ERROR,
+        message=f"文档预处理失败: {str(error)}",
+        source='document_preprocess',
+        context={'document_id': str(document_id)}
+    )
+
+def plan_pdf_chunks(document):
+    """
+    规划PDF分片
+    返回[(start, end), ...]页码区间（从0开始，左闭右开）；无需拆分时返回空列表
+    """
+    if not settings.DOCUMENT_PDF_FANOUT_ENABLED:
+        return []
+    
+    chunk_size = max(1, settings.DOCUMENT_PDF_CHUNK_SIZE)
+    with get_document_storage().local_path(document.storage_path) as pdf_path, fitz.open(pdf_path) as pdf:
+        page_count = len(pdf)
+    
+    if page_count <= chunk_size:
+        return []
+    
+    return [(start, min(start + chunk_size, page_count)) for start in range(0, page_count, chunk_size)]
+
+def build_pdf_chunk_workflow(document_id, chunks, force=False):
+    """
+    构建分片工作流
+    分片按轮询方式分配到最多DOCUMENT_PDF_MAX_PARALLEL_CHUNKS条通道，
+    同一通道内的分片串行执行，所有通道完成后执行汇总任务
+    """
+    lane_count = max(1, min(settings.DOCUMENT_PDF_MAX_PARALLEL_CHUNKS, len(chunks)))
+    lanes = [[] for _ in range(lane_count)]
+    for index, (start, end) in enumerate(chunks):
+        lanes[index % lane_count].append(process_pdf_chunk.si(str(document_id), start, end, force))
+    
+    header = group([chain(*lane) if len(lane) > 1 else lane[0] for lane in lanes])
+    return chord(header, finalize_pdf_chunks.si(str(document_id), chunks[-1][1]))
+
+@shared_task(bind=True)
+def process_pdf_chunk(self, document_id, start_page, end_page, force=False):
+    """
+    处理PDF的一个页码区间 [start_page, end_page)
+    超过内存上限时用剩余页码区间的新任务替换当前任务（在分片工作流中占据同一位置）
+    """
+    try:
+        document = Document.objects.get(id=document_id)
+        register_attempt(document, self.request.id)
+        logger.info(f"处理PDF分片: {document.filename} 第{start_page + 1}-{end_page}页")
+        written, skipped = process_pdf(
+            document,
+            get_pages_dir(document),
+            page_range=(start_page, end_page),
+            force=force,
+            checkpoint_key=self.request.id
         )
-        
-        return {'status': 'success', 'document_id': str(document.id)}
-        
+        return {'document_id': str(document_id), 'pages': end_page - start_page, 'written': written, 'skipped': skipped}
+    except MemoryCeilingExceeded as e:
+        logger.warning(f"{document.filename}: {str(e)}")
+        return self.replace(process_pdf_chunk.si(document_id, e.next_page, end_page, force))
+    except Ignore:
+        raise
     except Exception as e:
-        logger.error(f"文档预处理失败: {str(e)}")
-        
-        # 更新文档状态为失败
-        if 'document' in locals():
-            document.status = 'failed'
-            document.save()
+        fail_preprocess(document_id, e)
+        raise
+    finally:
+        release_checkpoint(self.request.id)
+
+@shared_task
+def finalize_pdf_chunks(document_id, page_count):
+    """汇总任务：所有分片完成后才将文档标记为预处理完成"""
+    try:
+        document = Document.objects.get(id=document_id)
+        remove_stale_pages(document, page_count)
         
-        # 记录错误日志
-        SystemLog.objects.create(
-            level=SystemLog.LEVEL_ERROR,
-            message=f"文档预处理失败: {str(e)}",
-            source='document_preprocess',
-            context={'document_id': str(document_id) if 'document_id' in locals() else None}
-        )
+        written = DocumentPage.objects.filter(document=document).count()
+        if written < page_count:
+            raise ValueError(f"分片处理不完整: 已写入{written}页，共{page_count}页")
         
+        return finish_preprocess(document)
+    except Exception as e:
+        fail_preprocess(document_id, e)
         raise
 
-def process_pdf(document, pages_dir):
-    """处理PDF文档"""
-    pdf_path = os.path.join(settings.MEDIA_ROOT, document.storage_path)
+# 页面已存在时由upsert覆盖的字段
+PAGE_UPSERT_FIELDS = [
+    'text', 'image_path', 'image_variants', 'image_baseline_bytes', 'layout_json', 'layout_blob', 'layout_index',
+    'ocr_confidence', 'fingerprint',
+]
+
+class PageBuffer:
+    """
+    DocumentPage写入缓冲
+    累积到DOCUMENT_PAGE_BULK_BATCH_SIZE条后在单个事务中批量upsert，
+    (document, page_num)已存在时覆盖原记录，重新处理不会产生重复页面；
+    作为上下文管理器使用时退出前写入剩余记录
+    指定document时每次写入后发布pages进度事件（本批写入及此前跳过的页数），page_count为文档总页数；
+    指定checkpoint时在写入页面的同一事务中把检查点推进到next_page；
+    跳过的页面（skip）与写入的页面一样计入批次，整批都被跳过时也推进检查点
+    """
     
-    with fitz.open(pdf_path) as pdf:
-        for page_num in range(len(pdf)):
-            page = pdf[page_num]
-            
-            # 提取文本
-            text = page.get_text()
-            
-            # 提取文本块和坐标
-            blocks = page.get_text('dict')['blocks']
-            layout_data = []
-            
-            for block in blocks:
-                if 'lines' in block:
-                    for line in block['lines']:
-                        for span in line['spans']:
-                            layout_data.append({
-                                'text': span['text'],
-                                'bbox': [span['bbox'][0], span['bbox'][1], span['bbox'][2], span['bbox'][3]],
-                                'size': span['size']
-                            })
-            
-            # 保存页面图像
-            pix = page.get_pixmap()
-            img_bytes = pix.tobytes()
-            image_filename = f"page_{page_num + 1}.png"
-            image_path = os.path.join(pages_dir, image_filename)
-            
-            with default_storage.open(image_path, 'wb') as f:
-                f.write(img_bytes)
-            
-            # 创建DocumentPage记录
-            DocumentPage.objects.create(
-                document=document,
-                page_num=page_num + 1,
-                text=text,
-                image_path=image_path,
-                layout_json=layout_data
+    def __init__(self, batch_size=None, document=None, page_count=None, checkpoint=None):
+        self.batch_size = max(1, batch_size or settings.DOCUMENT_PAGE_BULK_BATCH_SIZE)
+        self.document = document
+        self.page_count = page_count
+        self.checkpoint = checkpoint
+        self.next_page = None
+        self.pages = []
+        self.written = 0
+        self.skipped = 0
+        self._pending_skips = 0
+        self._reported = (0, 0)
+    
+    def add(self, page):
+        self.pages.append(page)
+        if len(self.pages) + self._pending_skips >= self.batch_size:
+            self.flush()
+    
+    def skip(self):
+        """记录一个内容未变化而跳过的页面"""
+        self.skipped += 1
+        self._pending_skips += 1
+        if len(self.pages) + self._pending_skips >= self.batch_size:
+            self.flush()
+    
+    def flush(self):
+        advance = self.checkpoint is not None and self.next_page is not None and self.next_page != self.checkpoint.next_page
+        if self.pages or advance:
+            with transaction.atomic():
+                if self.pages:
+                    DocumentPage.objects.bulk_create(
+                        self.pages,
+                        batch_size=self.batch_size,
+                        update_conflicts=True,
+                        unique_fields=['document', 'page_num'],
+                        update_fields=PAGE_UPSERT_FIELDS
+                    )
+                if advance:
+                    self.checkpoint.next_page = self.next_page
+                    self.checkpoint.save(update_fields=['next_page', 'updated_at'])
+            self.written += len(self.pages)
+            self.pages = []
+        self._pending_skips = 0
+        self._report_progress()
+    
+    def _report_progress(self):
+        if self.document is None:
+            return
+        written = self.written - self._reported[0]
+        skipped = self.skipped - self._reported[1]
+        if written or skipped:
+            publish_document_event(self.document, 'pages', written=written, skipped=skipped, page_count=self.page_count)
+            self._reported = (self.written, self.skipped)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        # 出错时也写入已完成的页面
+        self.flush()
+        return False
+
+# 页面处理流程版本，处理逻辑变化影响输出时递增，使已有页面在重新处理时失效
+PAGE_PIPELINE_VERSIONS = {'pdf': 1, 'image': 1, 'word': 1}
+
+def page_pipeline_options(source_type):
+    """影响页面处理结果的配置项，参与页面指纹计算"""
+    options = {
+        'layout_format': settings.DOCUMENT_LAYOUT_FORMAT,
+        'spatial_index': settings.DOCUMENT_LAYOUT_SPATIAL_INDEX,
+        'index_min_spans': settings.DOCUMENT_LAYOUT_INDEX_MIN_SPANS,
+    }
+    # 页面图像输出规格只影响入库时保存页面图像的页面
+    if source_type == 'image' or (source_type == 'pdf' and settings.DOCUMENT_PDF_RASTERIZE_ON_INGEST):
+        options['page_images'] = {
+            'profiles': settings.DOCUMENT_PAGE_IMAGE_PROFILES,
+            'primary': settings.DOCUMENT_PAGE_IMAGE_PRIMARY_PROFILE,
+        }
+    if source_type == 'pdf':
+        options['rasterize'] = settings.DOCUMENT_PDF_RASTERIZE_ON_INGEST
+    elif source_type == 'image':
+        options.update({
+            name.lower(): getattr(settings, name)
+            for name in (
+                'DOCUMENT_OCR_LANG', 'DOCUMENT_OCR_USE_ANGLE_CLS', 'DOCUMENT_OCR_NORMALIZE_ENABLED',
+                'DOCUMENT_OCR_GRAYSCALE', 'DOCUMENT_OCR_MAX_LONG_EDGE', 'DOCUMENT_OCR_TRIM_BORDERS',
+                'DOCUMENT_OCR_TRIM_TOLERANCE', 'DOCUMENT_OCR_DESKEW', 'DOCUMENT_OCR_DESKEW_MAX_ANGLE',
             )
+        })
+    elif source_type == 'word':
+        options['paragraphs_per_page'] = settings.DOCUMENT_WORD_PARAGRAPHS_PER_PAGE
+        options['rendered_breaks'] = settings.DOCUMENT_WORD_USE_RENDERED_PAGE_BREAKS
+    return options
 
-def process_image(document, pages_dir):
-    """处理图像文档"""
-    image_path = os.path.join(settings.MEDIA_ROOT, document.storage_path)
+def page_fingerprint(source_type, source_bytes):
+    """页面指纹：页面源内容 + 处理流程版本 + 处理选项"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps({
+        'version': PAGE_PIPELINE_VERSIONS[source_type],
+        'options': page_pipeline_options(source_type),
+    }, sort_keys=True).encode('utf-8'))
+    digest.update(source_bytes)
+    return digest.hexdigest()
+
+def existing_fingerprints(document, page_range=None, force=False):
+    """已入库页面的{page_num: fingerprint}；force为True时返回空字典，使所有页面重新处理"""
+    if force:
+        return {}
+    pages = DocumentPage.objects.filter(document=document)
+    if page_range:
+        pages = pages.filter(page_num__gt=page_range[0], page_num__lte=page_range[1])
+    return dict(pages.values_list('page_num', 'fingerprint'))
+
+def remove_stale_pages(document, page_count):
+    """删除页码超出当前页数的旧页面（源文件变短或分页方式变化）"""
+    DocumentPage.objects.filter(document=document, page_num__gt=page_count).delete()
+
+def record_page_metrics(document, written, skipped):
+    document.processing_metrics = {
+        **(document.processing_metrics or {}),
+        'pages': {'written': written, 'skipped': skipped},
+    }
+    document.save()
+
+def record_page_image_metrics(document):
+    """汇总各页保存的页面图像（含分片处理、重新处理时跳过的页面），记入processing_metrics['page_images']"""
+    report = summarize_page_images(
+        document.pages.exclude(image_variants={}).values_list('image_variants', 'image_baseline_bytes').iterator()
+    )
+    metrics = dict(document.processing_metrics or {})
+    if report:
+        metrics['page_images'] = report
+    else:
+        metrics.pop('page_images', None)
+    document.processing_metrics = metrics
+
+def extract_page_content(page):
+    """
+    单次结构化解析PDF页面
+    从同一份dict结果中同时生成纯文本（与page.get_text()一致）和文本块布局
+    """
+    blocks = page.get_text('dict', flags=fitz.TEXTFLAGS_TEXT)['blocks']
+    lines = []
+    layout_data = []
     
-    # 延迟导入PaddleOCR
-    from paddleocr import PaddleOCR
+    for block in blocks:
+        for line in block.get('lines', ()):
+            spans = line['spans']
+            lines.append(''.join(span['text'] for span in spans) + '\n')
+            for span in spans:
+                bbox = span['bbox']
+                layout_data.append({
+                    'text': span['text'],
+                    'bbox': [bbox[0], bbox[1], bbox[2], bbox[3]],
+                    'size': span['size']
+                })
     
-    # 在函数内部初始化OCR引擎
-    ocr = PaddleOCR(use_angle_cls=True, lang='ch')
+    return ''.join(lines), layout_data
+
+class MemoryCeilingExceeded(Exception):
+    """页面处理时常驻内存超过上限；此前的页面均已提交，剩余页码区间为[next_page, end_page)"""
     
-    # 使用PaddleOCR识别文本
-    result = ocr.ocr(image_path, cls=True)
+    def __init__(self, next_page, end_page, rss_mb):
+        super().__init__(f"常驻内存{rss_mb:.0f}MB超过上限，第{next_page + 1}-{end_page}页拆分为新任务继续处理")
+        self.next_page = next_page
+        self.end_page = end_page
+
+def current_rss_mb():
+    """当前进程的常驻内存（MB）；无法读取/proc时退化为进程的峰值常驻内存"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def memory_ceiling_reached():
+    """常驻内存达到DOCUMENT_PDF_MEMORY_CEILING_MB时先释放MuPDF资源缓存并回收对象，仍超过上限时返回True"""
+    ceiling = settings.DOCUMENT_PDF_MEMORY_CEILING_MB
+    if not ceiling or current_rss_mb() < ceiling:
+        return False
+    fitz.TOOLS.store_shrink(100)
+    gc.collect()
+    return current_rss_mb() >= ceiling
+
+class DeliveryLimitExceeded(Exception):
+    """任务的执行次数超过上限（工作进程反复在处理该任务时被强制终止，如OOM）"""
+
+def register_attempt(document, task_id):
+    """
+    记录预处理任务的一次执行，返回任务的检查点
+    检查点在任务结束时删除，开始时已存在说明上一次执行中工作进程被强制终止、本次为重新投递；
+    执行次数超过DOCUMENT_TASK_MAX_DELIVERIES时删除检查点并抛出DeliveryLimitExceeded，文档标记为失败，不再重新投递
+    """
+    if not task_id:
+        return None
+    checkpoint, created = PageCheckpoint.objects.get_or_create(task_id=task_id, defaults={'document': document})
+    if created:
+        return checkpoint
     
-    # 提取文本和坐标
-    text = ''
-    layout_data = []
+    PageCheckpoint.objects.filter(pk=checkpoint.pk).update(attempts=F('attempts') + 1)
+    checkpoint.refresh_from_db()
+    if checkpoint.attempts > settings.DOCUMENT_TASK_MAX_DELIVERIES:
+        checkpoint.delete()
+        raise DeliveryLimitExceeded(f"任务已执行{checkpoint.attempts}次仍未完成（工作进程可能在处理时被强制终止），不再重试")
+    logger.warning(f"任务重新投递: {document.filename} 第{checkpoint.attempts}次执行")
+    return checkpoint
+
+def release_checkpoint(task_id):
+    """任务正常结束、失败或被替换时删除检查点"""
+    if task_id:
+        PageCheckpoint.objects.filter(task_id=task_id).delete()
+
+def load_checkpoint(document, checkpoint_key):
+    """获取任务的页面处理检查点，任务首次执行时创建"""
+    if not checkpoint_key:
+        return None
+    checkpoint, _ = PageCheckpoint.objects.get_or_create(
+        task_id=checkpoint_key,
+        defaults={'document': document, 'next_page': 0}
+    )
+    return checkpoint
+
+def process_pdf(document, pages_dir, page_range=None, force=False, checkpoint_key=None):
+    """
+    处理PDF文档
+    page_range为(start, end)时只处理该页码区间（从0开始，左闭右开）
+    页面内容流与处理选项均未变化的页面直接跳过；返回(写入页数, 跳过页数)
+    checkpoint_key为任务ID时按批次记录检查点，同一任务被中断后重新执行时从检查点继续；
+    常驻内存超过上限时提交已处理的页面并抛出MemoryCeilingExceeded，由调用方拆分剩余页面
+    """
+    storage = get_document_storage()
+    fingerprints = existing_fingerprints(document, page_range, force)
+    checkpoint = load_checkpoint(document, checkpoint_key)
     
-    if result and result[0]:
-        for line in result[0]:
-            line_text = ''.join([item[1][0] for item in line])
-            text += line_text + '\n'
+    try:
+        with storage.local_path(document.storage_path) as pdf_path, fitz.open(pdf_path) as pdf, \
+                PageBuffer(document=document, page_count=len(pdf), checkpoint=checkpoint) as buffer:
+            page_count = len(pdf)
+            start, end = page_range or (0, page_count)
+            end = min(end, page_count)
+            if checkpoint and checkpoint.next_page > start:
+                logger.info(f"从检查点继续处理: {document.filename} 第{checkpoint.next_page + 1}页")
+                start = checkpoint.next_page
             
-            # 获取边界框
-            for item in line:
-                bbox = item[0]
-                text_content = item[1][0]
-                confidence = item[1][1]
+            for page_num in range(start, end):
+                if page_num > start and memory_ceiling_reached():
+                    buffer.flush()
+                    raise MemoryCeilingExceeded(page_num, end, current_rss_mb())
                 
-                layout_data.append({
-                    'text': text_content,
-                    'bbox': [bbox[0][0], bbox[0][1], bbox[2][0], bbox[2][1]],
-                    'confidence': float(confidence)
-                })
+                page = pdf[page_num]
+                fingerprint = page_fingerprint('pdf', repr((tuple(page.rect), page.rotation)).encode('utf-8') + page.read_contents())
+                buffer.next_page = page_num + 1
+                if fingerprints.get(page_num + 1) == fingerprint:
+                    buffer.skip()
+                    continue
+                
+                # 提取文本和文本块坐标
+                text, layout_data = extract_page_content(page)
+                
+                # 默认不在入库时渲染页面图像，由page-image接口按需渲染并缓存
+                image_path, image_variants, baseline_bytes = '', {}, None
+                if settings.DOCUMENT_PDF_RASTERIZE_ON_INGEST:
+                    image_path, image_variants, baseline_bytes = rasterize_pdf_page(page, pages_dir, page_num + 1)
+                
+                # 缓冲DocumentPage记录，按批次写入；布局编码后即释放原始片段列表
+                page_record = DocumentPage(
+                    document=document,
+                    page_num=page_num + 1,
+                    text=text,
+                    image_path=image_path,
+                    image_variants=image_variants,
+                    image_baseline_bytes=baseline_bytes,
+                    fingerprint=fingerprint
+                )
+                page_record.set_layout(layout_data)
+                layout_data = page = None
+                buffer.add(page_record)
+    except Exception:
+        # 正常结束或出错时删除检查点；工作进程被强制终止时不会执行到这里，检查点保留供重新投递的任务继续
+        if checkpoint:
+            checkpoint.delete()
+        raise
+    if checkpoint:
+        checkpoint.delete()
+    
+    if page_range is None:
+        remove_stale_pages(document, page_count)
+        record_page_metrics(document, buffer.written, buffer.skipped)
+    return buffer.written, buffer.skipped
+
+def rasterize_pdf_page(page, pages_dir, page_num):
+    """
+    入库时渲染PDF页面图像：按最大规格渲染一次，各规格由该位图缩放编码后写入存储
+    返回(主规格存储名, 各规格信息, 旧版本在默认分辨率下输出的PNG字节数)
+    PNG基准需要额外编码一次，只对DOCUMENT_PAGE_IMAGE_BASELINE_SAMPLE_INTERVAL抽样的页面计算，其余页面为None
+    """
+    zoom = page_raster_zoom(page.rect.width, page.rect.height)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+    image = Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+    # 像素缓冲区较大，转换后立即释放
+    pix = None
+    
+    image_path, variants = write_page_images(image, pages_dir, page_num)
+    baseline_bytes = None
+    interval = settings.DOCUMENT_PAGE_IMAGE_BASELINE_SAMPLE_INTERVAL
+    if interval and (page_num - 1) % interval == 0:
+        # 旧版本以72DPI渲染并保存PNG，按同一尺寸计算基准大小
+        baseline = image.resize((max(1, round(page.rect.width)), max(1, round(page.rect.height))), Image.Resampling.LANCZOS)
+        baseline_bytes = png_size(baseline)
+        baseline.close()
+    image.close()
+    return image_path, variants, baseline_bytes
+
+def parse_ocr_lines(lines, transform=None):
+    """
+    将PaddleOCR单张图像的识别结果[[box, (text, confidence)], ...]转换为文本、布局和平均置信度
+    transform为规范化图像到原图的坐标变换，布局中的bbox统一为原图坐标
+    """
+    texts = []
+    layout_data = []
+    
+    for box, (text_content, confidence) in lines or []:
+        points = [transform.to_original(x, y) for x, y in box] if transform else box
+        xs = [point[0] for point in points]
+        ys = [point[1] for point in points]
+        texts.append(text_content)
+        layout_data.append({
+            'text': text_content,
+            'bbox': [min(xs), min(ys), max(xs), max(ys)],
+            'confidence': float(confidence)
+        })
+    
+    text = ''.join(line + '\n' for line in texts)
+    confidence = sum(item['confidence'] for item in layout_data) / len(layout_data) if layout_data else None
+    return text, layout_data, confidence
+
+def ocr_image_file(path):
+    """
+    使用工作进程内预热的OCR引擎识别单张图像文件
+    开启规范化时先灰度化、裁边、缩小和纠偏，识别坐标再映射回原图
+    开启微批处理时与同一进程内其他调用提交的图像合并推理
+    返回(text, layout_data, confidence, stats)
+    """
+    image = path
+    transform = None
+    stats = {}
+    
+    if settings.DOCUMENT_OCR_NORMALIZE_ENABLED:
+        started = time.perf_counter()
+        with Image.open(path) as source:
+            image, transform, stats = normalize_for_ocr(source)
+        stats['normalize_seconds'] = time.perf_counter() - started
+    
+    engine = ocr_batcher if settings.DOCUMENT_OCR_BATCHING_ENABLED else ocr_pool
+    started = time.perf_counter()
+    result = engine.ocr(
+        image,
+        lang=settings.DOCUMENT_OCR_LANG,
+        use_angle_cls=settings.DOCUMENT_OCR_USE_ANGLE_CLS
+    )
+    stats['ocr_seconds'] = time.perf_counter() - started
+    
+    return (*parse_ocr_lines(result[0] if result else None, transform), stats)
+
+def summarize_ocr_stats(frame_stats):
+    """
+    汇总各帧的规范化与识别耗时
+    OCR耗时近似与像素数成正比，据此估算规范化节省的识别时间
+    """
+    summary = {
+        'frames': len(frame_stats),
+        'pixels_before': sum(stats.get('pixels_before', 0) for stats in frame_stats),
+        'pixels_after': sum(stats.get('pixels_after', 0) for stats in frame_stats),
+        'normalize_seconds': round(sum(stats.get('normalize_seconds', 0) for stats in frame_stats), 3),
+        'ocr_seconds': round(sum(stats['ocr_seconds'] for stats in frame_stats), 3),
+    }
+    if summary['pixels_after']:
+        ratio = summary['pixels_before'] / summary['pixels_after']
+        summary['estimated_seconds_saved'] = round(summary['ocr_seconds'] * (ratio - 1) - summary['normalize_seconds'], 3)
+    return summary
+
+def iter_image_frames(source_path):
+    """
+    逐帧产出(page_num, 帧图像, 帧内容摘要, 供OCR读取的本地图像路径)
+    单帧图像直接识别原文件；多帧图像（如多页传真TIFF）的本地路径为None，
+    由调用方确认需要识别后再用write_frame_png另存，跳过的帧不落盘
+    帧图像只在下一次迭代前有效
+    """
+    with Image.open(source_path) as image:
+        frame_count = getattr(image, 'n_frames', 1)
+        if frame_count <= 1:
+            digest = hashlib.sha256()
+            with open(source_path, 'rb') as f:
+                for chunk in read_chunks(f):
+                    digest.update(chunk)
+            yield 1, image, digest.digest(), source_path
+            return
+        
+        for index, frame in enumerate(ImageSequence.Iterator(image)):
+            frame = frame.convert('RGB')
+            yield index + 1, frame, hashlib.sha256(frame.tobytes()).digest(), None
+
+def write_frame_png(frame, work_dir, page_num):
+    """将多帧图像的一帧另存为PNG供OCR读取，返回本地路径"""
+    local_path = os.path.join(work_dir, f"page_{page_num}.png")
+    frame.save(local_path, format='PNG')
+    return local_path
+
+def process_image(document, pages_dir, force=False):
+    """
+    处理图像文档
+    多帧图像的每一帧作为一页，在有界线程池中并行OCR；
+    每帧识别完成后立即写入页面记录并删除该帧的本地副本，中途失败时已完成的帧不会丢失；
+    帧内容与OCR选项均未变化的页面在重新处理时跳过
+    """
+    fingerprints = existing_fingerprints(document, force=force)
+    max_workers = max(1, settings.DOCUMENT_OCR_MAX_WORKERS)
+    
+    frame_stats = []
+    page_count = 0
+    
+    def save_page(future):
+        page_num, image_path, image_variants, baseline_bytes, fingerprint, frame_path = pending.pop(future)
+        try:
+            text, layout_data, confidence, stats = future.result()
+        finally:
+            if frame_path:
+                os.remove(frame_path)
+        frame_stats.append(stats)
+        page = DocumentPage(
+            document=document,
+            page_num=page_num,
+            text=text,
+            image_path=image_path,
+            image_variants=image_variants,
+            image_baseline_bytes=baseline_bytes,
+            ocr_confidence=confidence,
+            fingerprint=fingerprint
+        )
+        page.set_layout(layout_data)
+        buffer.add(page)
+    
+    pending = {}
+    with get_document_storage().local_path(document.storage_path) as source_path, \
+            tempfile.TemporaryDirectory() as work_dir, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            PageBuffer(batch_size=1, document=document) as buffer:
+        for page_num, frame, frame_digest, local_path in iter_image_frames(source_path):
+            page_count = page_num
+            fingerprint = page_fingerprint('image', frame_digest)
+            if fingerprints.get(page_num) == fingerprint:
+                buffer.skip()
+                continue
+            
+            frame_path = None
+            if local_path is None:
+                local_path = frame_path = write_frame_png(frame, work_dir, page_num)
+            # 旧版本保存原上传文件（单帧）或逐帧PNG作为页面图像
+            baseline_bytes = os.path.getsize(local_path)
+            image_path, image_variants = write_page_images(frame, pages_dir, page_num)
+            future = executor.submit(ocr_image_file, local_path)
+            pending[future] = (page_num, image_path, image_variants, baseline_bytes, fingerprint, frame_path)
+            
+            # 限制排队中的帧数，已识别的帧写入后即删除本地副本，超长TIFF的帧不会堆积在磁盘和内存中
+            if len(pending) >= max_workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=lambda future: pending[future][0]):
+                    save_page(future)
+        
+        for future in as_completed(list(pending)):
+            save_page(future)
+    
+    remove_stale_pages(document, page_count)
+    if frame_stats:
+        document.processing_metrics = {**(document.processing_metrics or {}), 'ocr': summarize_ocr_stats(frame_stats)}
+    record_page_metrics(document, buffer.written, buffer.skipped)
+
+def process_word(document, pages_dir, force=False):
+    """
+    处理Word文档
+    流式解析document.xml，按分页符或段落数上限划分逻辑页面并批量写入；
+    解析结果未变化的页面不重复写入
+    """
+    fingerprints = existing_fingerprints(document, force=force)
+    page_count = 0
+    
+    with get_document_storage().local_path(document.storage_path) as word_path, PageBuffer(document=document) as buffer:
+        for page_num, text, layout_data in iter_word_pages(
+            word_path,
+            paragraphs_per_page=settings.DOCUMENT_WORD_PARAGRAPHS_PER_PAGE,
+            use_rendered_breaks=settings.DOCUMENT_WORD_USE_RENDERED_PAGE_BREAKS
+        ):
+            page_count = page_num
+            fingerprint = page_fingerprint('word', json.dumps([text, layout_data], ensure_ascii=False).encode('utf-8'))
+            if fingerprints.get(page_num) == fingerprint:
+                buffer.skip()
+                continue
+            buffer.add(DocumentPage(
+                document=document,
+                page_num=page_num,
+                text=text,
+                image_path="",
+                layout_json=layout_data,
+                fingerprint=fingerprint
+            ))
+    
+    remove_stale_pages(document, page_count)
+    record_page_metrics(document, buffer.written, buffer.skipped)
+
+# 可直接复用页面结果的文档状态
+DEDUP_REUSABLE_STATUSES = ('preprocessed', 'extracting', 'extracted')
+
+def clone_document_results(source, target, include_extractions=False):
+    """
+    将内容相同的已处理文档的页面复制到新文档
+    include_extractions为True且源文档已完成抽取时，一并复制抽取结果
+    """
+    with transaction.atomic():
+        with PageBuffer() as buffer:
+            for page in source.pages.order_by('page_num').iterator():
+                buffer.add(DocumentPage(
+                    document=target,
+                    page_num=page.page_num,
+                    text=page.text,
+                    image_path=page.image_path,
+                    image_variants=page.image_variants,
+                    image_baseline_bytes=page.image_baseline_bytes,
+                    layout_json=page.layout_json,
+                    layout_blob=page.layout_blob,
+                    layout_index=page.layout_index,
+                    fingerprint=page.fingerprint,
+                    ocr_confidence=page.ocr_confidence
+                ))
+        
+        target.status = 'preprocessed'
+        if include_extractions and source.status == 'extracted':
+            results = [
+                ExtractionResult(
+                    document=target,
+                    field_def_id=result.field_def_id,
+                    value_raw=result.value_raw,
+                    normalized_value=result.normalized_value,
+                    confidence=result.confidence,
+                    page_num=result.page_num,
+                    bbox=result.bbox,
+                    model_name=result.model_name,
+                    model_version=result.model_version,
+                    prompt_version=result.prompt_version
+                )
+                for result in source.extraction_results.all()
+            ]
+            ExtractionResult.objects.bulk_create(results)
+            target.status = 'extracted'
+        target.save()
     
-    # 复制图像到页面目录
-    image_filename = "page_1.png"
-    dest_path = os.path.join(pages_dir, image_filename)
-    
-    with open(image_path, 'rb') as f:
-        with default_storage.open(dest_path, 'wb') as dest:
-            dest.write(f.read())
-    
-    # 创建DocumentPage记录
-    DocumentPage.objects.create(
-        document=document,
-        page_num=1,
-        text=text,
-        image_path=dest_path,
-        layout_json=layout_data
+    logger.info(f"复用已处理文档 {source.id} 的结果: {target.filename}")
+    
+    SystemLog.objects.create(
+        level=SystemLog.LEVEL_INFO,
+        message=f"重复上传，复用已处理结果",
+        source='document_dedup',
+        context={'document_id': str(target.id), 'source_document_id': str(source.id)}
+    )
+
+def pipeline_template_id(auto_extract=None, prompt_template_id=None):
+    """
+    确定处理流水线中字段抽取步骤使用的Prompt模板ID
+    auto_extract为None时使用DOCUMENT_AUTO_EXTRACT；不需要自动抽取或没有激活的模板时返回None
+    """
+    if auto_extract is None:
+        auto_extract = settings.DOCUMENT_AUTO_EXTRACT
+    if not auto_extract:
+        return None
+    if prompt_template_id:
+        return prompt_template_id
+    
+    template_id = (
+        PromptTemplate.objects.filter(is_active=True)
+        .order_by('-created_at')
+        .values_list('id', flat=True)
+        .first()
     )
+    if template_id is None:
+        logger.warning("未找到激活的Prompt模板，文档处理后不自动抽取字段")
+    return template_id
 
-def process_word(document, pages_dir):
-    """处理Word文档（占位实现）"""
-    # TODO: 实现Word文档处理逻辑
-    # 可以使用python-docx库
-    DocumentPage.objects.create(
-        document=document,
-        page_num=1,
-        text="Word文档处理待实现",
-        image_path="",
-        layout_json=[]
+def build_document_pipeline(document, force=False, prompt_template_id=None):
+    """
+    构建文档处理流水线：预处理，指定prompt_template_id时随后执行字段抽取
+    各步骤只传递文档ID和模板ID；预处理队列按已知的文档类型直接指定，无需路由时再查询文档。
+    大型PDF的预处理会被分片工作流替换，抽取步骤在汇总任务完成后执行；任一步骤失败时后续步骤不再执行
+    """
+    document_id = str(document.id)
+    preprocess = preprocess_document.si(document_id, force).set(
+        queue=settings.DOCUMENT_PREPROCESS_QUEUES.get(document.source_type, 'pdf_text')
     )
+    if not prompt_template_id:
+        return preprocess
+    return chain(preprocess, extract_fields.si(document_id, prompt_template_id))
 
 @shared_task
-def process_document_async(document_id):
+def process_document_async(document_id, force=False):
     """
     异步处理文档的任务
-    供views.py调用的接口函数
+    保留给旧版本投递的消息使用，新代码直接投递build_document_pipeline构建的流水线
+    """
+    document = Document.objects.get(id=document_id)
+    return build_document_pipeline(document, force).apply_async().id
+
+@shared_task
+def ocr_health_check(warm_up=False):
+    """
+    OCR引擎健康检查
+    返回当前工作进程中各引擎的数量、模型加载耗时与推理耗时；warm_up为True时先预热默认引擎
+    """
+    if warm_up:
+        ocr_pool.warm_up(
+            lang=settings.DOCUMENT_OCR_LANG,
+            use_angle_cls=settings.DOCUMENT_OCR_USE_ANGLE_CLS
+        )
+    health = ocr_pool.health()
+    if settings.DOCUMENT_OCR_BATCHING_ENABLED:
+        health['batching'] = ocr_batcher.health()
+    return health
+
+@shared_task
+def cleanup_upload_sessions():
+    """
+    清理过期的断点续传上传
+    超过DOCUMENT_UPLOAD_SESSION_EXPIRE_HOURS未收到分片的未完成会话标记为expired并删除暂存文件；
+    暂存目录中没有对应未完成会话且同样过期的.part文件（如创建会话中途失败留下的）一并删除
     """
-    return preprocess_document.delay(document_id)
\ No newline at end of file
+    cutoff = timezone.now() - timedelta(hours=settings.DOCUMENT_UPLOAD_SESSION_EXPIRE_HOURS)
+    temp_dir = settings.DOCUMENT_UPLOAD_TEMP_DIR
+    
+    expired = 0
+    sessions = UploadSession.objects.filter(status__in=('uploading', 'finalizing'), updated_at__lt=cutoff)
+    for session in sessions.iterator():
+        # 以状态与更新时间为条件，跳过清理期间恰好恢复上传的会话
+        if not UploadSession.objects.filter(id=session.id, status=session.status, updated_at=session.updated_at).update(status='expired'):
+            continue
+        expired += 1
+        try:
+            os.remove(os.path.join(temp_dir, session.temp_path))
+        except FileNotFoundError:
+            pass
+    
+    orphaned = 0
+    if os.path.isdir(temp_dir):
+        active = set(UploadSession.objects.filter(status__in=('uploading', 'finalizing')).values_list('temp_path', flat=True))
+        for entry in os.scandir(temp_dir):
+            if entry.name.endswith('.part') and entry.name not in active and entry.stat().st_mtime < cutoff.timestamp():
+                os.remove(entry.path)
+                orphaned += 1
+    
+    if expired or orphaned:
+        logger.info(f"已清理过期上传会话{expired}个，孤立暂存文件{orphaned}个")
+    return {'expired': expired, 'orphaned': orphaned}
@@ -1,3 +1,1480 @@
-from django.test import TestCase
+import hashlib
+import io
+import math
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from contextlib import contextmanager
+from datetime import timedelta
+from io import StringIO
+from unittest import skipIf
+from unittest.mock import patch
 
-# Create your tests here.
+import fitz  # PyMuPDF
+import numpy as np
+from asgiref.sync import sync_to_async
+from celery import Celery
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db.models import Count, Sum
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from audit.models import AuditLog
+from core.celery import app as celery_app
+from documents.layout import ColumnarLayout
+from documents.models import (
+    Document, DocumentPage, DocumentStatusCounter, PageCheckpoint, UploadBatch, UploadSession,
+)
+from documents.normalize import ImageTransform, normalize_for_ocr
+from documents.ocr import OCRBatcher, OCREnginePool, consumes_warmup_queues, warm_up_ocr_engines
+from documents.page_images import summarize_page_images
+from documents.progress import batch_channel, document_channel, get_progress_broker
+from documents.search import PageSearch
+from documents.storage import S3DocumentStorage, get_document_storage, read_chunks
+from documents.tasks import (
+    DeliveryLimitExceeded, build_document_pipeline, build_pdf_chunk_workflow, cleanup_upload_sessions,
+    clone_document_results, finalize_pdf_chunks, get_pages_dir, pipeline_template_id, plan_pdf_chunks,
+    preprocess_document, process_document_async, process_image, process_pdf, process_pdf_chunk, register_attempt,
+    write_frame_png,
+)
+from documents.word import iter_word_pages
+from extractions.models import ExtractionResult, FieldDefinition
+from extractions.tasks import extract_fields
+from prompts.models import PromptTemplate
+
+try:
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+# 测试期间的文档存储、分片暂存与页面缓存目录
+TEST_MEDIA_ROOT = tempfile.mkdtemp(prefix='documents-tests-')
+
+
+@override_settings(
+    MEDIA_ROOT=TEST_MEDIA_ROOT,
+    DOCUMENT_STORAGE_BACKEND='documents.storage.LocalDocumentStorage',
+    DOCUMENT_STORAGE_ROOT=TEST_MEDIA_ROOT,
+    DOCUMENT_UPLOAD_TEMP_DIR=f'{TEST_MEDIA_ROOT}/upload_parts',
+    DOCUMENT_PAGE_CACHE_DIR=f'{TEST_MEDIA_ROOT}/page_cache',
+    DOCUMENT_PROGRESS_ENABLED=False,
+)
+class DocumentTestCase(TestCase):
+    """文档测试基类：文件写入临时目录，关闭进度事件，Celery任务在当前进程中同步执行"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        eager = celery_app.conf.task_always_eager, celery_app.conf.task_eager_propagates
+        celery_app.conf.task_always_eager = celery_app.conf.task_eager_propagates = True
+        cls.addClassCleanup(cls._restore_celery, eager)
+
+    @staticmethod
+    def _restore_celery(eager):
+        celery_app.conf.task_always_eager, celery_app.conf.task_eager_propagates = eager
+
+    def setUp(self):
+        self.addCleanup(shutil.rmtree, TEST_MEDIA_ROOT, ignore_errors=True)
+        self.user = get_user_model().objects.create_user('tester', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_document(self, **fields):
+        fields = {'filename': 'a.pdf', 'source_type': 'pdf', 'storage_path': 'uploads/a.pdf', 'status': 'preprocessed', **fields}
+        return Document.objects.create(uploaded_by=self.user, **fields)
+
+
+def tearDownModule():
+    shutil.rmtree(TEST_MEDIA_ROOT, ignore_errors=True)
+
+
+class DocumentPagesTests(DocumentTestCase):
+
+    def test_pages_are_listed_in_page_order(self):
+        document = self.create_document()
+        for page_num in (2, 1):
+            DocumentPage.objects.create(document=document, page_num=page_num, text=f'p{page_num}', image_path='')
+        response = self.client.get(f'/api/v1/documents/{document.id}/pages/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([page['page_num'] for page in response.data['results']], [1, 2])
+
+    def test_invalid_document_id_returns_404(self):
+        self.assertEqual(self.client.get('/api/v1/documents/abc/pages/').status_code, 404)
+
+
+class DocumentListTests(DocumentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for index in range(3):
+            document = self.create_document(filename=f'{index}.pdf')
+            for page_num in range(1, index + 2):
+                DocumentPage.objects.create(document=document, page_num=page_num, text='', image_path='')
+
+    def test_list_returns_compact_payload_with_page_counts(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/documents/')
+        self.assertEqual(response.status_code, 200)
+        
+        results = response.data['results']
+        self.assertEqual(set(results[0]), {'id', 'filename', 'source_type', 'status', 'uploaded_by', 'created_at', 'storage_path', 'page_count'})
+        self.assertEqual({row['filename']: row['page_count'] for row in results}, {'0.pdf': 1, '1.pdf': 2, '2.pdf': 3})
+        self.assertEqual({row['uploaded_by'] for row in results}, {'tester'})
+
+    def test_query_count_does_not_grow_with_documents(self):
+        for index in range(3, 8):
+            document = self.create_document(filename=f'{index}.pdf')
+            DocumentPage.objects.create(document=document, page_num=1, text='', image_path='')
+        with self.assertNumQueries(2):
+            self.assertEqual(len(self.client.get('/api/v1/documents/').data['results']), 8)
+
+    def test_fields_param_limits_payload(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/documents/', {'fields': 'id,filename'})
+        self.assertEqual([set(row) for row in response.data['results']], [{'id', 'filename'}] * 3)
+
+    def test_page_count_is_annotated_when_requested(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/documents/', {'fields': 'filename,page_count'})
+        self.assertEqual(sorted(row['page_count'] for row in response.data['results']), [1, 2, 3])
+
+    def test_unknown_fields_are_ignored(self):
+        response = self.client.get('/api/v1/documents/', {'fields': 'filename,pages'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data['results'][0]), {'filename'})
+
+
+class PageSpansTests(DocumentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.document = self.create_document()
+        page = DocumentPage(document=self.document, page_num=1, text='甲\n乙\n', image_path='')
+        page.set_layout([
+            {'text': '甲', 'bbox': [0, 0, 10, 10], 'size': 12},
+            {'text': '乙', 'bbox': [100, 100, 110, 110], 'size': 12},
+        ])
+        page.save()
+        self.url = f'/api/v1/documents/{self.document.id}/pages/1/spans/'
+
+    def test_bbox_returns_intersecting_spans(self):
+        response = self.client.get(self.url, {'bbox': '5,5,50,50'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([span['text'] for span in response.data['results']], ['甲'])
+
+    def test_contains_mode_excludes_partially_covered_spans(self):
+        response = self.client.get(self.url, {'bbox': '5,5,50,50', 'mode': 'contains'})
+        self.assertEqual(response.data['count'], 0)
+
+    def test_near_returns_closest_span(self):
+        response = self.client.get(self.url, {'near': '95,95'})
+        self.assertEqual([span['text'] for span in response.data['results']], ['乙'])
+
+    def test_requires_exactly_one_query(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'bbox': '0,0,1,1', 'near': '0,0'}).status_code, 400)
+
+    def test_invalid_document_id_returns_404(self):
+        self.assertEqual(self.client.get('/api/v1/documents/abc/pages/1/spans/', {'near': '0,0'}).status_code, 404)
+
+
+def make_pdf(*texts):
+    pdf = fitz.open()
+    for text in texts:
+        pdf.new_page().insert_text((72, 72), text)
+    return pdf.tobytes()
+
+
+class BulkUploadTests(DocumentTestCase):
+
+    def bulk_upload(self, files, **data):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            for name, content in files.items():
+                zf.writestr(name, content)
+        upload = SimpleUploadedFile('batch.zip', archive.getvalue())
+        return self.client.post('/api/v1/documents/bulk/', {'files': upload, **data}, format='multipart')
+
+    def test_identical_files_in_one_batch_are_stored_once(self):
+        same = make_pdf('same')
+        response = self.bulk_upload({'a.pdf': same, 'dir/b.pdf': same, 'c.pdf': make_pdf('other')})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['file_count'], 2)
+        self.assertEqual([entry['filename'] for entry in response.data['skipped']], ['b.pdf'])
+        self.assertEqual(sorted(Document.objects.values_list('filename', flat=True)), ['a.pdf', 'c.pdf'])
+
+    def test_in_batch_duplicates_are_kept_when_dedup_is_disabled(self):
+        same = make_pdf('same')
+        response = self.bulk_upload({'a.pdf': same, 'b.pdf': same}, dedup='false')
+        self.assertEqual(response.data['file_count'], 2)
+
+    def test_batch_progress_reports_processed_documents(self):
+        batch_id = self.bulk_upload({'a.pdf': make_pdf('one'), 'notes.txt': b'x'}).data['id']
+        response = self.client.get(f'/api/v1/documents/batches/{batch_id}/', {'include': 'documents'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['finished'])
+        self.assertEqual(response.data['progress']['done'], 1)
+        self.assertEqual(response.data['skipped'][0]['filename'], 'notes.txt')
+        self.assertEqual(response.data['documents'][0]['status'], 'preprocessed')
+
+    def test_invalid_batch_id_returns_404(self):
+        self.assertEqual(self.client.get('/api/v1/documents/batches/abc/').status_code, 404)
+
+
+class DedupUploadTests(DocumentTestCase):
+
+    def upload(self, content, filename='a.pdf', path='/api/v1/documents/'):
+        # 创建序列化器要求提交这些字段，实际值由视图根据上传文件确定
+        data = {'file': SimpleUploadedFile(filename, content), 'filename': filename, 'source_type': 'pdf', 'storage_path': '-'}
+        return self.client.post(path, data, format='multipart')
+
+    def test_identical_upload_reuses_storage_and_skips_preprocessing(self):
+        content = make_pdf('same', 'pages')
+        self.assertEqual(self.upload(content).status_code, 201)
+        original = Document.objects.get()
+        self.assertEqual(original.status, 'preprocessed')
+        
+        with patch('documents.views.build_document_pipeline') as pipeline:
+            self.assertEqual(self.upload(content, 'copy.pdf').status_code, 201)
+        pipeline.assert_not_called()
+        
+        copy = Document.objects.get(filename='copy.pdf')
+        self.assertEqual(copy.storage_path, original.storage_path)
+        self.assertEqual(copy.content_hash, hashlib.sha256(content).hexdigest())
+        self.assertEqual(copy.status, 'preprocessed')
+        self.assertEqual(list(copy.pages.values_list('page_num', 'text')), list(original.pages.values_list('page_num', 'text')))
+        # 重复上传的文件已删除，存储中只保留一份
+        self.assertEqual(os.listdir(os.path.join(TEST_MEDIA_ROOT, os.path.dirname(original.storage_path))), [os.path.basename(original.storage_path)])
+
+    def test_upload_matching_processing_document_is_preprocessed_again(self):
+        content = make_pdf('same')
+        processing = self.create_document(content_hash=hashlib.sha256(content).hexdigest(), status='processing')
+        DocumentPage.objects.create(document=processing, page_num=1, text='partial', image_path='')
+        
+        with patch('documents.views.build_document_pipeline') as pipeline:
+            self.assertEqual(self.upload(content, 'copy.pdf').status_code, 201)
+        
+        copy = Document.objects.get(filename='copy.pdf')
+        pipeline.assert_called_once()
+        self.assertEqual(pipeline.call_args.args[0], copy)
+        self.assertEqual(copy.storage_path, processing.storage_path)
+        self.assertEqual(copy.status, 'uploaded')
+        self.assertFalse(copy.pages.exists())
+
+    def test_dedup_can_be_disabled_per_request(self):
+        content = make_pdf('same')
+        self.upload(content)
+        self.assertEqual(self.upload(content, 'copy.pdf', '/api/v1/documents/?dedup=false').status_code, 201)
+        original, copy = Document.objects.order_by('created_at')
+        self.assertNotEqual(copy.storage_path, original.storage_path)
+
+
+class CloneDocumentResultsTests(DocumentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.source = self.create_document(status='extracted')
+        for page_num in (1, 2):
+            DocumentPage.objects.create(
+                document=self.source, page_num=page_num, text=f'p{page_num}', image_path=f'pages/{page_num}.png',
+                fingerprint=f'f{page_num}', ocr_confidence=0.9,
+            )
+        field_def = FieldDefinition.objects.create(key='policy_no', label='保单号', ui_order=1)
+        ExtractionResult.objects.create(
+            document=self.source, field_def=field_def, value_raw='P-1', normalized_value='P1', confidence=0.8,
+            page_num=2, model_name='mock', model_version='1', prompt_version=3,
+        )
+        self.target = self.create_document(filename='b.pdf', status='pending')
+
+    def test_pages_and_extractions_are_copied(self):
+        clone_document_results(self.source, self.target, include_extractions=True)
+        
+        self.target.refresh_from_db()
+        self.assertEqual(self.target.status, 'extracted')
+        self.assertEqual(
+            list(self.target.pages.order_by('page_num').values_list('page_num', 'text', 'image_path', 'fingerprint', 'ocr_confidence')),
+            [(1, 'p1', 'pages/1.png', 'f1', 0.9), (2, 'p2', 'pages/2.png', 'f2', 0.9)],
+        )
+        self.assertEqual(
+            list(self.target.extraction_results.values_list('field_def__key', 'value_raw', 'normalized_value', 'page_num', 'prompt_version')),
+            [('policy_no', 'P-1', 'P1', 2, 3)],
+        )
+        # 源文档的结果保持不变
+        self.assertEqual(self.source.pages.count(), 2)
+        self.assertEqual(self.source.extraction_results.count(), 1)
+
+    def test_extractions_are_not_copied_by_default(self):
+        clone_document_results(self.source, self.target)
+        
+        self.target.refresh_from_db()
+        self.assertEqual(self.target.status, 'preprocessed')
+        self.assertEqual(self.target.pages.count(), 2)
+        self.assertFalse(self.target.extraction_results.exists())
+
+    def test_extractions_of_unfinished_source_are_not_copied(self):
+        Document.objects.filter(id=self.source.id).update(status='extracting')
+        self.source.refresh_from_db()
+        clone_document_results(self.source, self.target, include_extractions=True)
+        
+        self.target.refresh_from_db()
+        self.assertEqual(self.target.status, 'preprocessed')
+        self.assertFalse(self.target.extraction_results.exists())
+
+
+class ResumableUploadTests(DocumentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data = make_pdf('resumable')
+        response = self.client.post('/api/v1/documents/uploads/', {'filename': 'r.pdf', 'total_size': len(self.data)}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.session_id = response.data['id']
+        self.url = f'/api/v1/documents/uploads/{self.session_id}/'
+
+    def patch(self, chunk, offset):
+        return self.client.generic(
+            'PATCH', self.url, chunk, content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset)
+        )
+
+    def upload_all(self):
+        middle = len(self.data) // 2
+        self.assertEqual(self.patch(self.data[:middle], 0)['Upload-Offset'], str(middle))
+        self.assertEqual(self.patch(self.data[middle:], middle).status_code, 204)
+
+    def test_offset_mismatch_is_rejected(self):
+        self.patch(self.data[:10], 0)
+        response = self.patch(self.data[10:20], 5)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Upload-Offset'], '10')
+        self.assertEqual(self.client.head(self.url)['Upload-Offset'], '10')
+
+    def test_chunk_beyond_total_size_is_rejected(self):
+        self.assertEqual(self.patch(self.data + b'x', 0).status_code, 400)
+
+    def test_finalize_requires_complete_upload(self):
+        self.patch(self.data[:10], 0)
+        self.assertEqual(self.client.post(f'{self.url}finalize/').status_code, 409)
+
+    def test_finalize_creates_document_once(self):
+        self.upload_all()
+        response = self.client.post(f'{self.url}finalize/')
+        self.assertEqual(response.status_code, 201)
+        document = Document.objects.get(upload_sessions__id=self.session_id)
+        with get_document_storage().open(document.storage_path) as f:
+            self.assertEqual(f.read(), self.data)
+        
+        self.assertEqual(self.client.post(f'{self.url}finalize/').status_code, 409)
+        self.assertEqual(Document.objects.count(), 1)
+
+    def test_finalize_loses_race_to_claimed_session(self):
+        self.upload_all()
+        # 本请求读取会话后，并发的finalize请求抢先认领了会话
+        session = UploadSession.objects.get(id=self.session_id)
+        UploadSession.objects.filter(id=self.session_id).update(status='finalizing')
+        with patch('documents.views.DocumentViewSet._get_upload_session', return_value=session):
+            self.assertEqual(self.client.post(f'{self.url}finalize/').status_code, 409)
+        self.assertFalse(Document.objects.exists())
+
+    def test_cleanup_expires_idle_sessions_and_orphaned_parts(self):
+        temp_dir = settings.DOCUMENT_UPLOAD_TEMP_DIR
+        stale = timezone.now() - timedelta(hours=settings.DOCUMENT_UPLOAD_SESSION_EXPIRE_HOURS + 1)
+        UploadSession.objects.filter(id=self.session_id).update(updated_at=stale)
+        orphan = os.path.join(temp_dir, 'orphan.part')
+        open(orphan, 'wb').close()
+        os.utime(orphan, (stale.timestamp(), stale.timestamp()))
+        fresh = self.client.post('/api/v1/documents/uploads/', {'filename': 'f.pdf', 'total_size': 10}, format='json').data
+        
+        self.assertEqual(cleanup_upload_sessions(), {'expired': 1, 'orphaned': 1})
+        self.assertEqual(UploadSession.objects.get(id=self.session_id).status, 'expired')
+        self.assertEqual(sorted(os.listdir(temp_dir)), [f"{fresh['id']}.part"])
+        self.assertEqual(self.patch(self.data, 0).status_code, 409)
+
+    def test_invalid_session_id_returns_404(self):
+        self.assertEqual(self.client.head('/api/v1/documents/uploads/abc/').status_code, 404)
+
+
+class DownloadTests(DocumentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 40
+        get_document_storage().write('uploads/report.bin', [self.content])
+        self.document = self.create_document(filename='报告.pdf', storage_path='uploads/report.bin')
+        self.url = f'/api/v1/documents/{self.document.id}/download/'
+
+    def test_full_download_sets_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('ETag', response)
+        self.assertIn('attachment', response['Content-Disposition'])
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_range_requests(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+        
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=-5')['Content-Range'], f'bytes {len(self.content) - 5}-{len(self.content) - 1}/{len(self.content)}')
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-').status_code, 416)
+
+    def test_stale_if_range_returns_full_content(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_download_is_audited_once_per_transfer(self):
+        self.client.get(self.url)
+        self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(AuditLog.objects.filter(action=AuditLog.ACTION_DOWNLOAD, entity_id=str(self.document.id)).count(), 1)
+
+    def test_unreachable_broker_does_not_block_download(self):
+        with patch('audit.tasks.record_audit_logs.delay', side_effect=OSError('broker unreachable')):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(AuditLog.objects.filter(action=AuditLog.ACTION_DOWNLOAD, entity_id=str(self.document.id)).exists())
+
+    def test_missing_file_returns_404(self):
+        get_document_storage().delete('uploads/report.bin')
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class PageImageTests(DocumentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        get_document_storage().write('uploads/p.pdf', [make_pdf('one', 'two')])
+        self.document = self.create_document(storage_path='uploads/p.pdf')
+        self.url = f'/api/v1/documents/{self.document.id}/page-image/'
+
+    def test_cached_tiles_are_served_without_opening_the_pdf(self):
+        first = self.client.get(self.url, {'page': 1, 'dpi': 144, 'tile': '0,0'})
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first['X-Tile-Size'], str(settings.DOCUMENT_PAGE_TILE_SIZE))
+        
+        with patch('documents.page_images.fitz.open', side_effect=AssertionError('PDF opened on cache hit')):
+            second = self.client.get(self.url, {'page': 1, 'dpi': 144, 'tile': '0,0'})
+        self.assertEqual(second.status_code, 200)
+        for header in ('X-Page-Width', 'X-Page-Height', 'X-Tile-Columns', 'X-Tile-Rows'):
+            self.assertEqual(second[header], first[header])
+
+    def test_page_geometry_matches_requested_dpi(self):
+        response = self.client.get(self.url, {'page': 2, 'dpi': 144})
+        page = fitz.open('pdf', make_pdf('x'))[0]
+        self.assertEqual(int(response['X-Page-Width']), math.ceil(page.rect.width * 2))
+
+    def test_out_of_range_requests_return_404(self):
+        self.assertEqual(self.client.get(self.url, {'page': 3}).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {'page': 1, 'tile': '99,99'}).status_code, 404)
+
+    @override_settings(DOCUMENT_PAGE_RENDER_MAX_PIXELS=1000 * 1000)
+    def test_oversized_full_page_render_requires_tiles(self):
+        with patch('fitz.Page.get_pixmap', side_effect=AssertionError('full page rendered')):
+            response = self.client.get(self.url, {'page': 1, 'dpi': 300})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('瓦片', response.data['error'])
+        self.assertGreater(int(response['X-Page-Width']) * int(response['X-Page-Height']), 1000 * 1000)
+        self.assertGreater(int(response['X-Tile-Columns']), 1)
+        
+        self.assertEqual(self.client.get(self.url, {'page': 1, 'dpi': 300, 'tile': '1,1'}).status_code, 200)
+        self.assertEqual(self.client.get(self.url, {'page': 1, 'dpi': 72}).status_code, 200)
+
+    def test_invalid_parameters_return_400(self):
+        self.assertEqual(self.client.get(self.url, {'page': 0}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'dpi': 0}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'tile': '1'}).status_code, 400)
+
+
+
+@override_settings(DOCUMENT_PDF_RASTERIZE_ON_INGEST=True, DOCUMENT_PDF_FANOUT_ENABLED=False)
+class PageImageBaselineTests(DocumentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        get_document_storage().write('uploads/four.pdf', [make_pdf('1', '2', '3', '4')])
+        self.document = self.create_document(storage_path='uploads/four.pdf', status='pending')
+
+    def test_baseline_is_not_encoded_by_default(self):
+        with patch('documents.tasks.png_size', side_effect=AssertionError('baseline PNG encoded')):
+            preprocess_document.delay(str(self.document.id))
+        
+        self.document.refresh_from_db()
+        report = self.document.processing_metrics['page_images']
+        self.assertEqual(report['pages'], 4)
+        self.assertEqual(report['baseline_pages'], 0)
+        self.assertIsNone(report['baseline_bytes'])
+        self.assertIsNone(report['saved_bytes'])
+
+    @override_settings(DOCUMENT_PAGE_IMAGE_BASELINE_SAMPLE_INTERVAL=3)
+    def test_sampled_baseline_is_extrapolated(self):
+        preprocess_document.delay(str(self.document.id))
+        
+        sampled = self.document.pages.exclude(image_baseline_bytes=None).values_list('page_num', flat=True)
+        self.assertEqual(sorted(sampled), [1, 4])
+        self.document.refresh_from_db()
+        report = self.document.processing_metrics['page_images']
+        self.assertEqual(report['baseline_pages'], 2)
+        self.assertGreater(report['baseline_bytes'], 0)
+        self.assertEqual(report['saved_bytes'], report['baseline_bytes'] - report['output_bytes'])
+
+    def test_summary_scales_sampled_pages(self):
+        variant = {'review': {'format': 'WEBP', 'bytes': 100}}
+        report = summarize_page_images([(variant, 400), (variant, None), (variant, None), (variant, 400)])
+        
+        self.assertEqual(report['output_bytes'], 400)
+        self.assertEqual(report['baseline_bytes'], 1600)
+        self.assertEqual(report['saved_bytes'], 1200)
+        self.assertEqual(report['saved_ratio'], 0.75)
+
+class WorkerKilled(BaseException):
+    """模拟工作进程在处理中途被终止（不是Exception，不会触发任务的失败处理）"""
+
+
+class PageCheckpointTests(DocumentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        get_document_storage().write('uploads/six.pdf', [make_pdf(*(f'page {n}' for n in range(1, 7)))])
+        self.document = self.create_document(storage_path='uploads/six.pdf', status='pending')
+
+    def test_redelivered_task_resumes_from_checkpoint(self):
+        PageCheckpoint.objects.create(task_id='task-1', document=self.document, next_page=4)
+        preprocess_document.apply(args=[str(self.document.id)], task_id='task-1')
+        
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.status, 'preprocessed')
+        self.assertEqual(list(self.document.pages.values_list('page_num', flat=True).order_by('page_num')), [5, 6])
+        self.assertFalse(PageCheckpoint.objects.exists())
+
+    def test_task_gives_up_after_max_deliveries(self):
+        PageCheckpoint.objects.create(task_id='task-1', document=self.document, attempts=settings.DOCUMENT_TASK_MAX_DELIVERIES)
+        with self.assertRaises(DeliveryLimitExceeded):
+            preprocess_document.apply(args=[str(self.document.id)], task_id='task-1')
+        
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.status, 'failed')
+        self.assertFalse(self.document.pages.exists())
+        self.assertFalse(PageCheckpoint.objects.exists())
+
+    def test_attempts_are_counted_per_delivery(self):
+        register_attempt(self.document, 'task-1')
+        self.assertEqual(register_attempt(self.document, 'task-1').attempts, 2)
+
+    @override_settings(DOCUMENT_PAGE_BULK_BATCH_SIZE=2)
+    def test_checkpoint_advances_over_skipped_pages(self):
+        process_pdf(self.document, get_pages_dir(self.document))
+        
+        # 第二次处理全部页面都未变化，在处理第6页前中断
+        calls = iter(range(5))
+        def interrupt_before_last_page():
+            if next(calls) == 4:
+                raise WorkerKilled
+            return False
+        with patch('documents.tasks.memory_ceiling_reached', side_effect=interrupt_before_last_page):
+            with self.assertRaises(WorkerKilled):
+                process_pdf(self.document, get_pages_dir(self.document), checkpoint_key='task-1')
+        self.assertEqual(PageCheckpoint.objects.get(task_id='task-1').next_page, 5)
+
+
+@skipIf(mock_aws is None, "需要安装moto（requirements-dev.txt）")
+class S3DocumentStorageTests(DocumentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        mock = mock_aws()
+        mock.start()
+        self.addCleanup(mock.stop)
+        self.storage = S3DocumentStorage(
+            bucket='documents', prefix='tests', region_name='us-east-1', access_key='testing', secret_key='testing',
+        )
+        self.storage.client.create_bucket(Bucket='documents')
+
+    def test_small_file_round_trip(self):
+        self.assertEqual(self.storage.write('uploads/a.pdf', [b'%PDF-', b'1.7']), 8)
+        
+        self.assertTrue(self.storage.exists('uploads/a.pdf'))
+        self.assertEqual(self.storage.size('uploads/a.pdf'), 8)
+        self.assertEqual(b''.join(read_chunks(self.storage.open('uploads/a.pdf'), 3)), b'%PDF-1.7')
+        self.assertEqual(self.storage.client.list_objects_v2(Bucket='documents')['Contents'][0]['Key'], 'tests/uploads/a.pdf')
+
+    def test_multipart_write(self):
+        part = 5 * 1024 * 1024
+        chunks = [bytes([n]) * (1024 * 1024) for n in range(11)]
+        
+        self.assertEqual(self.storage.write('uploads/big.bin', chunks), 11 * 1024 * 1024)
+        
+        data = b''.join(read_chunks(self.storage.open('uploads/big.bin')))
+        self.assertEqual(data, b''.join(chunks))
+        self.assertEqual(data[part:part + 1], bytes([5]))
+        self.assertEqual(self.storage.client.list_multipart_uploads(Bucket='documents').get('Uploads', []), [])
+
+    def test_failed_write_aborts_multipart_upload(self):
+        def chunks():
+            yield b'x' * (6 * 1024 * 1024)
+            raise OSError('client disconnected')
+        
+        with self.assertRaises(OSError):
+            self.storage.write('uploads/broken.bin', chunks())
+        self.assertFalse(self.storage.exists('uploads/broken.bin'))
+        self.assertEqual(self.storage.client.list_multipart_uploads(Bucket='documents').get('Uploads', []), [])
+
+    def test_local_path_downloads_to_temp_file(self):
+        self.storage.write('uploads/a.pdf', [b'%PDF-1.7'])
+        
+        with self.storage.local_path('uploads/a.pdf') as path:
+            self.assertTrue(path.endswith('.pdf'))
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'%PDF-1.7')
+        self.assertFalse(os.path.exists(path))
+
+    def test_delete(self):
+        self.storage.write('uploads/a.pdf', [b'%PDF-1.7'])
+        self.storage.delete('uploads/a.pdf')
+        
+        self.assertFalse(self.storage.exists('uploads/a.pdf'))
+        with self.assertRaises(FileNotFoundError):
+            self.storage.size('uploads/a.pdf')
+
+
+class MigrateDocumentStorageTests(DocumentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.legacy_root = os.path.join(TEST_MEDIA_ROOT, 'legacy')
+        self.storage_root = os.path.join(TEST_MEDIA_ROOT, 'storage')
+        self.write_legacy(os.path.join(self.legacy_root, 'uploads/20240101/old.pdf'), b'%PDF-old')
+        self.write_legacy(os.path.join(TEST_MEDIA_ROOT, 'pages/old/page_1.png'), b'png')
+        self.document = self.create_document(storage_path='uploads/20240101/old.pdf')
+        self.duplicate = self.create_document(storage_path='uploads/20240101/old.pdf')
+        DocumentPage.objects.create(document=self.document, page_num=1, text='', image_path='pages/old/page_1.png')
+        self.missing = self.create_document(storage_path='uploads/20240101/gone.pdf')
+
+    @staticmethod
+    def write_legacy(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def migrate(self, *args):
+        out = StringIO()
+        with self.settings(DOCUMENT_STORAGE_ROOT=self.storage_root):
+            call_command('migrate_document_storage', '--legacy-root', self.legacy_root, *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_changes_nothing(self):
+        output = self.migrate('--dry-run')
+        
+        self.assertIn('需迁移上传文件 1 个，页面图像 1 个', output)
+        self.assertIn('上传文件 1 个，页面图像 0 个', output)
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.storage_path, 'uploads/20240101/old.pdf')
+        self.assertFalse(os.path.exists(self.storage_root))
+
+    def test_copies_legacy_files_into_storage(self):
+        output = self.migrate()
+        
+        self.assertIn('已迁移上传文件 1 个，页面图像 1 个', output)
+        self.document.refresh_from_db()
+        self.duplicate.refresh_from_db()
+        self.assertRegex(self.document.storage_path, r'^uploads/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{32}\.pdf$')
+        self.assertEqual(self.duplicate.storage_path, self.document.storage_path)
+        with open(os.path.join(self.storage_root, self.document.storage_path), 'rb') as f:
+            self.assertEqual(f.read(), b'%PDF-old')
+        self.assertTrue(os.path.isfile(os.path.join(self.storage_root, 'pages/old/page_1.png')))
+        self.missing.refresh_from_db()
+        self.assertEqual(self.missing.storage_path, 'uploads/20240101/gone.pdf')
+        
+        # 再次执行时已迁移的文件不再复制
+        self.assertIn('已迁移上传文件 0 个，页面图像 0 个', self.migrate())
+
+
+class FakeOCREngine:
+    """不分阶段的OCR引擎，ocr_batch会逐张调用ocr()"""
+
+    def ocr(self, image, cls=True):
+        return [[[[0, 0], (image, 0.99)]]]
+
+
+class FakeOCRPool:
+
+    @contextmanager
+    def engine(self, lang='ch', use_angle_cls=True):
+        yield FakeOCREngine()
+
+    def record(self, key, kind, seconds):
+        pass
+
+
+class OCRBatcherTests(SimpleTestCase):
+
+    def setUp(self):
+        self.batcher = OCRBatcher(FakeOCRPool(), max_batch_size=4, max_latency_ms=0)
+
+    def test_results_are_returned_to_each_caller(self):
+        self.assertEqual(self.batcher.ocr('a'), [[[[0, 0], ('a', 0.99)]]])
+
+    def test_unexpected_error_fails_batch_and_keeps_thread_running(self):
+        with patch.object(self.batcher, '_dispatch', side_effect=RuntimeError('broken batch')):
+            future = self.batcher.submit('a')
+            with self.assertRaisesMessage(RuntimeError, 'broken batch'):
+                future.result(timeout=5)
+        
+        self.assertTrue(self.batcher._thread.is_alive())
+        self.assertEqual(self.batcher.submit('b').result(timeout=5), [[[0, 0], ('b', 0.99)]])
+
+    def test_dead_thread_is_restarted_on_submit(self):
+        dead = threading.Thread(target=lambda: None)
+        dead.start()
+        dead.join()
+        self.batcher._thread = dead
+        
+        self.assertEqual(self.batcher.submit('a').result(timeout=5), [[[0, 0], ('a', 0.99)]])
+        self.assertIsNot(self.batcher._thread, dead)
+
+
+class StatusCounterTests(DocumentTestCase):
+
+    def assertCountersMatchDocuments(self):
+        counted = {
+            (row['status'], row['source_type']): row['total']
+            for row in DocumentStatusCounter.objects.values('status', 'source_type').annotate(total=Sum('count'))
+            if row['total']
+        }
+        actual = {
+            (row['status'], row['source_type']): row['total']
+            for row in Document.objects.values('status', 'source_type').annotate(total=Count('id'))
+        }
+        self.assertEqual(counted, actual)
+
+    def test_counters_follow_create_update_and_delete(self):
+        first = self.create_document()
+        self.create_document()
+        self.create_document(filename='b.png', source_type='image', status='pending')
+        self.assertCountersMatchDocuments()
+        
+        document = Document.objects.get(id=first.id)
+        document.status = 'failed'
+        document.save()
+        document.save()
+        self.assertCountersMatchDocuments()
+        
+        Document.objects.get(id=first.id).delete()
+        self.assertCountersMatchDocuments()
+
+    def test_stats_are_served_from_counters(self):
+        self.create_document()
+        self.create_document(status='failed')
+        
+        with patch.object(Document.objects, 'values', side_effect=AssertionError('document table scanned')):
+            response = self.client.get('/api/v1/documents/stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['total'], response.data['preprocessed'], response.data['failed']), (2, 1, 1))
+
+    def test_rebuild_restores_counts(self):
+        self.create_document()
+        DocumentStatusCounter.objects.update(count=99)
+        
+        DocumentStatusCounter.rebuild()
+        self.assertCountersMatchDocuments()
+
+
+@override_settings(
+    DOCUMENT_OCR_GRAYSCALE=True,
+    DOCUMENT_OCR_TRIM_BORDERS=True,
+    DOCUMENT_OCR_TRIM_TOLERANCE=40,
+    DOCUMENT_OCR_MAX_LONG_EDGE=400,
+    DOCUMENT_OCR_DESKEW=True,
+    DOCUMENT_OCR_DESKEW_MAX_ANGLE=5,
+)
+class NormalizeForOCRTests(SimpleTestCase):
+
+    # 原图中两个黑色方块的中心
+    marks = [(200, 150), (1000, 750)]
+
+    def make_image(self):
+        image = Image.new('RGB', (1200, 900), 'white')
+        # 灰色边框决定裁剪范围，使旋转后方块仍完整留在图像内
+        for box in ((60, 60, 1140, 62), (60, 838, 1140, 840), (60, 60, 62, 840), (1138, 60, 1140, 840)):
+            image.paste((120, 120, 120), box)
+        for x, y in self.marks:
+            image.paste((0, 0, 0), (x - 15, y - 15, x + 15, y + 15))
+        return image
+
+    def mark_centers(self, array):
+        """规范化图像中左右两个方块的中心（像素中心坐标）"""
+        ys, xs = np.nonzero(array[:, :, 0] < 60)
+        middle = array.shape[1] / 2
+        return [
+            (float(xs[side].mean()) + 0.5, float(ys[side].mean()) + 0.5)
+            for side in (xs < middle, xs >= middle)
+        ]
+
+    def assertMapsToOriginal(self, array, transform):
+        for (x, y), expected in zip(self.mark_centers(array), self.marks):
+            mapped = transform.to_original(x, y)
+            self.assertAlmostEqual(mapped[0], expected[0], delta=4)
+            self.assertAlmostEqual(mapped[1], expected[1], delta=4)
+
+    def test_trim_and_scale_map_back_to_original(self):
+        with override_settings(DOCUMENT_OCR_DESKEW=False):
+            array, transform, stats = normalize_for_ocr(self.make_image())
+        
+        self.assertEqual(max(array.shape[:2]), 400)
+        self.assertEqual(array.shape[2], 3)
+        self.assertNotEqual(transform.offset, (0, 0))
+        self.assertEqual(stats['pixels_before'], 1200 * 900)
+        self.assertEqual(stats['pixels_after'], array.shape[0] * array.shape[1])
+        self.assertMapsToOriginal(array, transform)
+
+    def test_deskew_rotation_maps_back_to_original(self):
+        with patch('documents.normalize.estimate_skew', return_value=3.0):
+            array, transform, stats = normalize_for_ocr(self.make_image())
+        
+        self.assertEqual(stats['skew_angle'], 3.0)
+        self.assertMapsToOriginal(array, transform)
+
+    def test_estimated_skew_is_corrected(self):
+        lines = Image.new('L', (1200, 900), 255)
+        for y in range(100, 800, 40):
+            lines.paste(0, (100, y, 1100, y + 6))
+        
+        _, _, stats = normalize_for_ocr(lines.rotate(-2, resample=Image.BICUBIC, fillcolor=255))
+        self.assertAlmostEqual(stats['skew_angle'], 2.0, delta=0.5)
+
+    def test_identity_transform(self):
+        self.assertEqual(ImageTransform().to_original(12.5, 30), (12.5, 30))
+        self.assertEqual(ImageTransform(offset=(10, 20), scale=0.5).to_original(5, 5), (20, 30))
+
+
+class ColumnarLayoutTests(SimpleTestCase):
+
+    spans = [
+        {'text': '合同编号', 'bbox': [10.5, 20.25, 80.0, 32.0], 'size': 12.0},
+        {'text': '', 'bbox': [0, 0, 0, 0], 'size': 9.5},
+        {'text': 'Total: 1,024.00', 'bbox': [100.125, 700.5, 250.75, 712.0], 'size': 10.0},
+    ]
+
+    def test_round_trip_through_bytes(self):
+        layout = ColumnarLayout.from_bytes(ColumnarLayout.from_spans(self.spans).to_bytes())
+        
+        self.assertEqual(len(layout), 3)
+        self.assertEqual(layout.to_list(), self.spans)
+        self.assertEqual(layout.span(2), self.spans[2])
+        self.assertEqual(layout.texts(), ['合同编号', '', 'Total: 1,024.00'])
+
+    def test_irregular_spans_are_not_columnar(self):
+        self.assertIsNone(ColumnarLayout.from_spans([]))
+        self.assertIsNone(ColumnarLayout.from_spans([{'text': 'a', 'bbox': [0, 0, 1, 1], 'size': 'big'}]))
+        self.assertIsNone(ColumnarLayout.from_spans([{'text': 'a', 'bbox': [0, 0, 1]}]))
+        self.assertIsNone(ColumnarLayout.from_spans([
+            {'text': 'a', 'bbox': [0, 0, 1, 1], 'size': 1},
+            {'text': 'b', 'bbox': [0, 0, 1, 1], 'font': 1},
+        ]))
+
+    def test_rejects_unknown_format(self):
+        with self.assertRaises(ValueError):
+            ColumnarLayout.from_bytes(b'JSON\x00\x00\x00\x00')
+
+
+class PageSearchTests(DocumentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.report = self.create_document(filename='report.pdf')
+        self.scan = self.create_document(filename='scan.png', source_type='image')
+        DocumentPage.objects.create(document=self.report, page_num=1, text='第三季度财务报告 营业收入同比增长', image_path='')
+        DocumentPage.objects.create(document=self.report, page_num=2, text='附注：资产负债表', image_path='')
+        DocumentPage.objects.create(document=self.scan, page_num=1, text='季度财务报告扫描件 <机密>', image_path='')
+
+    def search(self, query, **params):
+        response = self.client.get('/api/v1/documents/search/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_index_search_ranks_and_highlights(self):
+        self.assertTrue(PageSearch('财务报告').use_index)
+        data = self.search('财务报告')
+        
+        self.assertEqual(data['count'], 2)
+        self.assertEqual({hit['filename'] for hit in data['results']}, {'report.pdf', 'scan.png'})
+        for hit in data['results']:
+            self.assertIn('<mark>财务报告</mark>', hit['snippet'])
+            self.assertIsNotNone(hit['score'])
+        self.assertNotIn('<机密>', ''.join(hit['snippet'] for hit in self.search('扫描件')['results']))
+
+    def test_index_follows_page_updates_and_deletes(self):
+        page = self.report.pages.get(page_num=2)
+        page.text = '现金流量表'
+        page.save()
+        self.assertEqual(self.search('资产负债')['count'], 0)
+        self.assertEqual(self.search('现金流量')['count'], 1)
+        
+        self.scan.delete()
+        self.assertEqual(self.search('财务报告')['count'], 1)
+
+    def test_short_terms_fall_back_to_like(self):
+        self.assertFalse(PageSearch('附注').use_index)
+        data = self.search('附注')
+        
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['results'][0]['snippet'], '<mark>附注</mark>：资产负债表')
+        self.assertIsNone(data['results'][0]['score'])
+        # 短词与索引词混合时仍走索引，短词以LIKE补充
+        self.assertEqual(self.search('财务报告 营业')['count'], 1)
+
+    def test_like_fallback_without_index(self):
+        with patch('documents.search.search_index_available', return_value=False):
+            self.assertFalse(PageSearch('财务报告').use_index)
+            data = self.search('财务报告', source_type='image')
+        
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['results'][0]['filename'], 'scan.png')
+        self.assertIn('<mark>财务报告</mark>', data['results'][0]['snippet'])
+        self.assertIn('&lt;机密&gt;', data['results'][0]['snippet'])
+
+    def test_empty_query_is_rejected(self):
+        self.assertEqual(self.client.get('/api/v1/documents/search/', {'q': ' '}).status_code, 400)
+
+
+class PageFingerprintTests(DocumentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        get_document_storage().write('uploads/two.pdf', [make_pdf('alpha', 'beta')])
+        self.document = self.create_document(storage_path='uploads/two.pdf', status='pending')
+
+    def page_metrics(self):
+        self.document.refresh_from_db()
+        return self.document.processing_metrics['pages']
+
+    def test_unchanged_pages_are_skipped(self):
+        preprocess_document.delay(str(self.document.id))
+        self.assertEqual(self.page_metrics(), {'written': 2, 'skipped': 0})
+        page_ids = set(self.document.pages.values_list('id', flat=True))
+        
+        preprocess_document.delay(str(self.document.id))
+        self.assertEqual(self.page_metrics(), {'written': 0, 'skipped': 2})
+        self.assertEqual(set(self.document.pages.values_list('id', flat=True)), page_ids)
+
+    def test_changed_source_is_reprocessed(self):
+        preprocess_document.delay(str(self.document.id))
+        get_document_storage().write('uploads/two.pdf', [make_pdf('alpha', 'gamma', 'delta')])
+        
+        preprocess_document.delay(str(self.document.id))
+        self.assertEqual(self.page_metrics(), {'written': 2, 'skipped': 1})
+        self.assertEqual(self.document.pages.get(page_num=2).text.strip(), 'gamma')
+
+    def test_force_reprocesses_every_page(self):
+        preprocess_document.delay(str(self.document.id))
+        
+        response = self.client.post(f'/api/v1/documents/{self.document.id}/reprocess/', {'force': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.page_metrics(), {'written': 2, 'skipped': 0})
+
+
+class DocumentPipelineTests(DocumentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        get_document_storage().write('uploads/a.pdf', [make_pdf('保单号 P-1')])
+        self.template = PromptTemplate.objects.create(name='默认', system_prompt='', field_prompts={}, default_prompt='')
+        FieldDefinition.objects.create(key='policy_no', label='保单号', ui_order=1)
+
+    def route(self, signature):
+        options = celery_app.amqp.router.route(dict(signature.options), signature.task, signature.args, signature.kwargs)
+        return options['queue'].name
+
+    def test_preprocess_step_is_routed_by_source_type(self):
+        for source_type, queue in (('pdf', 'pdf_text'), ('word', 'pdf_text'), ('image', 'ocr')):
+            document = self.create_document(source_type=source_type, status='pending')
+            self.assertEqual(self.route(build_document_pipeline(document)), queue)
+
+    def test_messages_without_queue_are_routed_by_stored_source_type(self):
+        document = self.create_document(source_type='image', status='pending')
+        self.assertEqual(self.route(preprocess_document.si(str(document.id))), 'ocr')
+
+    def test_extraction_step_is_chained_on_extraction_queue(self):
+        document = self.create_document(status='pending')
+        pipeline = build_document_pipeline(document, prompt_template_id=self.template.id)
+        
+        preprocess, extract = pipeline.tasks
+        self.assertEqual(preprocess.task, 'documents.tasks.preprocess_document')
+        self.assertEqual(extract.task, 'extractions.tasks.extract_fields')
+        self.assertEqual(extract.args, (str(document.id), self.template.id))
+        self.assertTrue(extract.immutable)
+        self.assertEqual(self.route(extract), 'extraction')
+
+    def test_pipeline_runs_extraction_after_preprocessing(self):
+        document = self.create_document(status='pending')
+        build_document_pipeline(document, prompt_template_id=self.template.id).apply_async()
+        
+        document.refresh_from_db()
+        self.assertEqual(document.status, 'extracted')
+        self.assertEqual(document.pages.count(), 1)
+        self.assertEqual(document.extraction_results.count(), 1)
+
+    def test_auto_extract_is_chained_only_when_enabled(self):
+        self.assertIsNone(pipeline_template_id(auto_extract=False, prompt_template_id=self.template.id))
+        self.assertEqual(pipeline_template_id(auto_extract=True), self.template.id)
+        with self.settings(DOCUMENT_AUTO_EXTRACT=False):
+            self.assertIsNone(pipeline_template_id())
+        with self.settings(DOCUMENT_AUTO_EXTRACT=True):
+            self.assertEqual(pipeline_template_id(), self.template.id)
+        
+        document = self.create_document(status='pending')
+        pipeline = build_document_pipeline(document, prompt_template_id=pipeline_template_id(auto_extract=False))
+        self.assertEqual(pipeline.task, 'documents.tasks.preprocess_document')
+
+    def test_upload_extracts_only_when_auto_extract_is_requested(self):
+        for auto_extract, status in (('false', 'preprocessed'), ('true', 'extracted')):
+            content = make_pdf('保单号', auto_extract)
+            data = {
+                'file': SimpleUploadedFile(f'{auto_extract}.pdf', content), 'filename': f'{auto_extract}.pdf',
+                'source_type': 'pdf', 'storage_path': '-', 'auto_extract': auto_extract,
+            }
+            self.assertEqual(self.client.post('/api/v1/documents/', data, format='multipart').status_code, 201)
+            self.assertEqual(Document.objects.get(filename=f'{auto_extract}.pdf').status, status)
+
+    def test_preprocess_failure_stops_extraction(self):
+        document = self.create_document(storage_path='uploads/missing.pdf', status='pending')
+        
+        with patch('extractions.tasks.call_extraction_model') as call_model, self.assertRaises(Exception):
+            build_document_pipeline(document, prompt_template_id=self.template.id).apply_async()
+        
+        call_model.assert_not_called()
+        document.refresh_from_db()
+        self.assertEqual(document.status, 'failed')
+        self.assertFalse(document.extraction_results.exists())
+
+    def test_process_document_async_preprocesses_without_extraction(self):
+        document = self.create_document(status='pending')
+        with patch('extractions.tasks.call_extraction_model') as call_model:
+            process_document_async.delay(str(document.id))
+        
+        call_model.assert_not_called()
+        document.refresh_from_db()
+        self.assertEqual(document.status, 'preprocessed')
+
+
+@override_settings(DOCUMENT_PDF_FANOUT_ENABLED=True, DOCUMENT_PDF_CHUNK_SIZE=3, DOCUMENT_PDF_MAX_PARALLEL_CHUNKS=2)
+class PdfFanoutTests(DocumentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        get_document_storage().write('uploads/seven.pdf', [make_pdf(*(f'page {n}' for n in range(1, 8)))])
+        self.document = self.create_document(storage_path='uploads/seven.pdf', status='processing')
+
+    def test_plan_splits_page_ranges(self):
+        self.assertEqual(plan_pdf_chunks(self.document), [(0, 3), (3, 6), (6, 7)])
+        with self.settings(DOCUMENT_PDF_CHUNK_SIZE=7):
+            self.assertEqual(plan_pdf_chunks(self.document), [])
+        with self.settings(DOCUMENT_PDF_FANOUT_ENABLED=False):
+            self.assertEqual(plan_pdf_chunks(self.document), [])
+
+    def test_workflow_runs_lanes_in_parallel_and_chunks_in_order(self):
+        chunks = [(0, 3), (3, 6), (6, 9), (9, 12), (12, 13)]
+        workflow = build_pdf_chunk_workflow(self.document.id, chunks, force=True)
+        
+        lanes = [[task.args[1:] for task in lane.tasks] for lane in workflow.tasks]
+        self.assertEqual(lanes, [[(0, 3, True), (6, 9, True), (12, 13, True)], [(3, 6, True), (9, 12, True)]])
+        self.assertEqual(workflow.body.task, 'documents.tasks.finalize_pdf_chunks')
+        self.assertEqual(workflow.body.args, (str(self.document.id), 13))
+
+    def test_single_chunk_lanes_are_plain_signatures(self):
+        workflow = build_pdf_chunk_workflow(self.document.id, [(0, 3), (3, 5)])
+        
+        self.assertEqual([task.task for task in workflow.tasks], ['documents.tasks.process_pdf_chunk'] * 2)
+        self.assertEqual([task.args[1:3] for task in workflow.tasks], [(0, 3), (3, 5)])
+
+    def test_finalize_completes_document_when_all_chunks_written(self):
+        for start, end in plan_pdf_chunks(self.document):
+            process_pdf_chunk.apply(args=[str(self.document.id), start, end])
+        finalize_pdf_chunks.apply(args=[str(self.document.id), 7])
+        
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.status, 'preprocessed')
+        self.assertEqual(list(self.document.pages.order_by('page_num').values_list('page_num', flat=True)), list(range(1, 8)))
+
+    def test_finalize_fails_document_with_missing_chunks(self):
+        process_pdf_chunk.apply(args=[str(self.document.id), 0, 3])
+        process_pdf_chunk.apply(args=[str(self.document.id), 6, 7])
+        
+        with self.assertRaisesMessage(ValueError, '已写入4页，共7页'):
+            finalize_pdf_chunks.apply(args=[str(self.document.id), 7])
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.status, 'failed')
+
+
+def make_docx(*blocks):
+    """由body内的WordprocessingML片段生成最小的.docx文件内容"""
+    document = (
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+        + ''.join(blocks) + '</w:body></w:document>'
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('word/document.xml', document)
+    return buffer.getvalue()
+
+
+def word_paragraph(*runs, properties=''):
+    """runs中的字符串为文本，其余为原样插入的run内元素"""
+    content = ''.join(f'<w:t>{run}</w:t>' if not run.startswith('<') else run for run in runs)
+    return f'<w:p>{properties}<w:r>{content}</w:r></w:p>'
+
+
+HARD_BREAK = '<w:br w:type="page"/>'
+RENDERED_BREAK = '<w:lastRenderedPageBreak/>'
+
+
+class WordPagesTests(SimpleTestCase):
+
+    def pages(self, *blocks, **options):
+        handle, path = tempfile.mkstemp(suffix='.docx')
+        with os.fdopen(handle, 'wb') as f:
+            f.write(make_docx(*blocks))
+        self.addCleanup(os.remove, path)
+        options.setdefault('paragraphs_per_page', 40)
+        return [
+            (text, [(entry['index'], entry['text']) for entry in layout])
+            for _, text, layout in iter_word_pages(path, **options)
+        ]
+
+    def test_hard_break_splits_paragraph(self):
+        pages = self.pages(word_paragraph('前言', HARD_BREAK, '正文'), word_paragraph('结尾'))
+        
+        self.assertEqual(pages, [
+            ('前言\n', [(0, '前言正文')]),
+            ('正文\n结尾\n', [(1, '结尾')]),
+        ])
+
+    def test_rendered_break_at_paragraph_start_moves_entry_with_text(self):
+        blocks = (word_paragraph('第一页'), word_paragraph(RENDERED_BREAK, '第二页'))
+        
+        self.assertEqual(self.pages(*blocks), [
+            ('第一页\n', [(0, '第一页')]),
+            ('第二页\n', [(1, '第二页')]),
+        ])
+        self.assertEqual(self.pages(*blocks, use_rendered_breaks=False), [
+            ('第一页\n第二页\n', [(0, '第一页'), (1, '第二页')]),
+        ])
+
+    def test_hard_break_followed_by_rendered_break_splits_once(self):
+        across_paragraphs = self.pages(word_paragraph('甲', HARD_BREAK), word_paragraph(RENDERED_BREAK, '乙'))
+        within_paragraph = self.pages(word_paragraph('甲', HARD_BREAK, RENDERED_BREAK, '乙'))
+        
+        self.assertEqual(across_paragraphs, [('甲\n', [(0, '甲')]), ('乙\n', [(1, '乙')])])
+        self.assertEqual(within_paragraph, [('甲\n', [(0, '甲乙')]), ('乙\n', [])])
+
+    def test_page_break_before_and_section_break(self):
+        pages = self.pages(
+            word_paragraph('封面'),
+            word_paragraph('目录', properties='<w:pPr><w:pageBreakBefore/></w:pPr>'),
+            word_paragraph('第一章', properties='<w:pPr><w:sectPr/></w:pPr>'),
+            word_paragraph('第二章'),
+        )
+        
+        self.assertEqual([text for text, _ in pages], ['封面\n', '目录\n第一章\n', '第二章\n'])
+
+    def test_tables_are_single_blocks(self):
+        cell = '<w:tc>{}</w:tc>'
+        table = '<w:tbl><w:tr>{}{}</w:tr><w:tr>{}{}</w:tr></w:tbl>'.format(
+            cell.format(word_paragraph('项目')), cell.format(word_paragraph('金额')),
+            cell.format(word_paragraph('合计')), cell.format(word_paragraph('100')),
+        )
+        handle, path = tempfile.mkstemp(suffix='.docx')
+        with os.fdopen(handle, 'wb') as f:
+            f.write(make_docx(word_paragraph('说明'), table, word_paragraph('备注')))
+        self.addCleanup(os.remove, path)
+        
+        [(page_num, text, layout)] = list(iter_word_pages(path, paragraphs_per_page=40))
+        self.assertEqual(text, '说明\n项目\t金额\n合计\t100\n备注\n')
+        self.assertEqual([entry['type'] for entry in layout], ['paragraph', 'table', 'paragraph'])
+        self.assertEqual(layout[1]['rows'], [['项目', '金额'], ['合计', '100']])
+        self.assertEqual(layout[2]['index'], 2)
+
+    def test_paragraphs_per_page_limit(self):
+        pages = self.pages(*(word_paragraph(f'段落{n}') for n in range(5)), paragraphs_per_page=2)
+        
+        self.assertEqual([[index for index, _ in layout] for _, layout in pages], [[0, 1], [2, 3], [4]])
+
+    def test_rejects_legacy_doc(self):
+        handle, path = tempfile.mkstemp(suffix='.doc')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        with self.assertRaises(ValueError):
+            list(iter_word_pages(path, paragraphs_per_page=40))
+
+
+class OCREnginePoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.pool = OCREnginePool(max_engines_per_key=1)
+        self.created = []
+        
+        def create(key):
+            engine = FakeOCREngine()
+            self.created.append((key, engine))
+            return engine
+        patcher = patch.object(self.pool, '_create', side_effect=create)
+        self.create = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_engines_per_key_are_capped(self):
+        borrowed = []
+        
+        def borrow():
+            with self.pool.engine('ch') as engine:
+                borrowed.append(engine)
+        
+        with self.pool.engine('ch') as first:
+            waiter = threading.Thread(target=borrow)
+            waiter.start()
+            waiter.join(0.2)
+            self.assertTrue(waiter.is_alive())
+            # 其他识别选项的分组不受影响
+            with self.pool.engine('en') as other:
+                self.assertIsNot(other, first)
+        waiter.join(5)
+        
+        self.assertEqual(borrowed, [first])
+        self.assertEqual([key for key, _ in self.created], [('ch', True), ('en', True)])
+
+    def test_engine_is_returned_after_exception(self):
+        with self.assertRaises(RuntimeError):
+            with self.pool.engine() as engine:
+                raise RuntimeError('inference failed')
+        
+        with self.pool.engine() as again:
+            self.assertIs(again, engine)
+        self.assertEqual(len(self.created), 1)
+
+    def test_failed_creation_releases_its_slot(self):
+        self.create.side_effect = [OSError('model download failed'), FakeOCREngine()]
+        
+        with self.assertRaises(OSError):
+            with self.pool.engine():
+                pass
+        self.assertEqual(self.pool._created[('ch', True)], 0)
+        with self.pool.engine() as engine:
+            self.assertIsInstance(engine, FakeOCREngine)
+        self.assertEqual(self.pool._created[('ch', True)], 1)
+
+
+class OCRWarmUpTests(SimpleTestCase):
+
+    def worker_app(self, *queues):
+        app = Celery('worker', set_as_current=False)
+        app.conf.task_default_queue = 'default'
+        if queues:
+            app.amqp.queues.select(queues)
+        return app
+
+    def test_only_ocr_workers_warm_up(self):
+        self.assertTrue(consumes_warmup_queues(self.worker_app('ocr')))
+        self.assertTrue(consumes_warmup_queues(self.worker_app('ocr', 'default')))
+        self.assertFalse(consumes_warmup_queues(self.worker_app('pdf_text')))
+        self.assertFalse(consumes_warmup_queues(self.worker_app()))
+
+    def test_warm_up_skips_other_queues(self):
+        for queues, calls in ((('pdf_text',), 0), (('ocr',), 1)):
+            with patch('documents.ocr.current_app', self.worker_app(*queues)), \
+                    patch('documents.ocr.ocr_pool.warm_up') as warm_up:
+                warm_up_ocr_engines()
+            self.assertEqual(warm_up.call_count, calls)
+
+
+def make_tiff(*shades):
+    """每个灰度值生成一帧的多帧TIFF"""
+    frames = [Image.new('L', (64, 48), shade) for shade in shades]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format='TIFF', save_all=True, append_images=frames[1:])
+    return buffer.getvalue()
+
+
+@override_settings(DOCUMENT_OCR_MAX_WORKERS=1)
+class MultiFrameImageTests(DocumentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        get_document_storage().write('uploads/fax.tiff', [make_tiff(10, 60, 110, 160, 210)])
+        self.document = self.create_document(filename='fax.tiff', source_type='image', storage_path='uploads/fax.tiff')
+        self.frames_on_disk = []
+
+    def fake_ocr(self, path, fail_on=None):
+        """按帧文件名返回识别结果，置信度为页码的十分之一"""
+        page_num = int(os.path.basename(path)[len('page_'):-len('.png')])
+        self.frames_on_disk.append(len(os.listdir(os.path.dirname(path))))
+        if page_num == fail_on:
+            raise RuntimeError(f'OCR failed on page {page_num}')
+        return f'第{page_num}页', [], page_num / 10, {'ocr_seconds': 0.0}
+
+    def process(self, fail_on=None):
+        with patch('documents.tasks.ocr_image_file', side_effect=lambda path: self.fake_ocr(path, fail_on)):
+            process_image(self.document, get_pages_dir(self.document))
+
+    def test_frames_become_pages_in_order(self):
+        self.process()
+        
+        pages = list(self.document.pages.order_by('page_num').values_list('page_num', 'text', 'ocr_confidence'))
+        self.assertEqual(pages, [(n, f'第{n}页', n / 10) for n in range(1, 6)])
+        self.assertEqual(self.document.processing_metrics['pages'], {'written': 5, 'skipped': 0})
+        # 识别完成的帧立即删除，排队中的帧不超过并发数的两倍
+        self.assertLessEqual(max(self.frames_on_disk), 2)
+
+    def test_unchanged_frames_are_not_written_to_disk(self):
+        self.process()
+        get_document_storage().write('uploads/fax.tiff', [make_tiff(10, 60, 120, 160, 210)])
+        
+        with patch('documents.tasks.write_frame_png', wraps=write_frame_png) as write_frame:
+            self.process()
+        
+        self.assertEqual([call.args[2] for call in write_frame.call_args_list], [3])
+        self.assertEqual(self.document.processing_metrics['pages'], {'written': 1, 'skipped': 4})
+
+    def test_completed_frames_survive_a_failure(self):
+        with self.assertRaisesMessage(RuntimeError, 'OCR failed on page 4'):
+            self.process(fail_on=4)
+        
+        self.assertEqual(list(self.document.pages.order_by('page_num').values_list('page_num', flat=True)), [1, 2, 3])
+        
+        self.process()
+        self.assertEqual(self.document.processing_metrics['pages'], {'written': 2, 'skipped': 3})
+
+
+@override_settings(
+    DOCUMENT_PROGRESS_ENABLED=True,
+    DOCUMENT_PROGRESS_BROKER='documents.progress.LocalProgressBroker',
+    DOCUMENT_PDF_FANOUT_ENABLED=False,
+)
+class ProgressEventTests(DocumentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        get_document_storage().write('uploads/two.pdf', [make_pdf('alpha', 'beta')])
+        self.batch = UploadBatch.objects.create(created_by=self.user)
+        self.document = self.create_document(storage_path='uploads/two.pdf', status='pending', batch=self.batch)
+
+    async def collect(self, channels, task, *args):
+        """订阅频道后在同步线程中执行task，返回收到的全部事件"""
+        subscription = await get_progress_broker().subscribe(channels)
+        try:
+            try:
+                await sync_to_async(task)(*args)
+            except Exception:
+                pass
+            events = []
+            while (event := await subscription.get(0.2)) is not None:
+                events.append(event)
+            return events
+        finally:
+            await subscription.close()
+
+    async def test_preprocess_publishes_status_and_page_events(self):
+        events = await self.collect([document_channel(self.document.id)], preprocess_document.delay, str(self.document.id))
+        
+        self.assertEqual(
+            [(event['event'], event.get('status')) for event in events],
+            [('status', 'processing'), ('pages', None), ('status', 'preprocessed')],
+        )
+        self.assertEqual((events[1]['written'], events[1]['skipped']), (2, 0))
+        self.assertEqual(events[2]['page_count'], 2)
+        for event in events:
+            self.assertEqual(event['document_id'], str(self.document.id))
+            self.assertEqual(event['batch_id'], str(self.batch.id))
+
+    async def test_batch_channel_receives_document_events(self):
+        events = await self.collect([batch_channel(self.batch.id)], preprocess_document.delay, str(self.document.id))
+        self.assertEqual(events[-1]['status'], 'preprocessed')
+
+    async def test_failure_publishes_error_then_status(self):
+        await sync_to_async(get_document_storage().delete)('uploads/two.pdf')
+        events = await self.collect([document_channel(self.document.id)], preprocess_document.delay, str(self.document.id))
+        
+        self.assertEqual([event['event'] for event in events[-2:]], ['error', 'status'])
+        self.assertEqual(events[-2]['stage'], 'preprocess')
+        self.assertEqual(events[-1]['status'], 'failed')
+
+    async def test_extraction_publishes_field_events(self):
+        def prepare():
+            PromptTemplate.objects.create(name='默认', system_prompt='', field_prompts={}, default_prompt='')
+            FieldDefinition.objects.create(key='policy_no', label='保单号', ui_order=1)
+            FieldDefinition.objects.create(key='insured', label='被保险人', ui_order=2)
+        await sync_to_async(prepare)()
+        
+        def fail_insured(prompt, field_def, pages):
+            if field_def.key == 'insured':
+                raise RuntimeError('model timeout')
+            return {'value': 'P-1', 'confidence': 0.9}
+        with patch('extractions.tasks.call_extraction_model', side_effect=fail_insured):
+            events = await self.collect([document_channel(self.document.id)], extract_fields, str(self.document.id))
+        
+        fields = [event for event in events if event['event'] == 'field']
+        self.assertEqual(
+            [(event['field_key'], event['done'], event['total'], event['success']) for event in fields],
+            [('policy_no', 1, 2, True), ('insured', 2, 2, False)],
+        )
+        self.assertEqual(fields[1]['error'], 'model timeout')
+        self.assertEqual((events[-1]['status'], events[-1]['extracted_fields']), ('extracted', 1))
+
+    def test_disabled_progress_publishes_nothing(self):
+        with self.settings(DOCUMENT_PROGRESS_ENABLED=False), \
+                patch('documents.progress.LocalProgressBroker.publish') as publish:
+            preprocess_document.delay(str(self.document.id))
+        publish.assert_not_called()
+
+
+@override_settings(
+    DOCUMENT_PROGRESS_ENABLED=True,
+    DOCUMENT_PROGRESS_BROKER='documents.progress.LocalProgressBroker',
+    DOCUMENT_PROGRESS_KEEPALIVE_SECONDS=0.1,
+    DOCUMENT_PROGRESS_STREAM_MAX_SECONDS=0.5,
+)
+class ProgressStreamTests(DocumentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.document = self.create_document(status='processing')
+        self.async_client = AsyncClient()
+        self.async_client.force_login(self.user)
+        self.url = f'/api/v1/documents/{self.document.id}/events/'
+
+    async def test_stream_sends_snapshot_events_keepalives_and_ends(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        
+        chunks = []
+        async for chunk in response.streaming_content:
+            chunk = chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
+            if not chunks:
+                self.assertTrue(chunk.startswith('event: snapshot\n'))
+                self.assertIn('"status": "processing"', chunk)
+                get_progress_broker().publish(
+                    [document_channel(self.document.id)], {'event': 'status', 'status': 'preprocessed'}
+                )
+            chunks.append(chunk)
+        
+        self.assertEqual(chunks[1], 'event: status\ndata: {"event": "status", "status": "preprocessed"}\n\n')
+        self.assertIn(': keepalive\n\n', chunks[2:])
+        # 超过最长保持时间后流结束并取消订阅
+        self.assertEqual(get_progress_broker()._subscribers, {})
+
+    async def test_stream_requires_authentication(self):
+        response = await AsyncClient().get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+    async def test_unknown_document_returns_404(self):
+        response = await self.async_client.get('/api/v1/documents/00000000-0000-0000-0000-000000000000/events/')
+        self.assertEqual(response.status_code, 404)
@@ -1,7 +1,13 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
+from documents.streams import batch_events, document_events
 from documents.views import DocumentViewSet
 
 router = DefaultRouter()
 router.register(r'', DocumentViewSet, basename='document')
 
-urlpatterns = router.urls
\ No newline at end of file
+urlpatterns = [
+    # 处理进度SSE推送（异步视图，需以ASGI方式部署）
+    path('<uuid:pk>/events/', document_events, name='document-events'),
+    path('batches/<uuid:batch_id>/events/', batch_events, name='document-batch-events'),
+] + router.urls
\ No newline at end of file
@@ -1,16 +1,100 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.http import FileResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
+from celery import group
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.http import FileResponse, HttpResponseRedirect
+from django.db import transaction
+from django.db.models import Count, Prefetch, Sum
+from django.utils import timezone
+import hashlib
 import os
+import tarfile
 import uuid
-from datetime import datetime
+import zipfile
 
-from documents.models import Document
-from documents.serializers import DocumentSerializer, DocumentCreateSerializer
-from documents.tasks import process_document_async
+from documents.archives import is_archive, iter_archive_entries
+from documents.models import Document, DocumentPage, DocumentStatusCounter, UploadBatch, UploadSession
+from documents.serializers import (
+    DocumentSerializer,
+    DocumentListSerializer,
+    DocumentPageListSerializer,
+    DocumentCreateSerializer,
+    UploadBatchSerializer,
+    UploadSessionSerializer
+)
+from documents.page_images import PageTooLarge, page_image_content_type, render_page_image, page_geometry
+from documents.responses import serve_file, is_partial_continuation
+from documents.search import PageSearch
+from documents.storage import get_document_storage, read_chunks, upload_name
+from documents.tasks import (
+    build_document_pipeline,
+    clone_document_results,
+    pipeline_template_id,
+    DEDUP_REUSABLE_STATUSES
+)
+from extractions.tasks import extract_fields
+from prompts.models import PromptTemplate
 from audit.models import AuditLog
+from audit.tasks import enqueue_audit_logs
+
+User = get_user_model()
+
+# 流式读写上传文件时的块大小
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# 统计接口返回的文档状态
+STATS_STATUSES = ['uploaded', 'pending', 'processing', 'preprocessed', 'processed', 'extracting', 'extracted', 'failed']
+
+# 批次进度中视为预处理已完成的文档状态
+BATCH_DONE_STATUSES = ['preprocessed', 'processed', 'extracting', 'extracted']
+
+def status_summary(rows):
+    """将按状态分组的计数行汇总为统计字典"""
+    summary = dict.fromkeys(STATS_STATUSES, 0)
+    summary['total'] = 0
+    for row in rows:
+        summary['total'] += row['total'] or 0
+        if row['status'] in summary:
+            summary[row['status']] += row['total'] or 0
+    return summary
+
+def batch_progress_summary(batch):
+    """按状态汇总批次内文档数量，计算完成比例"""
+    rows = Document.objects.filter(batch=batch).values('status').annotate(total=Count('id'))
+    summary = status_summary(rows)
+    done = sum(summary[name] for name in BATCH_DONE_STATUSES)
+    finished = done + summary['failed']
+    
+    data = UploadBatchSerializer(batch).data
+    data['progress'] = {
+        'total': summary['total'],
+        'done': done,
+        'failed': summary['failed'],
+        'in_progress': summary['total'] - finished,
+        'percent': round(finished * 100 / summary['total'], 1) if summary['total'] else 100.0,
+        'by_status': {name: count for name, count in summary.items() if name != 'total' and count},
+    }
+    data['finished'] = finished == summary['total']
+    return data
+
+class PageCursorPagination(CursorPagination):
+    """按页码游标分页"""
+    ordering = 'page_num'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+class SearchPagination(PageNumberPagination):
+    """全文检索结果按相关度排序，使用页码分页"""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
 
 class DocumentViewSet(viewsets.ModelViewSet):
     """文档视图集"""
@@ -18,9 +102,36 @@ class DocumentViewSet(viewsets.ModelViewSet):
     serializer_class = DocumentSerializer
     permission_classes = [IsAuthenticated]
     
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            return self._list_queryset(queryset)
+        if self.action == 'retrieve':
+            return queryset.select_related('uploaded_by').annotate(page_count=Count('pages')).prefetch_related(
+                Prefetch('pages', queryset=DocumentPage.objects.defer('layout_index').order_by('page_num'))
+            )
+        return queryset
+    
+    def _list_queryset(self, queryset):
+        """列表只查询需要返回的列：按?fields=裁剪字段，按需关联上传用户和注解页数"""
+        requested = DocumentListSerializer.requested_fields(self.request)
+        wanted = set(DocumentListSerializer.Meta.fields) if requested is None else requested
+        
+        columns = [name for name in DocumentListSerializer.Meta.fields if name in wanted and name not in ('uploaded_by', 'page_count')]
+        # 排序与搜索依赖的列始终保留
+        columns += ['id', 'created_at']
+        if 'uploaded_by' in wanted:
+            queryset = queryset.select_related('uploaded_by')
+            columns += ['uploaded_by__username']
+        if 'page_count' in wanted:
+            queryset = queryset.annotate(page_count=Count('pages'))
+        return queryset.only(*set(columns))
+    
     def get_serializer_class(self):
         if self.action == 'create':
             return DocumentCreateSerializer
+        if self.action == 'list':
+            return DocumentListSerializer
         return DocumentSerializer
     
     def perform_create(self, serializer):
@@ -28,35 +139,57 @@ class DocumentViewSet(viewsets.ModelViewSet):
         file_obj = self.request.FILES.get('file')
         if not file_obj:
             raise ValueError("请上传文件")
+        template_id = self._extract_template_id()
         
-        # 生成唯一文件名
-        ext = os.path.splitext(file_obj.name)[1]
-        unique_filename = f"{uuid.uuid4()}{ext}"
+        # 生成唯一的存储名
+        relative_path = upload_name(file_obj.name)
         
-        # 确保上传目录存在
-        upload_dir = os.path.join(os.getcwd(), 'uploads', datetime.now().strftime('%Y%m%d'))
-        os.makedirs(upload_dir, exist_ok=True)
+        # 流式写入文档存储，写入的同时计算内容摘要
+        digest = hashlib.sha256()
+        get_document_storage().write(relative_path, self._digest_chunks(file_obj.chunks(UPLOAD_CHUNK_SIZE), digest))
         
-        # 保存文件
-        file_path = os.path.join(upload_dir, unique_filename)
-        with open(file_path, 'wb') as f:
-            for chunk in file_obj.chunks():
-                f.write(chunk)
-        
-        # 计算相对路径用于存储
-        relative_path = os.path.join('uploads', datetime.now().strftime('%Y%m%d'), unique_filename)
+        self._register_upload(serializer.save, file_obj.name, relative_path, digest.hexdigest(), file_obj.size, template_id)
+    
+    def _digest_chunks(self, chunks, digest):
+        """边产出数据块边更新内容摘要"""
+        for chunk in chunks:
+            digest.update(chunk)
+            yield chunk
+    
+    def _register_upload(self, save, filename, relative_path, content_hash, size, template_id=None):
+        """
+        为已写入磁盘的上传文件创建文档记录、记录审计日志并触发处理
+        save为创建文档的可调用对象（serializer.save或Document.objects.create）
+        template_id为自动抽取使用的Prompt模板，为None时只做预处理
+        """
+        # 查找内容完全相同的已上传文档，复用其存储文件
+        duplicate = self._find_duplicate(content_hash)
+        if duplicate:
+            get_document_storage().delete(relative_path)
+            relative_path = duplicate.storage_path
         
         # 获取文件类型
-        source_type = self._get_file_type(ext)
+        source_type = self._get_file_type(os.path.splitext(filename)[1])
         
         # 创建文档记录
-        document = serializer.save(
-            filename=file_obj.name,
+        document = save(
+            filename=filename,
             source_type=source_type,
             storage_path=relative_path,
+            content_hash=content_hash,
             uploaded_by=self.request.user
         )
         
+        # 已处理过的相同文件直接复制页面（及抽取结果），无需重新处理
+        reused = False
+        if duplicate and duplicate.status in DEDUP_REUSABLE_STATUSES:
+            clone_document_results(
+                duplicate,
+                document,
+                include_extractions=self._flag('reuse_extractions', settings.DOCUMENT_DEDUP_REUSE_EXTRACTIONS)
+            )
+            reused = True
+        
         # 记录审计日志
         AuditLog.objects.create(
             action=AuditLog.ACTION_UPLOAD,
@@ -64,54 +197,533 @@ class DocumentViewSet(viewsets.ModelViewSet):
             entity_id=str(document.id),
             user=self.request.user,
             details={
-                'filename': file_obj.name,
+                'filename': filename,
                 'source_type': source_type,
-                'size': file_obj.size
+                'size': size,
+                'content_hash': content_hash,
+                'duplicate_of': str(duplicate.id) if duplicate else None,
+                'auto_extract_template_id': template_id
             }
         )
         
-        # 异步处理文档
-        process_document_async.delay(document.id)
+        # 异步处理文档：预处理与自动抽取作为一条流水线投递
+        if not reused:
+            build_document_pipeline(document, prompt_template_id=template_id).apply_async()
+        elif template_id and document.status != 'extracted':
+            extract_fields.delay(str(document.id), template_id)
+        
+        return document
+    
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_upload(self, request):
+        """
+        批量上传
+        表单字段files可重复提供多个文件，其中的ZIP/TAR压缩包会被流式解包，每个条目作为一个文档；
+        文档与审计日志批量写入，处理任务作为一个Celery group统一下发。
+        返回批次信息，可通过GET batches/{id}/ 查询整体进度
+        """
+        uploads = request.FILES.getlist('files')
+        if not uploads:
+            return Response({'error': '请上传文件'}, status=status.HTTP_400_BAD_REQUEST)
+        template_id = self._extract_template_id()
+        
+        entries = []
+        skipped = []
+        try:
+            for upload in uploads:
+                if is_archive(upload.name):
+                    for filename, stream in iter_archive_entries(upload, upload.name):
+                        self._store_bulk_entry(filename, iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''), entries, skipped)
+                else:
+                    self._store_bulk_entry(upload.name, upload.chunks(UPLOAD_CHUNK_SIZE), entries, skipped)
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+            self._discard_entries(entries)
+            return Response({'error': f"压缩包无法解析: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception:
+            # 任一文件失败时整批放弃，清理已写入的文件
+            self._discard_entries(entries)
+            raise
+        
+        batch = self._register_batch(entries, skipped, template_id)
+        return Response(batch_progress_summary(batch), status=status.HTTP_201_CREATED)
+    
+    def _discard_entries(self, entries):
+        storage = get_document_storage()
+        for entry in entries:
+            storage.delete(entry['storage_path'])
+    
+    def _store_bulk_entry(self, filename, chunks, entries, skipped):
+        """将批量上传中的单个文件流式写入文档存储，检查文件类型与批次限制"""
+        source_type = self._get_file_type(os.path.splitext(filename)[1])
+        if source_type == 'other':
+            skipped.append({'filename': filename, 'reason': '不支持的文件类型'})
+            return
+        if len(entries) >= settings.DOCUMENT_BULK_MAX_FILES:
+            raise ValidationError({'error': f"单批最多上传{settings.DOCUMENT_BULK_MAX_FILES}个文件"})
+        
+        relative_path = upload_name(filename)
+        entries.append({'filename': filename, 'source_type': source_type, 'storage_path': relative_path})
+        unpacked = sum(entry.get('size', 0) for entry in entries)
+        
+        def limited(chunks):
+            size = unpacked
+            for chunk in chunks:
+                size += len(chunk)
+                # 解压后的总大小受限，防止压缩炸弹占满存储
+                if size > settings.DOCUMENT_BULK_MAX_UNPACKED_SIZE:
+                    raise ValidationError({'error': '批量上传的文件总大小超出限制'})
+                yield chunk
+        
+        digest = hashlib.sha256()
+        size = get_document_storage().write(relative_path, self._digest_chunks(limited(chunks), digest))
+        entries[-1].update(content_hash=digest.hexdigest(), size=size)
+    
+    def _dedup_batch_entries(self, entries, skipped):
+        """同一批次内内容相同的文件只保留第一个，其余删除已写入的文件并记入skipped"""
+        kept = {}
+        for entry in entries:
+            first = kept.setdefault(entry['content_hash'], entry)
+            if first is not entry:
+                get_document_storage().delete(entry['storage_path'])
+                skipped.append({'filename': entry['filename'], 'reason': f"与批次内文件内容相同: {first['filename']}"})
+        return list(kept.values())
+    
+    def _register_batch(self, entries, skipped, template_id=None):
+        """
+        为批量上传的文件创建批次与文档记录
+        文档和审计日志各用一次bulk_create写入；bulk_create不触发信号，状态计数按维度汇总后调整。
+        批次内内容相同的文件只保留一个，内容相同的已处理文档直接复制结果，其余文档的处理流水线合并为一个group下发
+        """
+        user = self.request.user
+        duplicates = {}
+        if self._flag('dedup', settings.DOCUMENT_DEDUP_ENABLED):
+            entries = self._dedup_batch_entries(entries, skipped)
+            candidates = Document.objects.filter(
+                content_hash__in={entry['content_hash'] for entry in entries}
+            ).order_by('-created_at')
+            for candidate in candidates:
+                current = duplicates.get(candidate.content_hash)
+                if current is None or (current.status not in DEDUP_REUSABLE_STATUSES and candidate.status in DEDUP_REUSABLE_STATUSES):
+                    duplicates[candidate.content_hash] = candidate
+        
+        documents = []
+        for entry in entries:
+            duplicate = duplicates.get(entry['content_hash'])
+            if duplicate:
+                # 复用已有的存储文件
+                get_document_storage().delete(entry['storage_path'])
+                entry['storage_path'] = duplicate.storage_path
+            entry['duplicate'] = duplicate
+            documents.append(Document(
+                filename=entry['filename'],
+                source_type=entry['source_type'],
+                storage_path=entry['storage_path'],
+                content_hash=entry['content_hash'],
+                uploaded_by=user
+            ))
+        
+        with transaction.atomic():
+            batch = UploadBatch.objects.create(created_by=user, file_count=len(documents), skipped=skipped)
+            for document in documents:
+                document.batch = batch
+            Document.objects.bulk_create(documents)
+            
+            counts = {}
+            for document in documents:
+                document._counter_key = document.counter_key()
+                counts[document._counter_key] = counts.get(document._counter_key, 0) + 1
+            if settings.DOCUMENT_STATUS_COUNTERS_ENABLED:
+                for key, count in counts.items():
+                    DocumentStatusCounter.adjust(*key, count)
+            
+            AuditLog.objects.bulk_create([
+                AuditLog(
+                    action=AuditLog.ACTION_UPLOAD,
+                    entity_type='Document',
+                    entity_id=str(document.id),
+                    user=user,
+                    details={
+                        'filename': entry['filename'],
+                        'source_type': entry['source_type'],
+                        'size': entry['size'],
+                        'content_hash': entry['content_hash'],
+                        'duplicate_of': str(entry['duplicate'].id) if entry['duplicate'] else None,
+                        'batch_id': str(batch.id)
+                    }
+                )
+                for document, entry in zip(documents, entries)
+            ])
+        
+        include_extractions = self._flag('reuse_extractions', settings.DOCUMENT_DEDUP_REUSE_EXTRACTIONS)
+        pipelines = []
+        for document, entry in zip(documents, entries):
+            duplicate = entry['duplicate']
+            if duplicate and duplicate.status in DEDUP_REUSABLE_STATUSES:
+                clone_document_results(duplicate, document, include_extractions=include_extractions)
+                if template_id and document.status != 'extracted':
+                    pipelines.append(extract_fields.si(str(document.id), template_id))
+            else:
+                pipelines.append(build_document_pipeline(document, prompt_template_id=template_id))
+        
+        if pipelines:
+            group(pipelines).apply_async()
+        return batch
+    
+    @action(detail=False, methods=['get'], url_path=r'batches/(?P<batch_id>[^/.]+)')
+    def batch_progress(self, request, batch_id=None):
+        """
+        查询批量上传批次的处理进度
+        ?include=documents 时同时返回批次内各文档的状态
+        """
+        batch = get_object_or_404(UploadBatch, pk=batch_id)
+        data = batch_progress_summary(batch)
+        if request.query_params.get('include') == 'documents':
+            data['documents'] = list(batch.documents.order_by('created_at').values('id', 'filename', 'source_type', 'status'))
+        return Response(data)
+    
+    def _find_duplicate(self, content_hash):
+        """查找内容摘要相同的文档，优先返回已处理完成的最新文档"""
+        if not self._flag('dedup', settings.DOCUMENT_DEDUP_ENABLED):
+            return None
+        
+        candidates = Document.objects.filter(content_hash=content_hash).order_by('-created_at')
+        return candidates.filter(status__in=DEDUP_REUSABLE_STATUSES).first() or candidates.first()
+    
+    def _extract_template_id(self):
+        """
+        上传请求的自动抽取设置
+        auto_extract开关未提供时使用DOCUMENT_AUTO_EXTRACT，prompt_template_id未提供时使用当前激活的模板；
+        返回抽取使用的模板ID，不自动抽取时返回None
+        """
+        prompt_template_id = self.request.data.get('prompt_template_id', self.request.query_params.get('prompt_template_id'))
+        if prompt_template_id:
+            if not str(prompt_template_id).isdigit() or not PromptTemplate.objects.filter(id=prompt_template_id).exists():
+                raise ValidationError({'error': 'Prompt模板不存在'})
+            prompt_template_id = int(prompt_template_id)
+        return pipeline_template_id(self._flag('auto_extract', settings.DOCUMENT_AUTO_EXTRACT), prompt_template_id)
+    
+    def _flag(self, name, default):
+        """读取请求中的布尔开关参数，未提供时使用默认值"""
+        value = self.request.data.get(name, self.request.query_params.get(name))
+        if value is None:
+            return default
+        return str(value).lower() in ('1', 'true', 'yes')
+    
+    @action(detail=False, methods=['post'], url_path='uploads')
+    def create_upload(self, request):
+        """
+        创建断点续传上传会话
+        请求体: {"filename": "...", "total_size": 字节数}
+        之后通过PATCH uploads/{id}/ 按偏移量追加分片，最后POST uploads/{id}/finalize/ 完成上传
+        """
+        serializer = UploadSessionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        session_id = uuid.uuid4()
+        temp_path = f"{session_id}.part"
+        os.makedirs(settings.DOCUMENT_UPLOAD_TEMP_DIR, exist_ok=True)
+        open(os.path.join(settings.DOCUMENT_UPLOAD_TEMP_DIR, temp_path), 'wb').close()
+        
+        session = serializer.save(id=session_id, temp_path=temp_path, created_by=request.user)
+        
+        response = Response(UploadSessionSerializer(session).data, status=status.HTTP_201_CREATED)
+        response['Location'] = request.build_absolute_uri(f"{session.id}/")
+        response['Upload-Offset'] = str(session.offset)
+        return response
+    
+    @action(detail=False, methods=['get', 'head', 'patch'], url_path=r'uploads/(?P<session_id>[^/.]+)')
+    def upload_chunk(self, request, session_id=None):
+        """
+        查询上传偏移量（GET/HEAD），或从Upload-Offset指定的偏移量追加一个分片（PATCH）
+        分片从请求流中直接写入临时文件，不经过内存缓冲
+        """
+        session = self._get_upload_session(session_id)
+        
+        if request.method == 'PATCH':
+            if session.status != 'uploading':
+                return Response({'error': '上传会话已结束'}, status=status.HTTP_409_CONFLICT)
+            
+            try:
+                offset = int(request.headers.get('Upload-Offset', ''))
+            except ValueError:
+                return Response({'error': '缺少有效的Upload-Offset请求头'}, status=status.HTTP_400_BAD_REQUEST)
+            if offset != session.offset:
+                response = Response({'error': '偏移量不匹配', 'offset': session.offset}, status=status.HTTP_409_CONFLICT)
+                response['Upload-Offset'] = str(session.offset)
+                return response
+            
+            new_offset = self._append_chunk(session, request.stream)
+            if new_offset is None:
+                return Response({'error': '分片超出文件总大小'}, status=status.HTTP_400_BAD_REQUEST)
+            
+            # 以旧偏移量作为条件更新，防止并发请求重复追加；update()不会自动刷新updated_at，显式更新供过期清理判断
+            updated = UploadSession.objects.filter(id=session.id, status='uploading', offset=offset).update(
+                offset=new_offset, updated_at=timezone.now()
+            )
+            if not updated:
+                return Response({'error': '偏移量已被其他请求更新'}, status=status.HTTP_409_CONFLICT)
+            session.offset = new_offset
+        
+        response = Response(
+            UploadSessionSerializer(session).data,
+            status=status.HTTP_204_NO_CONTENT if request.method == 'PATCH' else status.HTTP_200_OK
+        )
+        response['Upload-Offset'] = str(session.offset)
+        response['Upload-Length'] = str(session.total_size)
+        response['Cache-Control'] = 'no-store'
+        return response
+    
+    @action(detail=False, methods=['post'], url_path=r'uploads/(?P<session_id>[^/.]+)/finalize')
+    def finalize_upload(self, request, session_id=None):
+        """
+        完成断点续传上传：校验文件完整后创建文档记录并触发处理
+        以会话状态为条件认领会话，并发的finalize请求只有一个会创建文档，其余返回409
+        """
+        session = self._get_upload_session(session_id)
+        
+        if session.status != 'uploading':
+            return Response({'error': '上传会话已结束'}, status=status.HTTP_409_CONFLICT)
+        if session.offset != session.total_size:
+            return Response(
+                {'error': '文件尚未上传完整', 'offset': session.offset, 'total_size': session.total_size},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        template_id = self._extract_template_id()
+        
+        claimed = UploadSession.objects.filter(
+            id=session.id, status='uploading', offset=session.total_size
+        ).update(status='finalizing', updated_at=timezone.now())
+        if not claimed:
+            return Response({'error': '上传会话已结束'}, status=status.HTTP_409_CONFLICT)
+        
+        temp_file = self._upload_temp_file(session)
+        try:
+            # 流式计算内容摘要后移入文档存储
+            digest = hashlib.sha256()
+            with open(temp_file, 'rb') as f:
+                for chunk in read_chunks(f, UPLOAD_CHUNK_SIZE):
+                    digest.update(chunk)
+            
+            relative_path = upload_name(session.filename)
+            get_document_storage().save_file(relative_path, temp_file)
+            
+            document = self._register_upload(
+                lambda **fields: Document.objects.create(**fields),
+                session.filename,
+                relative_path,
+                digest.hexdigest(),
+                session.total_size,
+                template_id
+            )
+        except Exception:
+            # 暂存文件仍在时允许重新完成上传，否则会话无法继续
+            restored = 'uploading' if os.path.exists(temp_file) else 'failed'
+            UploadSession.objects.filter(id=session.id, status='finalizing').update(status=restored)
+            raise
+        
+        session.status = 'completed'
+        session.document = document
+        session.save()
+        
+        return Response(DocumentSerializer(document).data, status=status.HTTP_201_CREATED)
+    
+    def _get_upload_session(self, session_id):
+        return get_object_or_404(UploadSession, id=session_id, created_by=self.request.user)
+    
+    def _upload_temp_file(self, session):
+        """上传会话的分片暂存文件路径"""
+        return os.path.join(settings.DOCUMENT_UPLOAD_TEMP_DIR, session.temp_path)
+    
+    def _append_chunk(self, session, stream):
+        """
+        将请求流追加写入临时文件，返回新的偏移量；超出文件总大小时返回None
+        写入前按数据库中的偏移量截断文件，丢弃上次中断时未确认的残留数据
+        """
+        temp_file = self._upload_temp_file(session)
+        offset = session.offset
+        with open(temp_file, 'r+b') as f:
+            f.truncate(offset)
+            f.seek(offset)
+            while stream is not None:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                if offset > session.total_size:
+                    f.truncate(session.offset)
+                    return None
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        return offset
     
     @action(detail=True, methods=['get'])
     def download(self, request, pk=None):
-        """下载文档"""
+        """
+        下载文档
+        本地存储的文件直接返回（支持条件请求、Range和sendfile），对象存储重定向到预签名下载地址
+        """
         try:
             document = self.get_object()
-            file_path = os.path.join(os.getcwd(), document.storage_path)
+            storage = get_document_storage()
             
-            if not os.path.exists(file_path):
+            if not storage.exists(document.storage_path):
                 return Response({'error': '文件不存在'}, status=status.HTTP_404_NOT_FOUND)
             
-            # 记录下载日志
-            AuditLog.objects.create(
-                action=AuditLog.ACTION_DOWNLOAD,
-                entity_type='Document',
-                entity_id=str(document.id),
-                user=request.user,
-                details={'filename': document.filename}
-            )
+            file_path = storage.local_file(document.storage_path)
+            if file_path:
+                response = serve_file(request, file_path, filename=document.filename, as_attachment=True)
+            else:
+                response = HttpResponseRedirect(storage.url(document.storage_path, document.filename))
             
-            return FileResponse(
-                open(file_path, 'rb'),
-                as_attachment=True,
-                filename=document.filename
-            )
+            # 记录下载日志（缓存校验命中和分段读取的后续请求不重复记录），由audit队列异步写入
+            if response.status_code in (200, 206, 302) and not is_partial_continuation(request):
+                enqueue_audit_logs([{
+                    'action': AuditLog.ACTION_DOWNLOAD,
+                    'entity_type': 'Document',
+                    'entity_id': str(document.id),
+                    'user_id': request.user.id,
+                    'details': {'filename': document.filename}
+                }])
+            
+            return response
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
+    @action(detail=True, methods=['get'])
+    def pages(self, request, pk=None):
+        """
+        分页获取文档页面
+        默认只返回页面元数据；?include=text,layout_json 按需返回页面文本和布局
+        """
+        document = get_object_or_404(Document.objects.only('id'), pk=pk)
+        
+        # 空间索引只供片段查询使用，列表中始终不加载
+        deferred = DocumentPageListSerializer.deferred_columns(request)
+        queryset = DocumentPage.objects.filter(document=document).defer('layout_index', *deferred)
+        
+        paginator = PageCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = DocumentPageListSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+    
+    @action(detail=True, methods=['get'], url_path=r'pages/(?P<page_num>\d+)/spans')
+    def page_spans(self, request, pk=None, page_num=None):
+        """
+        查询页面上的文本片段
+        参数: bbox=x0,y0,x1,y1 返回与矩形相交的片段（mode=contains时只返回完全位于矩形内的片段）
+              near=x,y 返回距离该点最近的k个片段（k默认为1）
+        坐标与页面布局一致（PDF为点，图像为像素）
+        """
+        page = get_object_or_404(
+            DocumentPage.objects.only('id', 'page_num', 'layout_json', 'layout_blob', 'layout_index'),
+            document_id=pk,
+            page_num=page_num
+        )
+        
+        try:
+            bbox = request.query_params.get('bbox')
+            near = request.query_params.get('near')
+            mode = request.query_params.get('mode', 'intersects')
+            k = int(request.query_params.get('k', 1))
+            rect = [float(value) for value in bbox.split(',')] if bbox else None
+            point = [float(value) for value in near.split(',')] if near else None
+            if (rect is None) == (point is None) or (rect and len(rect) != 4) or (point and len(point) != 2):
+                raise ValueError
+            if mode not in ('intersects', 'contains') or not 1 <= k <= 100:
+                raise ValueError
+        except ValueError:
+            return Response({'error': '请提供bbox=x0,y0,x1,y1或near=x,y其中之一'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        spans = page.spans()
+        if spans is None:
+            return Response({'error': '该页面没有文本片段坐标'}, status=status.HTTP_404_NOT_FOUND)
+        
+        results = spans.region(rect, contains=mode == 'contains') if rect else spans.nearest(*point, k=k)
+        return Response({'page_num': page.page_num, 'count': len(results), 'results': results})
+    
+    @action(detail=True, methods=['get'], url_path='page-image')
+    def page_image(self, request, pk=None):
+        """
+        获取页面图像
+        参数: page 页码（从1开始）, dpi 渲染分辨率, tile 瓦片坐标"列,行"（可选）,
+              profile 入库时保存的页面图像规格（如review、thumbnail，可选）
+        指定profile时返回入库时保存的该规格图像；PDF页面未指定profile时按需渲染并写入缓存，
+        其他类型返回入库时保存的主规格页面图像；
+        整页像素数超过DOCUMENT_PAGE_RENDER_MAX_PIXELS时返回400及瓦片网格，需按瓦片获取
+        """
+        document = self.get_object()
+        
+        try:
+            page_num = int(request.query_params.get('page', 1))
+            dpi = int(request.query_params.get('dpi', settings.DOCUMENT_PAGE_RENDER_DEFAULT_DPI))
+            tile = request.query_params.get('tile')
+            tile = tuple(int(value) for value in tile.split(',')) if tile else None
+            profile = request.query_params.get('profile')
+            if page_num < 1 or dpi <= 0 or dpi > settings.DOCUMENT_PAGE_RENDER_MAX_DPI or (tile and (len(tile) != 2 or min(tile) < 0)):
+                raise ValueError
+        except ValueError:
+            return Response({'error': '参数无效'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if profile or document.source_type != 'pdf':
+            page = document.pages.filter(page_num=page_num).only('image_path', 'image_variants').first()
+            image_path = self._stored_page_image(page, profile) if page and not tile else None
+            if not image_path:
+                return Response({'error': '页面图像不存在'}, status=status.HTTP_404_NOT_FOUND)
+            response = FileResponse(get_document_storage().open(image_path), content_type=page_image_content_type(image_path))
+            response['Cache-Control'] = 'private, max-age=86400'
+            return response
+        
+        try:
+            image_path = render_page_image(document, page_num, dpi, tile)
+        except IndexError as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+        except PageTooLarge as e:
+            # 附带瓦片网格，查看器据此改为按瓦片获取
+            return self._set_tile_headers(
+                Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST),
+                page_geometry(document, page_num, dpi)
+            )
+        
+        response = serve_file(request, image_path, content_type='image/png')
+        response['Cache-Control'] = 'private, max-age=86400'
+        return self._set_tile_headers(response, page_geometry(document, page_num, dpi))
+    
+    def _set_tile_headers(self, response, geometry):
+        """供查看器计算平移缩放所需的瓦片网格"""
+        response['X-Page-Width'] = geometry['width']
+        response['X-Page-Height'] = geometry['height']
+        response['X-Tile-Size'] = geometry['tile_size']
+        response['X-Tile-Columns'] = geometry['tile_columns']
+        response['X-Tile-Rows'] = geometry['tile_rows']
+        return response
+    
+    def _stored_page_image(self, page, profile=None):
+        """入库时保存的页面图像存储名；未指定规格时为主规格，旧版本入库的页面只有image_path"""
+        if profile:
+            variant = (page.image_variants or {}).get(profile)
+            return variant['name'] if variant else None
+        return page.image_path
+    
     @action(detail=True, methods=['post'])
     def reprocess(self, request, pk=None):
-        """重新处理文档"""
+        """
+        重新处理文档
+        默认只重新处理指纹（源内容、流程版本或处理选项）发生变化的页面，force=true时全部重新处理
+        auto_extract、prompt_template_id与上传时含义相同，预处理完成后重新抽取字段
+        """
+        template_id = self._extract_template_id()
         try:
             document = self.get_object()
+            force = self._flag('force', False)
             
             # 更新文档状态
             document.status = 'pending'
             document.save()
             
             # 重新触发异步处理
-            process_document_async.delay(document.id)
+            build_document_pipeline(document, force, template_id).apply_async()
             
             # 记录日志
             AuditLog.objects.create(
@@ -119,25 +731,57 @@ class DocumentViewSet(viewsets.ModelViewSet):
                 entity_type='Document',
                 entity_id=str(document.id),
                 user=request.user,
-                details={'document_id': str(document.id)}
+                details={'document_id': str(document.id), 'force': force, 'auto_extract_template_id': template_id}
             )
             
             return Response({'status': 'processing'}, status=status.HTTP_200_OK)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        全文检索文档页面
+        参数: q 检索词（空格分隔的多个词需同时命中）, source_type 文档类型（可选）
+        返回按相关度排序的页面命中及高亮摘要，使用page/page_size分页
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': '请提供检索词'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        results = PageSearch(query, source_type=request.query_params.get('source_type'))
+        paginator = SearchPagination()
+        hits = paginator.paginate_queryset(results, request, view=self)
+        return paginator.get_paginated_response(hits)
+    
     @action(detail=False, methods=['get'])
     def stats(self, request):
-        """获取文档统计信息"""
-        stats = {
-            'total': Document.objects.count(),
-            'pending': Document.objects.filter(status='pending').count(),
-            'processing': Document.objects.filter(status='processing').count(),
-            'processed': Document.objects.filter(status='processed').count(),
-            'extracting': Document.objects.filter(status='extracting').count(),
-            'extracted': Document.objects.filter(status='extracted').count(),
-            'failed': Document.objects.filter(status='failed').count(),
-        }
+        """
+        获取文档统计信息
+        参数group_by=source_type|uploaded_by时额外返回按该维度分组的统计
+        开启状态计数表时汇总计数表，否则对文档表做一次分组聚合
+        """
+        group_by = request.query_params.get('group_by')
+        if group_by not in (None, 'source_type', 'uploaded_by'):
+            return Response({'error': 'group_by参数无效'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        dimensions = ['status'] + ([group_by] if group_by else [])
+        if settings.DOCUMENT_STATUS_COUNTERS_ENABLED:
+            rows = DocumentStatusCounter.objects.values(*dimensions).annotate(total=Sum('count'))
+        else:
+            rows = Document.objects.values(*dimensions).annotate(total=Count('id'))
+        rows = list(rows)
+        
+        stats = status_summary(rows)
+        
+        if group_by:
+            groups = {}
+            for row in rows:
+                groups.setdefault(row[group_by], []).append(row)
+            if group_by == 'uploaded_by':
+                usernames = dict(User.objects.filter(id__in=[key for key in groups if key]).values_list('id', 'username'))
+                groups = {usernames.get(key, key) if key else None: value for key, value in groups.items()}
+            stats[f'by_{group_by}'] = {str(key): status_summary(value) for key, value in groups.items()}
         
         return Response(stats)
     
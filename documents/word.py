@@ -0,0 +1,211 @@
+"""
+Word文档流式解析
+从.docx压缩包中流式读取word/document.xml，用增量XML解析器逐段处理，
+处理完的顶层元素立即从树中移除，内存占用不随文档长度增长。
+按显式分页符（及Word上次排版留下的分页标记）划分逻辑页面，
+单页段落数达到上限时也会分页。
+"""
+import zipfile
+from xml.etree.ElementTree import iterparse
+
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+W_BODY = W_NS + 'body'
+W_P = W_NS + 'p'
+W_PPR = W_NS + 'pPr'
+W_TBL = W_NS + 'tbl'
+W_TR = W_NS + 'tr'
+W_TC = W_NS + 'tc'
+W_T = W_NS + 't'
+W_TAB = W_NS + 'tab'
+W_BR = W_NS + 'br'
+W_CR = W_NS + 'cr'
+W_RENDERED_BREAK = W_NS + 'lastRenderedPageBreak'
+W_PAGE_BREAK_BEFORE = W_NS + 'pageBreakBefore'
+W_SECT_PR = W_NS + 'sectPr'
+W_TYPE = W_NS + 'type'
+W_VAL = W_NS + 'val'
+W_STYLE = W_NS + 'pStyle'
+
+# 分页符占位，用于在段落文本中标记分页位置
+PAGE_BREAK = object()
+
+
+class _PageBuilder:
+    """累积当前逻辑页的文本与布局条目"""
+
+    def __init__(self):
+        self.page_num = 0
+        self.lines = []
+        self.layout = []
+        self.blocks = 0
+
+    def add(self, text, entry):
+        self.lines.append(text)
+        self.layout.append(entry)
+        self.blocks += 1
+
+    def append_text(self, text):
+        """将分页符之后的段落剩余文本追加到新页"""
+        self.lines.append(text)
+
+    def take(self):
+        """取出当前页内容，页面为空时返回None"""
+        if not self.lines and not self.layout:
+            return None
+        self.page_num += 1
+        page = (self.page_num, '\n'.join(self.lines) + '\n', self.layout)
+        self.lines, self.layout, self.blocks = [], [], 0
+        return page
+
+
+def _paragraph_segments(paragraph, use_rendered_breaks):
+    """按分页符切分段落文本，返回文本片段列表（相邻片段之间有一个分页符）"""
+    segments = [[]]
+    for child in paragraph:
+        if child.tag == W_PPR:
+            continue
+        for node in child.iter():
+            tag = node.tag
+            if tag == W_T:
+                segments[-1].append(node.text or '')
+            elif tag == W_TAB:
+                segments[-1].append('\t')
+            elif tag == W_CR:
+                segments[-1].append('\n')
+            elif tag == W_BR:
+                if node.get(W_TYPE) == 'page':
+                    segments.append([])
+                else:
+                    segments[-1].append('\n')
+            elif tag == W_RENDERED_BREAK and use_rendered_breaks:
+                segments.append([])
+    return [''.join(parts) for parts in segments]
+
+
+def _paragraph_text(paragraph):
+    return ''.join(_paragraph_segments(paragraph, False))
+
+
+def _table_rows(table):
+    """提取表格各行各单元格的文本（嵌套表格的文本并入所在单元格）"""
+    rows = []
+    for row in table.iter(W_TR):
+        cells = []
+        for cell in row:
+            if cell.tag != W_TC:
+                continue
+            cells.append('\n'.join(_paragraph_text(p) for p in cell.iter(W_P)))
+        rows.append(cells)
+    return rows
+
+
+def iter_word_pages(path, paragraphs_per_page, use_rendered_breaks=True):
+    """
+    流式解析.docx文件，逐页产出(page_num, text, layout)
+    layout为段落/表格级别的条目列表:
+    {'type': 'paragraph', 'index', 'style', 'text'} 或 {'type': 'table', 'index', 'rows', 'text'}
+    """
+    if not zipfile.is_zipfile(path):
+        raise ValueError("仅支持.docx格式的Word文档，旧版.doc请先转换为.docx")
+
+    builder = _PageBuilder()
+    block_index = 0
+    body = None
+    stack = []
+    paragraph_depth = 0
+    table_depth = 0
+
+    with zipfile.ZipFile(path) as archive, archive.open('word/document.xml') as stream:
+        for event, elem in iterparse(stream, events=('start', 'end')):
+            tag = elem.tag
+            if event == 'start':
+                stack.append(elem)
+                if tag == W_BODY:
+                    body = elem
+                elif tag == W_P:
+                    paragraph_depth += 1
+                elif tag == W_TBL:
+                    table_depth += 1
+                continue
+
+            stack.pop()
+            parent = stack[-1] if stack else None
+
+            if tag == W_P:
+                paragraph_depth -= 1
+                # 只处理表格外的最外层段落（文本框中的段落并入所在段落）
+                if paragraph_depth == 0 and table_depth == 0:
+                    ppr = elem.find(W_PPR)
+                    style = ppr.find(W_STYLE) if ppr is not None else None
+                    break_before = ppr is not None and ppr.find(W_PAGE_BREAK_BEFORE) is not None
+                    section = ppr.find(W_SECT_PR) if ppr is not None else None
+                    break_after = section is not None and (
+                        section.find(W_TYPE) is None or section.find(W_TYPE).get(W_VAL) != 'continuous'
+                    )
+
+                    if break_before or builder.blocks >= paragraphs_per_page:
+                        page = builder.take()
+                        if page:
+                            yield page
+
+                    segments = _paragraph_segments(elem, use_rendered_breaks)
+                    entry = {
+                        'type': 'paragraph',
+                        'index': block_index,
+                        'style': style.get(W_VAL) if style is not None else None,
+                        'text': ''.join(segments),
+                    }
+                    block_index += 1
+
+                    # 分页符两侧的空片段不产生内容：连续的分页符（如硬分页符后紧跟排版分页标记）只分一次页，
+                    # 段落开头的分页符先分页再写入，布局条目跟随段落首段文本所在的页
+                    pending_break = False
+                    for position, segment in enumerate(segments):
+                        pending_break = pending_break or position > 0
+                        if not segment:
+                            continue
+                        if pending_break:
+                            page = builder.take()
+                            if page:
+                                yield page
+                            pending_break = False
+                        if entry is not None:
+                            builder.add(segment, entry)
+                            entry = None
+                        else:
+                            builder.append_text(segment)
+
+                    if entry is not None:
+                        # 空段落（或只含分页符的段落）保留在分页符之前的页
+                        builder.add('', entry)
+
+                    if pending_break or break_after:
+                        page = builder.take()
+                        if page:
+                            yield page
+
+            elif tag == W_TBL:
+                table_depth -= 1
+                if table_depth == 0 and paragraph_depth == 0:
+                    if builder.blocks >= paragraphs_per_page:
+                        page = builder.take()
+                        if page:
+                            yield page
+
+                    rows = _table_rows(elem)
+                    text = '\n'.join('\t'.join(cells) for cells in rows)
+                    builder.add(text, {
+                        'type': 'table',
+                        'index': block_index,
+                        'rows': rows,
+                        'text': text,
+                    })
+                    block_index += 1
+
+            # 顶层元素处理完后立即从树中移除，保持内存平稳
+            if parent is body and body is not None:
+                body.remove(elem)
+
+    page = builder.take()
+    if page:
+        yield page
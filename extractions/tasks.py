@@ -7,8 +7,10 @@ from datetime import datetime
 
 from extractions.models import ExtractionResult, FieldDefinition
 from documents.models import Document, DocumentPage
+from documents.progress import publish_document_event
 from prompts.models import PromptTemplate
 from audit.models import AuditLog, SystemLog
+from audit.tasks import enqueue_audit_logs
 
 logger = get_task_logger(__name__)
 
@@ -39,15 +41,17 @@ def extract_fields(document_id, prompt_template_id=None):
                 raise ValueError("未找到可用的Prompt模板")
         
         # 获取所有字段定义
-        field_definitions = FieldDefinition.objects.filter().order_by('ui_order')
+        field_definitions = list(FieldDefinition.objects.filter().order_by('ui_order'))
+        publish_document_event(document, 'status', status=document.status, fields=len(field_definitions))
         
-        # 获取文档所有页面文本
-        document_pages = DocumentPage.objects.filter(document=document).order_by('page_num')
+        # 获取文档所有页面，各字段共用同一批页面对象及其片段索引
+        document_pages = list(DocumentPage.objects.filter(document=document).order_by('page_num'))
         
         # 抽取结果
         results = []
+        audit_records = []
         
-        for field_def in field_definitions:
+        for done, field_def in enumerate(field_definitions, 1):
             try:
                 # 组合Prompt
                 prompt = compose_prompt(field_def, prompt_template, document_pages)
@@ -71,19 +75,22 @@ def extract_fields(document_id, prompt_template_id=None):
                     )
                     results.append(result)
                 
-                # 记录审计日志
-                AuditLog.objects.create(
-                    action=AuditLog.ACTION_EXTRACT,
-                    entity_type='ExtractionResult',
-                    entity_id=str(result.id),
-                    details={
+                # 审计日志汇总后交给audit队列批量写入
+                audit_records.append({
+                    'action': AuditLog.ACTION_EXTRACT,
+                    'entity_type': 'ExtractionResult',
+                    'entity_id': str(result.id),
+                    'details': {
                         'document_id': str(document.id),
                         'field_key': field_def.key,
                         'value': extraction_result['value'],
                         'confidence': extraction_result['confidence']
                     },
-                    prompt_text=prompt,
-                    model_response=json.dumps(extraction_result)
+                    'prompt_text': prompt,
+                    'model_response': json.dumps(extraction_result)
+                })
+                publish_document_event(
+                    document, 'field', field_key=field_def.key, done=done, total=len(field_definitions), success=True
                 )
                 
             except Exception as e:
@@ -94,10 +101,18 @@ def extract_fields(document_id, prompt_template_id=None):
                     source='field_extraction',
                     context={'document_id': str(document.id), 'field_key': field_def.key, 'error': str(e)}
                 )
+                publish_document_event(
+                    document, 'field', field_key=field_def.key, done=done, total=len(field_definitions),
+                    success=False, error=str(e)
+                )
+        
+        if audit_records:
+            enqueue_audit_logs(audit_records)
         
         # 更新文档状态
         document.status = 'extracted'
         document.save()
+        publish_document_event(document, 'status', status=document.status, extracted_fields=len(results))
         
         logger.info(f"文档字段抽取完成: {document.filename}, 抽取字段数: {len(results)}")
         
@@ -114,6 +129,8 @@ def extract_fields(document_id, prompt_template_id=None):
         if 'document' in locals():
             document.status = 'failed'
             document.save()
+            publish_document_event(document, 'error', stage='extraction', error=str(e))
+            publish_document_event(document, 'status', status=document.status)
         
         SystemLog.objects.create(
             level=SystemLog.LEVEL_ERROR,
@@ -192,7 +209,6 @@ def call_extraction_model(prompt, field_def, document_pages):
         for pattern in patterns:
             if pattern in all_text:
                 # 简单提取公司名称（实际需要更复杂的逻辑）
-                import re
                 match = re.search(r'([\u4e00-\u9fa5]+)' + re.escape(pattern), all_text)
                 if match:
                     value = match.group(1) + pattern
@@ -243,6 +259,8 @@ def call_extraction_model(prompt, field_def, document_pages):
     if not value:
         value = ""
         confidence = 0.0
+    else:
+        page_num, bbox = locate_value(document_pages, value, default_page=page_num)
     
     return {
         'value': value,
@@ -251,6 +269,17 @@ def call_extraction_model(prompt, field_def, document_pages):
         'bbox': bbox
     }
 
+def locate_value(document_pages, value, default_page=1):
+    """
+    定位抽取值所在的页码和包围盒
+    在文本包含该值的首个页面上，通过页面片段空间索引查找对应片段
+    """
+    for page in document_pages:
+        if value in page.text:
+            spans = page.spans()
+            return page.page_num, spans.locate(value) if spans else None
+    return default_page, None
+
 def normalize_value(value, field_def):
     """标准化字段值"""
     if not value: